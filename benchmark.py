@@ -0,0 +1,1791 @@
+import argparse
+import contextlib
+import csv
+import io
+import os
+import random
+import statistics
+import string
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+def random_barcode(length=13):
+    return ''.join(random.choices(string.digits, k=length))
+
+
+# Write a synthetic day file with the same layout scanner.py produces
+def make_day_csv(filepath, rows, line_name="BenchLine", spread=False):
+    with open(filepath, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["ProductionLineName", "Time Scanned", "Barcode"])
+        day = datetime.now().strftime('%Y-%m-%d')
+        stamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        for n in range(rows):
+            if spread:
+                # Scan times spread over the whole day to exercise every segment
+                second = random.randrange(86400)
+                stamp = f"{day} {second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}"
+            writer.writerow([line_name, stamp, f"{n:013d}"])
+
+
+def time_per_call(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls
+
+
+def legacy_is_unique(filepath, barcode):
+    """The original per-scan check: re-read the whole day file with pandas."""
+    df = pd.read_csv(filepath, sep=',')
+    return barcode not in df['Barcode'].astype(str).unique().tolist()
+
+
+def bench_dedup(args):
+    """Compare per-scan dedup cost of the CSV re-read against the in-memory index."""
+    import scanner
+
+    print(f"{'rows':>10} {'legacy ms/scan':>16} {'index us/scan':>15} {'warm ms':>10}")
+    with tempfile.TemporaryDirectory() as folder:
+        for rows in args.rows:
+            day = datetime.now().strftime('%Y-%m-%d')
+            filepath = os.path.join(folder, f"{day}_BenchLine.csv")
+            make_day_csv(filepath, rows)
+
+            legacy = time_per_call(lambda: legacy_is_unique(filepath, random_barcode()), args.legacy_calls)
+
+            index = scanner.BarcodeIndex("BenchLine", folder_path=folder + os.sep)
+            warm_start = time.perf_counter()
+            index.warm()
+            warm = time.perf_counter() - warm_start
+            assert len(index) == rows
+            probe = random_barcode()
+            indexed = time_per_call(lambda: probe in index, args.calls)
+
+            print(f"{rows:>10} {legacy * 1e3:>16.2f} {indexed * 1e6:>15.2f} {warm * 1e3:>10.1f}")
+
+
+def open_pty_port(timeout=1):
+    """Create a pseudo-terminal pair and open its slave end like a USB scanner port."""
+    import serial
+
+    master, slave = os.openpty()
+    port = serial.Serial(os.ttyname(slave), 9600, timeout=timeout)
+    return master, slave, port
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def legacy_read_scans(port, framer):
+    """The original reader: one byte per read() followed by a 50 ms sleep."""
+    data = port.read()
+    time.sleep(0.05)
+    return framer.feed(data) if data else []
+
+
+def make_scanner_line(folder, name="BenchLine", terminator="cr", publisher=None):
+    """A ScannerLine writing its day file under `folder` instead of data/."""
+    import scanner
+    from utils import ConfigObject
+
+    scanner.FOLDER_PATH = folder
+    line = scanner.ScannerLine(ConfigObject({
+        "name": name,
+        "header": ["ProductionLineName", "Time Scanned", "Barcode"],
+        "port": None,
+        "baudrate": 9600,
+        "terminator": terminator,
+        "read_mode": "waiting",
+        "lookback_days": 0,
+    }), publisher)
+    with contextlib.redirect_stdout(io.StringIO()):
+        line.check_date()
+    return line
+
+
+def run_serial_mode(mode, scans, folder, terminator):
+    import scanner
+
+    master, slave, port = open_pty_port()
+    line = make_scanner_line(folder, f"Bench-{mode}", terminator)
+    framer = line.framer
+    barcodes = [f"{n:013d}" for n in range(scans)]
+    sent = {}
+    latencies = []
+    end = scanner.TERMINATORS[terminator][0]
+
+    def write_scans():
+        for barcode in barcodes:
+            sent[barcode] = time.perf_counter()
+            os.write(master, barcode.encode() + end)
+
+    writer = threading.Thread(target=write_scans)
+    start = time.perf_counter()
+    writer.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        while len(latencies) < scans:
+            if mode == "legacy":
+                framed = legacy_read_scans(port, framer)
+            else:
+                framed = scanner.read_scans(port, framer, mode)
+            for barcode in framed:
+                line.process_scan(barcode)
+                latencies.append(time.perf_counter() - sent[scanner.clean_barcode(barcode)])
+    elapsed = time.perf_counter() - start
+    writer.join()
+    port.close()
+    os.close(master)
+    os.close(slave)
+    return scans / elapsed, latencies
+
+
+def bench_serial(args):
+    """Scans/second and scan-to-commit latency of the serial readers over a pty loopback."""
+    print(f"{'mode':>12} {'scans':>7} {'scans/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    with tempfile.TemporaryDirectory() as folder:
+        folder += os.sep
+        for mode in args.modes:
+            scans = args.legacy_scans if mode == "legacy" else args.scans
+            rate, latencies = run_serial_mode(mode, scans, folder, args.terminator)
+            print(f"{mode:>12} {scans:>7} {rate:>10.1f} "
+                  f"{statistics.median(latencies) * 1e3:>9.2f} {percentile(latencies, 99) * 1e3:>9.2f}")
+
+
+def legacy_count(filepath):
+    """The original /data path: materialize every row with csv.DictReader to count them."""
+    with open(filepath, newline='', encoding='utf-8') as file:
+        return len(list(csv.DictReader(file)))
+
+
+def bench_counter(args):
+    """Cost of one dashboard refresh (one new scan, N viewers) vs rows in the day file."""
+    from utils import CsvTail
+
+    print(f"{'rows':>10} {'viewers':>8} {'legacy ms':>10} {'tail ms':>9}")
+    with tempfile.TemporaryDirectory() as folder:
+        for rows in args.rows:
+            filepath = os.path.join(folder, f"{rows}.csv")
+            make_day_csv(filepath, rows)
+            tail = CsvTail()
+            count = len(tail.read_new_rows(filepath)[0])
+
+            def refresh(counter):
+                with open(filepath, 'a', newline='') as file:
+                    csv.writer(file).writerow(["BenchLine", "2024-01-01 08:00:00", random_barcode()])
+                for _ in range(args.viewers):
+                    counter()
+
+            legacy = time_per_call(lambda: refresh(lambda: legacy_count(filepath)), args.refreshes)
+
+            def tail_count():
+                nonlocal count
+                count += len(tail.read_new_rows(filepath)[0])
+
+            incremental = time_per_call(lambda: refresh(tail_count), args.refreshes)
+            assert count == legacy_count(filepath)
+            print(f"{rows:>10} {args.viewers:>8} {legacy * 1e3:>10.2f} {incremental * 1e3:>9.3f}")
+
+
+def legacy_visual_counts(filepath, segments):
+    """The original /visual path: pandas re-read plus iterrows over every segment."""
+    segment_bounds = [(datetime.strptime(seg["start"], "%H:%M").time(),
+                       datetime.strptime(seg["end"], "%H:%M").time()) for seg in segments]
+    actual_counts = [0] * len(segments)
+    df = pd.read_csv(filepath)
+    df['Time Scanned'] = pd.to_datetime(df['Time Scanned'])
+    df = df[df['Time Scanned'].dt.date == datetime.now().date()]
+    for _, row in df.iterrows():
+        scanned_time = row['Time Scanned'].time()
+        for idx, (start, end) in enumerate(segment_bounds):
+            if start <= end:
+                if start <= scanned_time <= end:
+                    actual_counts[idx] += 1
+                    break
+            elif scanned_time >= start or scanned_time <= end:
+                actual_counts[idx] += 1
+                break
+    return actual_counts
+
+
+def bench_visual(args):
+    """Segment bucketing: legacy iterrows vs vectorized full rebuild vs incremental update."""
+    from utils import load_config
+    import webapp
+
+    segments = list(load_config().time_segments) + [{"start": "22:00", "end": "06:00", "target": 0}]
+    schedule = webapp.get_segment_schedule(segments)
+    print(f"{'rows':>10} {'legacy s':>10} {'rebuild ms':>11} {'update ms':>10}")
+    with tempfile.TemporaryDirectory() as folder:
+        for rows in args.rows:
+            filepath = os.path.join(folder, f"{rows}.csv")
+            make_day_csv(filepath, rows, spread=True)
+
+            legacy = "-"
+            if rows <= args.legacy_max:
+                start = time.perf_counter()
+                expected = legacy_visual_counts(filepath, segments)
+                legacy = f"{time.perf_counter() - start:.2f}"
+
+            counter = webapp.SegmentCounter()
+            start = time.perf_counter()
+            counts = counter.counts("BenchLine", filepath, schedule)
+            rebuild = time.perf_counter() - start
+            if legacy != "-":
+                assert counts == expected, (counts, expected)
+
+            def update():
+                with open(filepath, 'a', newline='') as file:
+                    csv.writer(file).writerow(["BenchLine", datetime.now().strftime('%Y-%m-%d %H:%M:%S'), random_barcode()])
+                counter.counts("BenchLine", filepath, schedule)
+
+            incremental = time_per_call(update, args.updates)
+            print(f"{rows:>10} {legacy:>10} {rebuild * 1e3:>11.1f} {incremental * 1e3:>10.3f}")
+
+
+def bench_pace(args):
+    """/api/pace: schedule compile time, first call on a full day file, then cost per new scan."""
+    from utils import load_config
+    import webapp
+
+    segments = list(load_config().time_segments) + [{"start": "22:00", "end": "06:00", "target": 0}]
+    compile_ms = time_per_call(lambda: webapp.SegmentSchedule(segments), 50) * 1e3
+    schedule = webapp.SegmentSchedule(segments)
+    seconds = np.random.randint(0, 86400, 1000000)
+    bucket_ms = time_per_call(lambda: schedule.bucket(seconds), 5) * 1e3
+    print(f"compile {compile_ms:.2f} ms, bucket 1M scans {bucket_ms:.1f} ms")
+    print(f"{'rows':>10} {'first ms':>9} {'update ms':>10}")
+    with sandbox_cwd():
+        os.makedirs("data", exist_ok=True)
+        for rows in args.rows:
+            webapp.segment_counter = webapp.SegmentCounter()
+            filepath = webapp.get_current_file_path()
+            make_day_csv(filepath, rows, line_name=webapp.get_line_settings()[0], spread=True)
+            start = time.perf_counter()
+            webapp.compute_pace()
+            first = time.perf_counter() - start
+
+            def update():
+                append_scan(filepath, webapp.get_line_settings()[0])
+                webapp.compute_pace()
+
+            print(f"{rows:>10} {first * 1e3:>9.1f} {time_per_call(update, args.updates) * 1e3:>10.3f}")
+
+
+@contextlib.contextmanager
+def sandbox_cwd():
+    """Run inside a scratch folder holding a copy of config.yaml, so data/ writes stay out of the repo."""
+    import shutil
+
+    origin = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        shutil.copy(os.path.join(origin, "config.yaml"), folder)
+        os.chdir(folder)
+        try:
+            yield folder
+        finally:
+            os.chdir(origin)
+
+
+def start_test_server(app):
+    """Serve a Flask app from a background thread on a free local port."""
+    import logging
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class SSEClient(threading.Thread):
+    """Minimal EventSource: records the arrival time of every data event, the bytes read and the last event ID."""
+
+    def __init__(self, port, path, headers=None):
+        super().__init__(daemon=True)
+        self.port = port
+        self.path = path
+        self.headers = headers or {}
+        self.events = []
+        self.bytes = 0
+        self.last_id = None
+        self.connected = threading.Event()
+        self.sock = None
+
+    def run(self):
+        import http.client
+
+        conn = http.client.HTTPConnection("127.0.0.1", self.port)
+        conn.request("GET", self.path, headers=self.headers)
+        self.sock = conn.sock  # getresponse() detaches it from the connection for a streamed reply
+        response = conn.getresponse()
+        self.connected.set()
+        try:
+            while True:
+                line = response.fp.readline()
+                if not line:
+                    break
+                self.bytes += len(line)
+                if line.startswith(b"id:"):
+                    self.last_id = line[3:].strip().decode()
+                elif line.startswith(b"data:"):
+                    self.events.append((time.perf_counter(), line))
+        except (OSError, ValueError, AttributeError):
+            pass  # Closed by stop()
+
+    def stop(self):
+        import socket
+
+        if self.sock is not None:
+            self.sock.shutdown(socket.SHUT_RDWR)
+            self.sock.close()  # So the server's next write fails and it drops the subscription
+
+
+def append_scan(filepath, line_name):
+    with open(filepath, 'a', newline='') as file:
+        csv.writer(file).writerow([line_name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), random_barcode()])
+
+
+def bench_sse(args):
+    """Server CPU and push latency per scan as the number of SSE subscribers grows."""
+    import resource
+
+    def cpu_seconds():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    with sandbox_cwd():
+        import webapp
+
+        server = start_test_server(webapp.app)
+        filepath = webapp.get_current_file_path()
+        os.makedirs(webapp.FOLDER_PATH, exist_ok=True)
+        make_day_csv(filepath, args.rows, webapp.get_line_settings()[0])
+
+        print(f"{'clients':>8} {'cpu ms/scan':>12} {'p50 ms':>8} {'p99 ms':>8}")
+        for clients in args.clients:
+            readers = [SSEClient(server.port, path) for path in ("/stream", "/visual-stream") for _ in range(clients // 2 or 1)]
+            for reader in readers:
+                reader.start()
+                reader.connected.wait()
+            time.sleep(1)
+
+            sent = []
+            cpu_start = cpu_seconds()
+            for _ in range(args.scans):
+                sent.append(time.perf_counter())
+                append_scan(filepath, webapp.get_line_settings()[0])
+                time.sleep(args.interval)
+            time.sleep(1)
+            cpu = (cpu_seconds() - cpu_start) / args.scans
+
+            latencies = []
+            for reader in readers:
+                # Skip the initial snapshot, then pair each update with the scan that caused it
+                for sent_at, (received_at, _) in zip(sent, reader.events[1:]):
+                    latencies.append(received_at - sent_at)
+            if latencies:
+                print(f"{len(readers):>8} {cpu * 1e3:>12.2f} "
+                      f"{statistics.median(latencies) * 1e3:>8.1f} {percentile(latencies, 99) * 1e3:>8.1f}")
+            for reader in readers:
+                reader.stop()
+            time.sleep(0.5)
+        server.shutdown()
+
+
+def bench_delta(args):
+    """SSE bytes per scan with full snapshots vs deltas, reconnect cost, and /data revalidation."""
+    import http.client
+    import hub
+
+    refreshes = [0]
+    original_refresh = hub.Topic.refresh
+
+    def counted_refresh(topic):
+        refreshes[0] += 1
+        original_refresh(topic)
+
+    hub.Topic.refresh = counted_refresh
+    with sandbox_cwd():
+        # Hourly segments around the clock, so every scan lands in one and changes /visual-stream
+        set_config(time_segments=[{"start": f"{hour:02d}:00", "end": f"{hour + 1:02d}:00" if hour < 23 else "23:59",
+                                   "target": 20} for hour in range(24)])
+        import webapp
+
+        server = start_test_server(webapp.app)
+        filepath = webapp.get_current_file_path()
+        os.makedirs(webapp.FOLDER_PATH, exist_ok=True)
+        make_day_csv(filepath, args.rows, webapp.get_line_settings()[0])
+
+        # SNAPSHOT_EVERY = 0 sends the full state on every change, as before deltas
+        print(f"{'mode':>9} {'path':>14} {'bytes/event':>12} {'events':>7}")
+        for mode, snapshot_every in (("snapshot", 0), ("delta", hub.SNAPSHOT_EVERY)):
+            hub.SNAPSHOT_EVERY = snapshot_every
+            for path in ("/stream", "/visual-stream"):
+                client = SSEClient(server.port, path)
+                client.start()
+                client.connected.wait()
+                time.sleep(0.5)
+                start_bytes, start_events = client.bytes, len(client.events)
+                for _ in range(args.scans):
+                    append_scan(filepath, webapp.get_line_settings()[0])
+                    time.sleep(args.interval)
+                time.sleep(1)
+                events = len(client.events) - start_events
+                print(f"{mode:>9} {path:>14} {(client.bytes - start_bytes) / max(events, 1):>12.0f} {events:>7}")
+                client.stop()
+        hub.SNAPSHOT_EVERY = 50
+
+        # A wallboard drops off the Wi-Fi, misses a few scans and reconnects
+        print(f"\n{'reconnect':>9} {'bytes':>7} {'recomputes':>11}")
+        for mode in ("legacy", "resume"):
+            hub.TOPIC_LINGER = 0 if mode == "legacy" else 60
+            client = SSEClient(server.port, "/visual-stream")
+            client.start()
+            client.connected.wait()
+            time.sleep(0.5)
+            last_id = client.last_id
+            client.stop()
+            for _ in range(args.missed):
+                append_scan(filepath, webapp.get_line_settings()[0])
+                time.sleep(args.interval)
+            time.sleep(2.5)  # Lets the hub refresh (or, for legacy, expire) the topic
+            headers = {"Last-Event-ID": last_id} if mode == "resume" else {}
+            refreshes[0] = 0
+            client = SSEClient(server.port, "/visual-stream", headers)
+            client.start()
+            client.connected.wait()
+            time.sleep(0.5)
+            print(f"{mode:>9} {client.bytes:>7} {refreshes[0]:>11}")
+            client.stop()
+
+        conn = http.client.HTTPConnection("127.0.0.1", server.port)
+        print(f"\n{'/data':>9} {'bytes':>7} {'ms/request':>11}")
+        etag = None
+        for mode in ("full", "304"):
+            headers = {"If-None-Match": etag} if mode == "304" else {}
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                conn.request("GET", "/data", headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+                etag = response.getheader("ETag")
+            elapsed = (time.perf_counter() - started) / args.requests
+            print(f"{mode:>9} {len(body):>7} {elapsed * 1e3:>11.2f}")
+        conn.close()
+        server.shutdown()
+
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=20):
+    import socket
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server did not start on port {port}")
+
+
+def rss_kb(pid):
+    """Resident memory of a process and its children (the dev server's reloader forks one)."""
+    total = 0
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                total += int(line.split()[1])
+    with open(f"/proc/{pid}/task/{pid}/children") as children:
+        for child in children.read().split():
+            total += rss_kb(int(child))
+    return total
+
+
+def set_config(**sections):
+    """Update top-level sections of config.yaml in the current directory."""
+    import yaml
+
+    with open("config.yaml") as file:
+        data = yaml.safe_load(file)
+    data.update(sections)
+    with open("config.yaml", "w") as file:
+        yaml.dump(data, file, default_flow_style=False)
+
+
+def open_sse_sockets(port, path, count):
+    """Open `count` raw SSE connections without a thread per client."""
+    import selectors
+    import socket
+
+    selector = selectors.DefaultSelector()
+    for _ in range(count):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n".encode())
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+    return selector
+
+
+def wait_for_events(selector, count, timeout):
+    """Return arrival times of the first data event on each of `count` sockets."""
+    arrivals = {}
+    deadline = time.time() + timeout
+    while len(arrivals) < count and time.time() < deadline:
+        for key, _ in selector.select(timeout=0.5):
+            try:
+                chunk = key.fileobj.recv(65536)
+            except BlockingIOError:
+                continue
+            if b"data:" in chunk and key.fileobj not in arrivals:
+                arrivals[key.fileobj] = time.perf_counter()
+    return list(arrivals.values())
+
+
+def wait_for_sse_clients(port, count, timeout=30):
+    """Wait until the web app reports `count` connected SSE clients on /healthz."""
+    import json
+    import urllib.error
+    import urllib.request
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            response = urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=3)
+        except urllib.error.HTTPError as e:
+            response = e
+        if json.load(response)["webapp"]["sse_clients"] == count:
+            return
+        time.sleep(0.5)
+    raise RuntimeError(f"web app still has SSE clients other than {count} after {timeout}s")
+
+
+def bench_serve(args):
+    """Memory and push latency of each serving mode as concurrent SSE clients grow."""
+    import importlib.util
+    import subprocess
+    import sys
+
+    import urllib.error
+    import urllib.request
+
+    def healthz_ms(port):
+        """Time main.py's probe takes with the streams open, or None if it would fail (PROBE_TIMEOUT 3 s)."""
+        started = time.perf_counter()
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=3).close()
+        except urllib.error.HTTPError:
+            pass
+        except OSError:
+            return None
+        return (time.perf_counter() - started) * 1e3
+
+    print(f"{'mode':>9} {'clients':>8} {'connected':>10} {'rss MB':>8} {'p50 ms':>8} {'p99 ms':>8} {'healthz':>8}")
+    for mode in args.modes:
+        if mode == "waitress" and importlib.util.find_spec("waitress") is None:
+            # webapp.py would fall back to the threaded server and be measured under the wrong name
+            print(f"{mode:>9} skipped: waitress is not installed (pip install -r requirements.txt)")
+            continue
+        with sandbox_cwd():
+            port = free_port()
+            set_config(server={"host": "127.0.0.1", "port": port, "mode": mode,
+                               "threads": args.threads or max(args.clients) + 8})
+            os.makedirs("data", exist_ok=True)
+            from utils import load_config
+            line_name = load_config().name
+            filepath = f"data/{datetime.now().strftime('%Y-%m-%d')}_{line_name}.csv"
+            make_day_csv(filepath, 1000, line_name)
+            server = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "webapp.py")],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_for_port(port)
+                for clients in args.clients:
+                    selector = open_sse_sockets(port, "/stream", clients)
+                    connected = len(wait_for_events(selector, clients, timeout=10))  # Initial snapshot
+                    time.sleep(0.5)
+                    sent = time.perf_counter()
+                    append_scan(filepath, line_name)
+                    latencies = [arrival - sent for arrival in wait_for_events(selector, clients, timeout=10)]
+                    rss = rss_kb(server.pid) / 1024
+                    probe = healthz_ms(port)
+                    probe = f"{probe:>8.1f}" if probe is not None else f"{'timeout':>8}"
+                    if latencies:
+                        print(f"{mode:>9} {clients:>8} {connected:>10} {rss:>8.1f} "
+                              f"{statistics.median(latencies) * 1e3:>8.1f} {percentile(latencies, 99) * 1e3:>8.1f} "
+                              f"{probe}")
+                    else:
+                        print(f"{mode:>9} {clients:>8} {connected:>10} {rss:>8.1f} {'-':>8} {'-':>8} {probe}")
+                    for key in list(selector.get_map().values()):
+                        key.fileobj.close()
+                    selector.close()
+                    # A closed stream counts against max_streams until the server notices the client is gone
+                    wait_for_sse_clients(port, 0)
+            finally:
+                server.terminate()
+                server.wait()
+
+
+def bench_push(args):
+    """Scan-to-screen latency: file watcher alone vs the scanner pushing events over the IPC socket."""
+    import hub
+    import ipc
+
+    print(f"{'watcher':>9} {'ipc':>5} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    with sandbox_cwd() as folder:
+        import webapp
+
+        server = start_test_server(webapp.app)
+        socket_path = os.path.join(folder, "scan_events.sock")
+        for use_inotify in (False, True):
+            for use_ipc in (False, True):
+                webapp.change_hub = hub.ChangeHub(webapp.FOLDER_PATH, use_inotify=use_inotify)
+                listener = publisher = None
+                if use_ipc:
+                    listener = ipc.ScanListener(socket_path, webapp.on_scan_event)
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        listener.start()
+                    publisher = ipc.ScanPublisher(socket_path)
+                line = make_scanner_line(webapp.FOLDER_PATH, webapp.get_line_settings()[0], publisher=publisher)
+
+                with contextlib.redirect_stdout(io.StringIO()):
+                    client = SSEClient(server.port, "/stream")
+                    client.start()
+                    client.connected.wait()
+                    time.sleep(1)
+                    latencies = []
+                    for _ in range(args.scans):
+                        seen = len(client.events)
+                        sent = time.perf_counter()
+                        line.process_scan(random_barcode())
+                        while len(client.events) == seen:
+                            time.sleep(0.0005)
+                        latencies.append(client.events[-1][0] - sent)
+                        time.sleep(random.uniform(0, args.interval))
+                client.stop()
+                if listener is not None:
+                    listener.close()
+                    publisher.close()
+                watcher = "inotify" if use_inotify else "polling"
+                print(f"{watcher:>9} {'yes' if use_ipc else 'no':>5} {statistics.median(latencies) * 1e3:>8.1f} "
+                      f"{percentile(latencies, 99) * 1e3:>8.1f} {max(latencies) * 1e3:>8.1f}")
+        server.shutdown()
+
+
+def legacy_append(filepath, row):
+    """The original write path: open, append and close the day file per scan, no fsync."""
+    with open(filepath, 'a', newline='') as file:
+        csv.writer(file).writerow(row)
+
+
+def bench_store(args):
+    """Sustained append throughput per fsync policy, plus a torn-row recovery check."""
+    import store
+
+    header = ["ProductionLineName", "Time Scanned", "Barcode"]
+    row = ["BenchLine", datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "0000000000000"]
+    print(f"{'writer':>16} {'rows/s':>10} {'us/row':>9}")
+    with tempfile.TemporaryDirectory() as folder:
+        filepath = os.path.join(folder, "legacy.csv")
+        per_row = time_per_call(lambda: legacy_append(filepath, row), args.rows)
+        print(f"{'legacy':>16} {1 / per_row:>10.0f} {per_row * 1e6:>9.1f}")
+
+        for policy in store.FSYNC_POLICIES:
+            day_store = store.DayFileStore(header, fsync=policy, batch_size=args.batch_size)
+            day_store.open(os.path.join(folder, f"{policy}.csv"))
+            rows = args.rows if policy != "always" else min(args.rows, args.always_rows)
+            per_row = time_per_call(lambda: day_store.append(row), rows)
+            day_store.close()
+            print(f"{'store/' + policy:>16} {1 / per_row:>10.0f} {per_row * 1e6:>9.1f}")
+
+        # Simulate a power cut in the middle of a row and reopen
+        filepath = os.path.join(folder, "torn.csv")
+        day_store = store.DayFileStore(header)
+        day_store.open(filepath)
+        day_store.append(row)
+        day_store.close()
+        with open(filepath, 'ab') as file:
+            file.write(b"BenchLine,2024-01-01 08:0")
+        with contextlib.redirect_stdout(io.StringIO()):
+            day_store.open(filepath)
+        day_store.append(row)
+        day_store.close()
+        with open(filepath, newline='') as file:
+            rows = list(csv.reader(file))
+        assert rows == [header, row, row], rows
+        print("torn row recovery: ok")
+
+
+def bench_history(args):
+    """/api/history over N days of day files: cold index build, warm query, and the old re-parse."""
+    from datetime import timedelta
+
+    with sandbox_cwd():
+        import webapp
+
+        os.makedirs(webapp.FOLDER_PATH, exist_ok=True)
+        line_name = webapp.get_line_settings()[0]
+        today = datetime.now().date()
+        for n in range(args.days):
+            day = (today - timedelta(days=n)).strftime('%Y-%m-%d')
+            make_day_csv(f"{webapp.FOLDER_PATH}{day}_{line_name}.csv", args.rows, line_name, spread=True)
+        start = (today - timedelta(days=args.days - 1)).strftime('%Y-%m-%d')
+        url = f"/api/history?start={start}&end={today.strftime('%Y-%m-%d')}"
+        client = webapp.app.test_client()
+
+        began = time.perf_counter()
+        for name in os.listdir(webapp.FOLDER_PATH):
+            df = pd.read_csv(os.path.join(webapp.FOLDER_PATH, name))
+            pd.to_datetime(df['Time Scanned']).dt.hour.value_counts()
+        reparse = time.perf_counter() - began
+
+        began = time.perf_counter()
+        total = client.get(url).json["total"]
+        cold = time.perf_counter() - began
+        assert total == args.days * args.rows
+
+        warm = time_per_call(lambda: client.get(url), args.queries)
+        append_scan(webapp.get_current_file_path(), webapp.get_line_settings()[0])
+        began = time.perf_counter()
+        assert client.get(url).json["total"] == total + 1
+        grown = time.perf_counter() - began
+
+        print(f"{args.days} days x {args.rows} rows")
+        print(f"{'re-parse every file':>28} {reparse * 1e3:>10.1f} ms")
+        print(f"{'cold index build':>28} {cold * 1e3:>10.1f} ms")
+        print(f"{'warm query':>28} {warm * 1e3:>10.2f} ms")
+        print(f"{'query after a new scan':>28} {grown * 1e3:>10.2f} ms")
+
+
+def bench_compaction(args):
+    """Disk size and load time of a closed day as CSV vs compacted Parquet."""
+    import compaction
+
+    if not compaction.is_available():
+        print("pyarrow is not installed")
+        return
+    print(f"{'rows':>9} {'csv MB':>8} {'parquet MB':>11} {'csv load ms':>12} {'mmap load ms':>13} {'to pandas ms':>13}")
+    with tempfile.TemporaryDirectory() as folder:
+        for rows in args.rows:
+            csv_path = os.path.join(folder, f"2000-01-01_Bench{rows}.csv")
+            make_day_csv(csv_path, rows, spread=True)
+            with open(csv_path, 'rb') as file:
+                original = file.read()
+            csv_size = len(original)
+
+            def load_csv():
+                df = pd.read_csv(csv_path)
+                df['Time Scanned'] = pd.to_datetime(df['Time Scanned'])
+
+            csv_load = time_per_call(load_csv, args.loads)
+            parquet_path = compaction.compact_day_file(csv_path, keep_csv=True)
+            parquet_size = os.path.getsize(parquet_path)
+            mmap_load = time_per_call(lambda: compaction.read_day_table(parquet_path), args.loads)
+            pandas_load = time_per_call(lambda: compaction.read_day_table(parquet_path).to_pandas(), args.loads)
+            assert b"".join(compaction.iter_csv_bytes(parquet_path)) == original
+            print(f"{rows:>9} {csv_size / 1e6:>8.2f} {parquet_size / 1e6:>11.2f} {csv_load * 1e3:>12.1f} "
+                  f"{mmap_load * 1e3:>13.2f} {pandas_load * 1e3:>13.1f}")
+
+
+def bench_export(args):
+    """Peak Python memory and time to stream a multi-day export, per format."""
+    import tracemalloc
+    from datetime import timedelta
+
+    with sandbox_cwd():
+        import webapp
+
+        os.makedirs(webapp.FOLDER_PATH, exist_ok=True)
+        line_name = webapp.get_line_settings()[0]
+        today = datetime.now().date()
+        for n in range(args.days):
+            day = (today - timedelta(days=n)).strftime('%Y-%m-%d')
+            make_day_csv(f"{webapp.FOLDER_PATH}{day}_{line_name}.csv", args.rows, line_name)
+        start = (today - timedelta(days=args.days - 1)).strftime('%Y-%m-%d')
+        client = webapp.app.test_client()
+
+        print(f"{args.days} days x {args.rows} rows")
+        print(f"{'format':>8} {'bytes out':>12} {'seconds':>8} {'peak MB':>8}")
+        for export_format in ("csv", "gzip", "zip"):
+            tracemalloc.start()
+            began = time.perf_counter()
+            response = client.get(f"/export?start={start}&format={export_format}", buffered=False)
+            total = sum(len(chunk) for chunk in response.response)
+            elapsed = time.perf_counter() - began
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            response.close()
+            print(f"{export_format:>8} {total:>12} {elapsed:>8.2f} {peak / 1e6:>8.2f}")
+
+
+def wait_for_log(path, text, count=1, timeout=20):
+    """Wait until a subprocess log file contains `text` at least `count` times."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with open(path) as file:
+            if file.read().count(text) >= count:
+                return True
+        time.sleep(0.05)
+    return False
+
+
+def legacy_modify_config(key, value):
+    import yaml
+
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+    config[key] = value
+    with open('config.yaml', 'w') as file:
+        yaml.dump(config, file, default_flow_style=False)
+
+
+def bench_config(args):
+    """Config read cost, and file writes and service reloads per admin save, before and after ConfigStore."""
+    import yaml
+    from utils import ConfigObject, ConfigStore
+
+    def legacy_load():
+        with open('config.yaml') as file:
+            return ConfigObject(yaml.safe_load(file))
+
+    with sandbox_cwd():
+        store = ConfigStore()
+        print(f"{'read':>8} {'us/call':>9}")
+        print(f"{'legacy':>8} {time_per_call(legacy_load, args.calls) * 1e6:>9.1f}")
+        print(f"{'store':>8} {time_per_call(store.get, args.calls) * 1e6:>9.1f}")
+
+        print(f"\n{'save':>8} {'writes':>7} {'reloads':>8} {'ms/save':>8}")
+        for mode in ("legacy", "store"):
+            # A second store stands in for main.py's monitor, polling faster than its 1 s to catch every write
+            monitor = ConfigStore()
+            monitor.get()
+            last_mtime = os.stat('config.yaml').st_mtime_ns
+            reloads = [0]
+            done = threading.Event()
+
+            def watch():
+                nonlocal last_mtime
+                while not done.wait(args.poll):
+                    if mode == "legacy":
+                        mtime = os.stat('config.yaml').st_mtime_ns
+                        if mtime != last_mtime:
+                            last_mtime = mtime
+                            reloads[0] += 1
+                    elif monitor.refresh():
+                        reloads[0] += 1
+
+            watcher = threading.Thread(target=watch, daemon=True)
+            watcher.start()
+            writes = 0
+            elapsed = 0
+            for save in range(args.saves):
+                segments = [{"start": "08:00", "end": "12:00", "target": 50 + save}]
+                started = time.perf_counter()
+                if mode == "legacy":
+                    for key, value in (("target", 100 + save), ("name", "BenchLine"), ("time_segments", segments)):
+                        legacy_modify_config(key, value)
+                        writes += 1
+                else:
+                    store.update({"target": 100 + save, "name": "BenchLine", "time_segments": segments})
+                    writes += 1
+                elapsed += time.perf_counter() - started
+                time.sleep(args.poll * 20)
+            done.set()
+            watcher.join()
+            print(f"{mode:>8} {writes / args.saves:>7.1f} {reloads[0] / args.saves:>8.2f} "
+                  f"{elapsed / args.saves * 1e3:>8.2f}")
+
+
+def link_repo(folder):
+    """Link the scripts, templates and static files into `folder`, since main.py starts services by script name."""
+    for name in os.listdir(REPO_DIR):
+        if name.endswith(".py") or name in ("templates", "static"):
+            os.symlink(os.path.join(REPO_DIR, name), os.path.join(folder, name))
+
+
+def bench_reload(args):
+    """Scans lost while admin edits go through the real path: POST /admin, main.py's monitor, service reload.
+
+    Exits non-zero if a scan is lost or an edit is not applied in place.
+    """
+    import json
+    import signal
+    import subprocess
+    import sys
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+
+    failed = False
+    print(f"{'mode':>10} {'edits':>6} {'applied':>8} {'sent':>6} {'recorded':>9} {'lost':>6}")
+    for mode in args.modes:
+        with sandbox_cwd() as folder:
+            link_repo(folder)
+            master, slave = os.openpty()
+            port = free_port()
+            set_config(scanner={"port": os.ttyname(slave), "baudrate": 9600, "read_mode": "waiting",
+                                "terminator": "cr"},
+                       server={"mode": "waitress", "host": "127.0.0.1", "port": port, "threads": 16},
+                       supervisor={"mode": mode}, storage={"fsync": "never"})
+            from utils import load_config
+            line_name = load_config().name
+            filepath = f"data/{datetime.now().strftime('%Y-%m-%d')}_{line_name}.csv"
+            log = open("main.log", "w")
+            process = subprocess.Popen([sys.executable, "main.py"], stdout=log, stderr=subprocess.STDOUT,
+                                       env=dict(os.environ, PYTHONUNBUFFERED="1"), start_new_session=True)
+            try:
+                deadline = time.time() + 60
+                while time.time() < deadline:
+                    try:
+                        with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as response:
+                            if json.load(response).get("scanner"):
+                                break
+                    except OSError:
+                        time.sleep(0.1)
+                else:
+                    raise RuntimeError(f"main.py did not become healthy in {mode} mode, see main.log")
+                sent = []
+                stop = threading.Event()
+
+                def send():
+                    while not stop.is_set():
+                        barcode = random_barcode()
+                        os.write(master, barcode.encode() + b"\r")
+                        sent.append(barcode)
+                        time.sleep(args.interval)
+
+                sender = threading.Thread(target=send, daemon=True)
+                sender.start()
+                for edit in range(args.edits):
+                    time.sleep(args.edit_interval)
+                    # The admin page's form: a new day target and segment targets
+                    form = urllib.parse.urlencode({
+                        "target": 100 + edit,
+                        "segment_start_0": "00:00", "segment_end_0": "11:59", "segment_target_0": 50 + edit,
+                        "segment_start_1": "12:00", "segment_end_1": "23:59", "segment_target_1": 50 + edit,
+                    }).encode()
+                    try:
+                        urllib.request.urlopen(f"http://127.0.0.1:{port}/admin", data=form, timeout=5).close()
+                    except urllib.error.HTTPError as e:
+                        if e.code != 302:
+                            raise RuntimeError(f"POST /admin failed with {e.code}")
+                time.sleep(args.edit_interval)
+                stop.set()
+                sender.join()
+                time.sleep(1.5)  # Let the scanner drain what is still in the tty buffer
+                process.send_signal(signal.SIGTERM)
+                process.wait(30)
+            finally:
+                # A service left running would keep reading the pseudo-terminal of later runs
+                with contextlib.suppress(ProcessLookupError):
+                    os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+                log.close()
+            with open("main.log") as file:
+                output = file.read()
+            # Each save is one atomic write that main.py applies in place (saves within its 1 s poll may
+            # be applied together); a restart would mean the scanner was stopped during an edit
+            applied = output.count("Services reloaded without a restart.")
+            with open(filepath, newline='') as file:
+                recorded = {row[-1] for row in list(csv.reader(file))[1:]}
+            lost = len([barcode for barcode in sent if barcode not in recorded])
+            ok = lost == 0 and applied > 0 and "Services restarted" not in output
+            failed = failed or not ok
+            print(f"{mode:>10} {args.edits:>6} {applied:>8} {len(sent):>6} {len(recorded):>9} {lost:>6}"
+                  + ("" if ok else "  FAILED"))
+            os.close(master)
+            os.close(slave)
+    return 1 if failed else 0
+
+
+def bench_startup(args):
+    """Cold import cost of each module, then main.py's time to a healthy /healthz and total RSS per supervisor mode."""
+    import json
+    import signal
+    import subprocess
+    import sys
+    import urllib.request
+
+    # VmRSS rather than ru_maxrss, which Linux carries over from this process through fork and exec
+    probe = ("import sys, time; started = time.perf_counter(); import {module}; "
+             "rss = [line.split()[1] for line in open('/proc/self/status') if line.startswith('VmRSS:')][0]; "
+             "print(time.perf_counter() - started, rss, 'pandas' in sys.modules)")
+    print(f"{'import':>10} {'ms':>8} {'rss MB':>7} {'pandas':>7}")
+    for module in ("scanner", "webapp", "main"):
+        with sandbox_cwd():
+            timings = []
+            for _ in range(args.repeat):
+                output = subprocess.run([sys.executable, "-c", probe.format(module=module)], capture_output=True,
+                                        text=True, check=True, env=dict(os.environ, PYTHONPATH=REPO_DIR)).stdout
+                seconds, rss, pandas = output.split()
+                timings.append(float(seconds))
+            print(f"{module:>10} {statistics.median(timings) * 1e3:>8.0f} {int(rss) / 1024:>7.1f} {pandas:>7}")
+
+    print(f"\n{'mode':>10} {'ready s':>8} {'rss MB':>7} {'processes':>10}")
+    for mode in args.modes:
+        with sandbox_cwd() as folder:
+            link_repo(folder)
+            master, slave = os.openpty()
+            port = free_port()
+            set_config(scanner={"port": os.ttyname(slave), "baudrate": 9600, "read_mode": "waiting",
+                                "terminator": "cr"},
+                       server={"mode": "threaded", "host": "127.0.0.1", "port": port, "threads": 16},
+                       supervisor={"mode": mode})
+            log = open("main.log", "w")
+            started = time.perf_counter()
+            process = subprocess.Popen([sys.executable, "main.py"], stdout=log, stderr=subprocess.STDOUT)
+            ready = None
+            while ready is None and time.perf_counter() - started < 60:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as response:
+                        if json.load(response).get("scanner"):
+                            ready = time.perf_counter() - started
+                except OSError:
+                    time.sleep(0.05)
+            time.sleep(args.settle)
+            with open(f"/proc/{process.pid}/task/{process.pid}/children") as children:
+                count = 1 + len(children.read().split())
+            memory = rss_kb(process.pid) / 1024
+            process.send_signal(signal.SIGTERM)
+            process.wait(30)
+            log.close()
+            os.close(master)
+            os.close(slave)
+            print(f"{mode:>10} {ready if ready is not None else float('nan'):>8.2f} {memory:>7.1f} {count:>10}")
+
+
+def bench_drain(args):
+    """Scans still in the tty buffer when the scanner gets SIGTERM, and how many reach the day file."""
+    import signal
+    import subprocess
+    import sys
+
+    print(f"{'burst':>6} {'recorded':>9} {'lost':>6} {'exit s':>7}")
+    for burst in args.bursts:
+        with sandbox_cwd():
+            master, slave = os.openpty()
+            set_config(scanner={"port": os.ttyname(slave), "baudrate": 9600, "read_mode": "waiting",
+                                "terminator": "cr"}, ipc={"enabled": False})
+            from utils import load_config
+            filepath = f"data/{datetime.now().strftime('%Y-%m-%d')}_{load_config().name}.csv"
+            with open("scanner.log", "w") as log:
+                process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "scanner.py")], stdout=log,
+                                           stderr=subprocess.STDOUT, env=dict(os.environ, PYTHONUNBUFFERED="1"))
+                assert wait_for_log("scanner.log", "Listening on"), "scanner did not start"
+                barcodes = [random_barcode() for _ in range(burst)]
+                os.write(master, b"".join(barcode.encode() + b"\r" for barcode in barcodes))
+                started = time.perf_counter()
+                process.send_signal(signal.SIGTERM)
+                process.wait()
+            elapsed = time.perf_counter() - started
+            with open(filepath, newline='') as file:
+                recorded = {row[-1] for row in list(csv.reader(file))[1:]}
+            lost = len(set(barcodes) - recorded)
+            print(f"{burst:>6} {len(recorded):>9} {lost:>6} {elapsed:>7.2f}")
+            os.close(master)
+            os.close(slave)
+
+
+def bench_metrics(args):
+    """Cost of the metric updates on the scan path, next to the cost of a whole scan."""
+    import metrics
+
+    registry = metrics.Registry()
+    counter = metrics.Counter("bench_total", "bench", ["line"], registry=registry).labels(line="BenchLine")
+    histogram = metrics.Histogram("bench_seconds", "bench", ["line"], registry=registry).labels(line="BenchLine")
+    costs = {
+        "counter inc": time_per_call(counter.inc, args.calls),
+        "histogram observe": time_per_call(lambda: histogram.observe(0.0003), args.calls),
+        "perf_counter x2": time_per_call(lambda: time.perf_counter() - time.perf_counter(), args.calls),
+    }
+    # One accepted scan makes one dedup and one append observation, one counter increment and two timer pairs
+    per_scan = costs["counter inc"] + 2 * costs["histogram observe"] + 2 * costs["perf_counter x2"]
+    with tempfile.TemporaryDirectory() as folder:
+        line = make_scanner_line(folder + "/")
+        barcodes = [random_barcode() for _ in range(args.scans)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            for barcode in barcodes:
+                line.process_scan(barcode)
+            scan = (time.perf_counter() - started) / args.scans
+        line.close()
+        render = time_per_call(lambda: metrics.REGISTRY.render(), 200)
+    for name, cost in costs.items():
+        print(f"{name:>20} {cost * 1e9:>8.0f} ns")
+    print(f"{'metrics per scan':>20} {per_scan * 1e9:>8.0f} ns")
+    print(f"{'process_scan':>20} {scan * 1e9:>8.0f} ns  (metrics {per_scan / scan * 100:.1f}%)")
+    print(f"{'render scanner':>20} {render * 1e6:>8.1f} us")
+
+
+def bench_logging(args):
+    """Caller-side cost per scan: the old print() calls vs records handed to the logging queue."""
+    import logging
+    import logs
+    from utils import ConfigObject
+
+    with tempfile.TemporaryDirectory() as folder:
+        # A console that takes `delay` seconds per write stands in for a slow serial console or SSH session
+        class SlowConsole(io.StringIO):
+            def write(self, text):
+                time.sleep(args.delay)
+                return super().write(text)
+
+        console = SlowConsole()
+        barcode = random_barcode()
+
+        def legacy_scan():
+            print(f"[BenchLine] Scanned Barcode: {barcode}", file=console, flush=True)
+            print(f"[BenchLine] {barcode} is unique in the 'Barcode' column.", file=console, flush=True)
+
+        legacy = time_per_call(legacy_scan, args.scans)
+
+        handler = logs.setup_logging("bench", ConfigObject({"logging": {"folder": folder}}), console=console)
+        logger = logging.getLogger("scanner")
+
+        def logged_scan():
+            logger.debug(f"[BenchLine] Scanned Barcode: {barcode}", extra={"line": "BenchLine", "barcode": barcode})
+            logger.info(f"[BenchLine] Recorded {barcode}",
+                        extra={"line": "BenchLine", "barcode": barcode, "latency_ms": 0.1})
+
+        logged = time_per_call(logged_scan, args.scans)
+        print(f"{'print()':>10} {legacy * 1e6:>10.1f} us/scan")
+        print(f"{'logging':>10} {logged * 1e6:>10.1f} us/scan  (dropped {handler.dropped})")
+
+
+def bench_forward(args):
+    """Scans delivered exactly once through a collector outage and a forwarder crash, plus transport costs."""
+    import gzip
+    import json
+    import signal
+    import subprocess
+    import sys
+    import collector
+
+    with sandbox_cwd():
+        port = free_port()
+        set_config(ipc={"enabled": False}, forwarder={
+            "enabled": True, "url": f"http://127.0.0.1:{port}/ingest", "source": "bench",
+            "batch_size": args.batch_size, "batch_interval": args.batch_interval, "compress": True,
+            "outbox": "outbox/", "timeout": 5})
+        from utils import load_config, check_folder_exists, check_csv_exists
+        config = load_config()
+        check_folder_exists("data/")
+        filepath = f"data/{datetime.now().strftime('%Y-%m-%d')}_{config.name}.csv"
+        check_csv_exists(filepath, config.header)
+
+        server = collector.make_server("127.0.0.1", port, "collected/")
+        server.connections = 0
+        process_request = server.process_request
+
+        def count_connection(request, client_address):
+            server.connections += 1
+            process_request(request, client_address)
+        server.process_request = count_connection
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        def start_forwarder():
+            return subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "forwarder.py")], stdout=log,
+                                    stderr=subprocess.STDOUT)
+
+        written = []
+        writing = threading.Event()
+        writing.set()
+
+        def write_scans():
+            while writing.is_set():
+                barcode = random_barcode()
+                with open(filepath, 'a', newline='') as file:
+                    csv.writer(file).writerow([config.name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), barcode])
+                written.append(barcode)
+                time.sleep(1 / args.rate)
+
+        with open("forwarder.log", "w") as log:
+            forwarder = start_forwarder()
+            writer = threading.Thread(target=write_scans)
+            writer.start()
+            time.sleep(args.phase)
+            print(f"collector down for {args.outage}s")
+            server.state.fail = True
+            time.sleep(args.outage)
+            server.state.fail = False
+            outbox_peak = len([name for name in os.listdir("outbox") if name.endswith(".batch")])
+            time.sleep(args.phase)
+            print("forwarder killed (SIGKILL) and restarted")
+            forwarder.send_signal(signal.SIGKILL)
+            forwarder.wait()
+            time.sleep(1)
+            forwarder = start_forwarder()
+            time.sleep(args.phase)
+            writing.clear()
+            writer.join()
+            started = time.perf_counter()
+            deadline = time.time() + args.settle
+            while time.time() < deadline and server.state.sources.get("bench", {}).get("scans", 0) < len(written):
+                time.sleep(0.1)
+            drained = time.perf_counter() - started
+            forwarder.send_signal(signal.SIGTERM)
+            forwarder.wait()
+
+        with open("collected/bench.csv", newline='') as file:
+            received = list(csv.reader(file))
+        barcodes = [row[3] for row in received]
+        sequences = [int(row[0]) for row in received]
+        print(f"{'written':>8} {'received':>9} {'missing':>8} {'duplicated':>11} {'in order':>9} "
+              f"{'batches':>8} {'connections':>12} {'outbox peak':>12} {'drain s':>8}")
+        print(f"{len(written):>8} {len(barcodes):>9} {len(set(written) - set(barcodes)):>8} "
+              f"{len(barcodes) - len(set(barcodes)):>11} {str(barcodes == written):>9} {max(sequences):>8} "
+              f"{server.connections:>12} {outbox_peak:>12} {drained:>8.2f}")
+
+        # Transport: request size and time per batch, gzip vs plain and keep-alive vs a connection per batch
+        from forwarder import CollectorClient
+        scans = [{"line": config.name, "time": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                  "barcode": random_barcode(), "file": os.path.basename(filepath)} for _ in range(args.batch_size)]
+        print(f"\n{'compress':>9} {'keep-alive':>11} {'bytes':>8} {'ms/batch':>9}")
+        for compress in (False, True):
+            for keep_alive in (False, True):
+                client = CollectorClient(f"http://127.0.0.1:{port}/ingest", f"transport-{compress}-{keep_alive}",
+                                         compress=compress)
+                started = time.perf_counter()
+                for seq in range(1, args.batches + 1):
+                    payload = json.dumps({"source": client.source, "seq": seq, "scans": scans}).encode('utf-8')
+                    body = gzip.compress(payload, 6) if compress else payload
+                    assert client.send(seq, body) == 200
+                    if not keep_alive:
+                        client.close()
+                elapsed = (time.perf_counter() - started) / args.batches
+                client.close()
+                print(f"{str(compress):>9} {str(keep_alive):>11} {len(body):>8} {elapsed * 1e3:>9.2f}")
+        server.shutdown()
+
+
+def legacy_bridge(in_path, out_path):
+    """The original port_fowarding.py loop: poll in_waiting without ever blocking."""
+    import serial
+
+    in_port = serial.Serial(in_path, 9600)
+    out_port = serial.Serial(out_path, 9600)
+    while True:
+        if in_port.in_waiting:
+            out_port.write(in_port.read(in_port.in_waiting))
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as file:
+        fields = file.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def bench_bridge(args):
+    """Serial bridge over two pseudo-terminals: idle CPU, throughput and latency, old loop vs select() vs tee."""
+    import signal
+    import subprocess
+    import sys
+
+    print(f"{'mode':>7} {'idle cpu %':>11} {'load cpu %':>11} {'scans/s':>9} {'p50 ms':>7} {'p99 ms':>7} "
+          f"{'recorded':>9}")
+    for mode in args.modes:
+        with sandbox_cwd():
+            scanner_master, scanner_slave = os.openpty()
+            device_master, device_slave = os.openpty()
+            in_path, out_path = os.ttyname(scanner_slave), os.ttyname(device_slave)
+            if mode == "legacy":
+                command = ["-c", f"import sys; sys.path.insert(0, {REPO_DIR!r}); import benchmark; "
+                                 f"benchmark.legacy_bridge({in_path!r}, {out_path!r})"]
+            elif mode == "select":
+                command = [os.path.join(REPO_DIR, "port_fowarding.py"), "--in-port", in_path, "--out-port", out_path]
+            else:
+                set_config(ipc={"enabled": False}, scanner={"port": in_path, "baudrate": 9600, "read_mode": "waiting",
+                                                            "terminator": "cr", "forward_port": out_path})
+                command = [os.path.join(REPO_DIR, "scanner.py")]
+            with open("bridge.log", "w") as log:
+                process = subprocess.Popen([sys.executable] + command, stdout=log, stderr=subprocess.STDOUT)
+            time.sleep(args.startup)  # Let both ports open; opening flushes what was already written
+
+            idle_started = cpu_seconds(process.pid)
+            time.sleep(args.idle)
+            idle_cpu = (cpu_seconds(process.pid) - idle_started) / args.idle * 100
+
+            received = bytearray()
+            arrived = threading.Condition()
+
+            def read_device():
+                while True:
+                    try:
+                        data = os.read(device_master, 65536)
+                    except OSError:
+                        return
+                    with arrived:
+                        received.extend(data)
+                        arrived.notify_all()
+
+            threading.Thread(target=read_device, daemon=True).start()
+
+            def wait_for(size, timeout=30):
+                with arrived:
+                    return arrived.wait_for(lambda: len(received) >= size, timeout)
+
+            # Latency: one scan at a time, timed until it comes out of the other port
+            latencies = []
+            for _ in range(args.samples):
+                scan = random_barcode().encode() + b"\r"
+                target = len(received) + len(scan)
+                started = time.perf_counter()
+                os.write(scanner_master, scan)
+                if not wait_for(target):
+                    break
+                latencies.append((time.perf_counter() - started) * 1e3)
+                time.sleep(0.005)
+
+            # Throughput: a burst of scans written as fast as the pty takes them
+            expected = len(received) + args.scans * 14
+            load_started, started = cpu_seconds(process.pid), time.perf_counter()
+            for _ in range(args.scans):
+                os.write(scanner_master, random_barcode().encode() + b"\r")
+            wait_for(expected)
+            elapsed = time.perf_counter() - started
+            load_cpu = (cpu_seconds(process.pid) - load_started) / elapsed * 100
+
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            recorded = "-"
+            if mode == "tee":
+                from utils import load_config
+                with open(f"data/{datetime.now().strftime('%Y-%m-%d')}_{load_config().name}.csv") as file:
+                    recorded = str(sum(1 for _ in file) - 1)
+            for fd in (scanner_master, scanner_slave, device_master, device_slave):
+                os.close(fd)
+            print(f"{mode:>7} {idle_cpu:>11.1f} {load_cpu:>11.1f} {args.scans / elapsed:>9.0f} "
+                  f"{percentile(latencies, 50):>7.2f} {percentile(latencies, 99):>7.2f} {recorded:>9}")
+
+
+def synthetic_stream(scans, rate, pattern="steady", burst_size=10, duplicates=0.0):
+    """(seconds from start, barcode) pairs at an average of `rate` scans per second.
+
+    steady: evenly spaced; poisson: exponential gaps; burst: `burst_size` scans
+    back to back, then a pause keeping the average rate. A `duplicates` share of
+    the scans repeats an earlier barcode of the stream.
+    """
+    stream = []
+    offset = 0.0
+    for n in range(scans):
+        if stream and random.random() < duplicates:
+            barcode = random.choice(stream)[1]
+        else:
+            barcode = random_barcode()
+        stream.append((offset, barcode))
+        if pattern == "poisson":
+            offset += random.expovariate(rate)
+        elif pattern == "burst":
+            offset += burst_size / rate if (n + 1) % burst_size == 0 else 0.0
+        else:
+            offset += 1 / rate
+    return stream
+
+
+def recorded_stream(filepath, speed=1.0):
+    """Replay a day CSV: its barcodes with the original gaps between scan times, `speed` times faster."""
+    with open(filepath, newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        column = header.index('Barcode') if 'Barcode' in header else len(header) - 1
+        time_column = header.index('Time Scanned') if 'Time Scanned' in header else 1
+        rows = [row for row in reader if len(row) > max(column, time_column)]
+    if not rows:
+        return []
+    rows.sort(key=lambda row: row[time_column])
+    start = datetime.strptime(rows[0][time_column], '%Y-%m-%d %H:%M:%S')
+    return [((datetime.strptime(row[time_column], '%Y-%m-%d %H:%M:%S') - start).total_seconds() / speed, row[column])
+            for row in rows]
+
+
+def expected_accepted(stream):
+    """Barcodes the dedup check must accept (first scan of each) in order; the rest must be rejected."""
+    seen = set()
+    accepted = []
+    for _, barcode in stream:
+        if barcode not in seen:
+            seen.add(barcode)
+            accepted.append(barcode)
+    return accepted
+
+
+class DayFileWatcher(threading.Thread):
+    """Record when each barcode shows up in the day files of a folder, using inotify."""
+
+    def __init__(self, folder, paths):
+        super().__init__(daemon=True)
+        import hub
+        from utils import CsvTail
+
+        self.watcher = hub.InotifyWatcher(folder)
+        self.tails = {path: CsvTail() for path in paths}
+        self.arrivals = {path: {} for path in paths}  # path -> barcode -> arrival time
+        self.rows = {path: 0 for path in paths}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.watcher.wait(0.2)
+            now = time.perf_counter()
+            for path, tail in self.tails.items():
+                if not os.path.exists(path):
+                    continue
+                rows, _ = tail.read_new_rows(path)
+                self.rows[path] += len(rows)
+                for row in rows:
+                    self.arrivals[path].setdefault(row[-1], now)
+
+
+def latency_summary(values):
+    if not values:
+        return None
+    return {"p50_ms": round(statistics.median(values) * 1e3, 2), "p95_ms": round(percentile(values, 95) * 1e3, 2),
+            "p99_ms": round(percentile(values, 99) * 1e3, 2), "max_ms": round(max(values) * 1e3, 2)}
+
+
+def bench_replay(args):
+    """Replay barcode streams into scanner.py through pseudo-terminals while SSE clients watch webapp.py."""
+    import json
+    import subprocess
+    import sys
+
+    if args.replay:
+        streams = [recorded_stream(args.replay, args.speed) for _ in range(args.lines)]
+    else:
+        streams = [synthetic_stream(args.scans, args.rate, args.pattern, args.burst_size, args.duplicates)
+                   for _ in range(args.lines)]
+
+    with sandbox_cwd():
+        ptys = [os.openpty() for _ in range(args.lines)]
+        names = [f"ReplayLine{n + 1}" for n in range(args.lines)]
+        port = free_port()
+        set_config(name=names[0], scanner={"port": os.ttyname(ptys[0][1]), "baudrate": 9600,
+                                           "read_mode": "waiting", "terminator": "cr"},
+                   lines=[{"name": name, "port": os.ttyname(slave)} for name, (_, slave) in zip(names[1:], ptys[1:])],
+                   server={"host": "127.0.0.1", "port": port, "mode": "threaded"},
+                   logging={"folder": "logs/", "level": "INFO", "console_level": "WARNING"})
+        os.makedirs("data", exist_ok=True)
+        day = datetime.now().strftime('%Y-%m-%d')
+        paths = [f"data/{day}_{name}.csv" for name in names]
+        log = open("services.log", "w")
+        webapp_process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "webapp.py")],
+                                          stdout=log, stderr=subprocess.STDOUT)
+        wait_for_port(port)
+        scanner_process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "scanner.py")],
+                                           stdout=log, stderr=subprocess.STDOUT)
+        watcher = DayFileWatcher("data", paths)
+        watcher.start()
+        clients = [SSEClient(port, f"/stream?line={names[n % args.lines]}") for n in range(args.clients)]
+        try:
+            deadline = time.time() + 20
+            while not all(os.path.exists(path) for path in paths) and time.time() < deadline:
+                time.sleep(0.05)
+            time.sleep(1)  # Ports opened
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.connected.wait(10)
+
+            sent = [{} for _ in range(args.lines)]  # line -> barcode -> first send time
+
+            def replay(n):
+                master = ptys[n][0]
+                start = time.perf_counter()
+                for offset, barcode in streams[n]:
+                    delay = start + offset - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    sent[n].setdefault(barcode, time.perf_counter())
+                    os.write(master, barcode.encode() + b"\r")
+
+            started = time.perf_counter()
+            senders = [threading.Thread(target=replay, args=(n,)) for n in range(args.lines)]
+            for sender in senders:
+                sender.start()
+            for sender in senders:
+                sender.join()
+            send_seconds = time.perf_counter() - started
+            accepted = [expected_accepted(stream) for stream in streams]
+            deadline = time.time() + args.settle
+            while time.time() < deadline and any(watcher.rows[path] < len(accepted[n]) for n, path in enumerate(paths)):
+                time.sleep(0.05)
+            time.sleep(1)  # Late duplicates or SSE events
+        finally:
+            watcher.stopped.set()
+            for client in clients:
+                client.stop()
+            scanner_process.terminate()
+            scanner_process.wait()
+            webapp_process.terminate()
+            webapp_process.wait()
+            log.close()
+            for master, slave in ptys:
+                os.close(master)
+                os.close(slave)
+
+    csv_latencies = []
+    sse_latencies = []
+    missing = extra = duplicate_rows = 0
+    last_arrival = started
+    for n, path in enumerate(paths):
+        arrivals = watcher.arrivals[path]
+        missing += len(set(accepted[n]) - set(arrivals))
+        extra += len(set(arrivals) - set(accepted[n]))
+        duplicate_rows += watcher.rows[path] - len(arrivals)
+        csv_latencies += [arrivals[barcode] - sent[n][barcode] for barcode in accepted[n] if barcode in arrivals]
+        last_arrival = max([last_arrival] + list(arrivals.values()))
+    for index, client in enumerate(clients):
+        n = index % args.lines
+        # The k-th accepted scan is on screen once a payload reports a count of at least k
+        counts = [(arrival, json.loads(line[5:])["count"]) for arrival, line in client.events]
+        position = 0
+        for k, barcode in enumerate(accepted[n], 1):
+            while position < len(counts) and counts[position][1] < k:
+                position += 1
+            if position == len(counts):
+                break
+            sse_latencies.append(counts[position][0] - sent[n][barcode])
+
+    total_sent = sum(len(stream) for stream in streams)
+    total_accepted = sum(len(names) for names in accepted)
+    recorded = total_accepted - missing + extra
+    results = {
+        "benchmark": "replay",
+        "time": datetime.now().isoformat(timespec='seconds'),
+        "settings": {key: value for key, value in vars(args).items() if key != "func"},
+        "sent": total_sent,
+        "expected_accepted": total_accepted,
+        "recorded": recorded,
+        "dedup": {"missing": missing, "unexpected": extra, "duplicate_rows": duplicate_rows,
+                  "correct": missing == 0 and extra == 0 and duplicate_rows == 0},
+        "send_rate": round(total_sent / send_seconds, 1) if send_seconds else None,
+        "throughput": round(recorded / (last_arrival - started), 1) if last_arrival > started else None,
+        "scan_to_csv": latency_summary(csv_latencies),
+        "scan_to_sse": latency_summary(sse_latencies),
+    }
+    print(f"sent {total_sent} scans on {args.lines} line(s) at {results['send_rate']}/s, "
+          f"{args.clients} SSE client(s)")
+    print(f"recorded {recorded}/{total_accepted} expected, throughput {results['throughput']}/s, "
+          f"dedup {'ok' if results['dedup']['correct'] else 'FAILED'} "
+          f"(missing {missing}, unexpected {extra}, duplicate rows {duplicate_rows})")
+    for name in ("scan_to_csv", "scan_to_sse"):
+        summary = results[name] or {}
+        print(f"{name:>12} " + " ".join(f"{key} {value:>8}" for key, value in summary.items()))
+
+    if args.results_dir:
+        os.makedirs(args.results_dir, exist_ok=True)
+        path = os.path.join(args.results_dir, f"replay-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+        with open(path, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"results saved to {path}")
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare_results(json.load(file), results, args.tolerance)
+
+
+def compare_results(baseline, current, tolerance):
+    """Print each metric next to a saved run and flag changes worse than `tolerance` (a fraction)."""
+    ignored = ("results_dir", "baseline", "tolerance")
+    changed = [key for key, value in current["settings"].items()
+               if key not in ignored and baseline.get("settings", {}).get(key) != value]
+    if changed:
+        print(f"note: the baseline was run with different settings ({', '.join(changed)})")
+    rows = [("throughput", baseline.get("throughput"), current.get("throughput"), True)]
+    for name in ("scan_to_csv", "scan_to_sse"):
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            rows.append((f"{name} {key}", (baseline.get(name) or {}).get(key), (current.get(name) or {}).get(key), False))
+    print(f"{'metric':>20} {'baseline':>10} {'current':>10} {'change':>8}")
+    regressions = 0 if current["dedup"]["correct"] else 1
+    for metric, before, after, higher_is_better in rows:
+        if before is None or after is None:
+            continue
+        change = (after - before) / before if before else 0.0
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        regressions += bool(flag)
+        print(f"{metric:>20} {before:>10} {after:>10} {change * 100:>7.1f}%{flag}")
+    if not current["dedup"]["correct"]:
+        print("dedup correctness: REGRESSION")
+    print(f"{regressions} regression(s) beyond {tolerance * 100:.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the production monitor hot paths")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    dedup = subparsers.add_parser("dedup", help="per-scan duplicate check cost vs rows in the day file")
+    dedup.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000, 200000])
+    dedup.add_argument("--calls", type=int, default=100000)
+    dedup.add_argument("--legacy-calls", type=int, default=5)
+    dedup.set_defaults(func=bench_dedup)
+
+    serial_bench = subparsers.add_parser("serial", help="serial reader throughput over a pseudo-terminal")
+    serial_bench.add_argument("--modes", nargs="+", default=["legacy", "waiting", "read_until"])
+    serial_bench.add_argument("--scans", type=int, default=2000)
+    serial_bench.add_argument("--legacy-scans", type=int, default=5)
+    serial_bench.add_argument("--terminator", default="cr")
+    serial_bench.set_defaults(func=bench_serial)
+
+    counter = subparsers.add_parser("counter", help="/data and /stream refresh cost vs rows in the day file")
+    counter.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    counter.add_argument("--viewers", type=int, default=20)
+    counter.add_argument("--refreshes", type=int, default=10)
+    counter.set_defaults(func=bench_counter)
+
+    visual = subparsers.add_parser("visual", help="/visual segment bucketing cost vs rows in the day file")
+    visual.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    visual.add_argument("--legacy-max", type=int, default=1000000, help="skip the legacy path above this many rows")
+    visual.add_argument("--updates", type=int, default=20)
+    visual.set_defaults(func=bench_visual)
+
+    pace = subparsers.add_parser("pace", help="/api/pace cost: first call vs incremental update per scan")
+    pace.add_argument("--rows", type=int, nargs="+", default=[1000, 100000, 1000000])
+    pace.add_argument("--updates", type=int, default=200)
+    pace.set_defaults(func=bench_pace)
+
+    sse = subparsers.add_parser("sse", help="SSE fan-out: server CPU and latency vs subscriber count")
+    sse.add_argument("--clients", type=int, nargs="+", default=[2, 20, 100, 200])
+    sse.add_argument("--scans", type=int, default=20)
+    sse.add_argument("--interval", type=float, default=0.2)
+    sse.add_argument("--rows", type=int, default=10000)
+    sse.set_defaults(func=bench_sse)
+
+    delta = subparsers.add_parser("delta", help="SSE bytes per event and reconnect cost, snapshots vs deltas")
+    delta.add_argument("--rows", type=int, default=20000)
+    delta.add_argument("--scans", type=int, default=50)
+    delta.add_argument("--missed", type=int, default=5, help="scans missed while a client is disconnected")
+    delta.add_argument("--interval", type=float, default=0.05)
+    delta.add_argument("--requests", type=int, default=200, help="/data requests per mode")
+    delta.set_defaults(func=bench_delta)
+
+    serve = subparsers.add_parser("serve", help="serving modes: memory and latency vs concurrent SSE clients")
+    serve.add_argument("--modes", nargs="+", default=["dev", "threaded", "waitress"])
+    serve.add_argument("--clients", type=int, nargs="+", default=[10, 100, 300])
+    serve.add_argument("--threads", type=int, default=None,
+                       help="server.threads (default: enough for the most clients plus the reserve)")
+    serve.set_defaults(func=bench_serve)
+
+    push = subparsers.add_parser("push", help="scan-to-screen latency with and without the IPC push channel")
+    push.add_argument("--scans", type=int, default=30)
+    push.add_argument("--interval", type=float, default=0.3)
+    push.set_defaults(func=bench_push)
+
+    store_bench = subparsers.add_parser("store", help="append throughput per fsync policy and crash recovery")
+    store_bench.add_argument("--rows", type=int, default=20000)
+    store_bench.add_argument("--always-rows", type=int, default=2000)
+    store_bench.add_argument("--batch-size", type=int, default=32)
+    store_bench.set_defaults(func=bench_store)
+
+    history = subparsers.add_parser("history", help="/api/history query cost over many day files")
+    history.add_argument("--days", type=int, default=90)
+    history.add_argument("--rows", type=int, default=2000)
+    history.add_argument("--queries", type=int, default=20)
+    history.set_defaults(func=bench_history)
+
+    compaction_bench = subparsers.add_parser("compaction", help="closed-day size and load time, CSV vs Parquet")
+    compaction_bench.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    compaction_bench.add_argument("--loads", type=int, default=5)
+    compaction_bench.set_defaults(func=bench_compaction)
+
+    export_bench = subparsers.add_parser("export", help="streaming range export: memory and time per format")
+    export_bench.add_argument("--days", type=int, default=90)
+    export_bench.add_argument("--rows", type=int, default=20000)
+    export_bench.set_defaults(func=bench_export)
+
+    config_bench = subparsers.add_parser("config", help="config read cost and reloads per admin save")
+    config_bench.add_argument("--calls", type=int, default=2000)
+    config_bench.add_argument("--saves", type=int, default=50)
+    config_bench.add_argument("--poll", type=float, default=0.0005, help="seconds between monitor checks")
+    config_bench.set_defaults(func=bench_config)
+
+    reload_bench = subparsers.add_parser("reload", help="scans lost during admin edits through main.py; "
+                                         "exits non-zero on any loss")
+    reload_bench.add_argument("--modes", nargs="+", default=["processes", "threads"], help="supervisor modes")
+    reload_bench.add_argument("--edits", type=int, default=5)
+    reload_bench.add_argument("--edit-interval", type=float, default=1.0)
+    reload_bench.add_argument("--interval", type=float, default=0.01, help="seconds between scans")
+    reload_bench.set_defaults(func=bench_reload)
+
+    startup = subparsers.add_parser("startup", help="import cost, time to healthy and RSS per supervisor mode")
+    startup.add_argument("--modes", nargs="+", default=["processes", "threads"])
+    startup.add_argument("--repeat", type=int, default=5, help="cold imports timed per module")
+    startup.add_argument("--settle", type=float, default=3, help="seconds after ready before RSS is read")
+    startup.set_defaults(func=bench_startup)
+
+    drain = subparsers.add_parser("drain", help="scans committed when the scanner is stopped with SIGTERM")
+    drain.add_argument("--bursts", type=int, nargs="+", default=[10, 100, 250])
+    drain.set_defaults(func=bench_drain)
+
+    metrics_bench = subparsers.add_parser("metrics", help="overhead of the metric updates on the scan path")
+    metrics_bench.add_argument("--calls", type=int, default=200000)
+    metrics_bench.add_argument("--scans", type=int, default=20000)
+    metrics_bench.set_defaults(func=bench_metrics)
+
+    logging_bench = subparsers.add_parser("logging", help="scan-path cost of print() vs the logging queue")
+    logging_bench.add_argument("--scans", type=int, default=2000)
+    logging_bench.add_argument("--delay", type=float, default=0.0002, help="seconds per console write")
+    logging_bench.set_defaults(func=bench_logging)
+
+    forward = subparsers.add_parser("forward", help="forwarding to a collector through an outage and a crash")
+    forward.add_argument("--rate", type=float, default=100, help="scans per second written to the day file")
+    forward.add_argument("--phase", type=float, default=3, help="seconds between disruptions")
+    forward.add_argument("--outage", type=float, default=5, help="seconds the collector answers 503")
+    forward.add_argument("--batch-size", type=int, default=200)
+    forward.add_argument("--batch-interval", type=float, default=1)
+    forward.add_argument("--batches", type=int, default=200, help="batches per transport measurement")
+    forward.add_argument("--settle", type=float, default=90, help="seconds to wait for the outbox to drain")
+    forward.set_defaults(func=bench_forward)
+
+    bridge = subparsers.add_parser("bridge", help="serial bridge CPU, throughput and latency over ptys")
+    bridge.add_argument("--modes", nargs="+", default=["legacy", "select", "tee"])
+    bridge.add_argument("--scans", type=int, default=5000, help="scans in the throughput burst")
+    bridge.add_argument("--samples", type=int, default=200, help="scans timed one by one for latency")
+    bridge.add_argument("--idle", type=float, default=3, help="seconds of idle CPU measurement")
+    bridge.add_argument("--startup", type=float, default=2, help="seconds to let the process open its ports")
+    bridge.set_defaults(func=bench_bridge)
+
+    replay = subparsers.add_parser("replay", help="replay scans into scanner.py over ptys with SSE clients attached")
+    replay.add_argument("--lines", type=int, default=1, help="production lines, one pseudo-terminal each")
+    replay.add_argument("--scans", type=int, default=500, help="synthetic scans per line")
+    replay.add_argument("--rate", type=float, default=50, help="average scans per second per line")
+    replay.add_argument("--pattern", choices=["steady", "poisson", "burst"], default="steady")
+    replay.add_argument("--burst-size", type=int, default=10)
+    replay.add_argument("--duplicates", type=float, default=0.1, help="share of scans repeating a barcode")
+    replay.add_argument("--replay", help="day CSV to replay instead of a synthetic stream")
+    replay.add_argument("--speed", type=float, default=60, help="replay speed-up for --replay")
+    replay.add_argument("--clients", type=int, default=10, help="SSE clients on /stream")
+    replay.add_argument("--settle", type=float, default=15, help="seconds to wait for the last rows")
+    replay.add_argument("--results-dir", default="benchmark_results", help="where results are saved ('' to skip)")
+    replay.add_argument("--baseline", help="saved results file to compare against")
+    replay.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before a regression")
+    replay.set_defaults(func=bench_replay)
+
+    args = parser.parse_args()
+    # A benchmark that checks correctness returns non-zero when the check fails
+    raise SystemExit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
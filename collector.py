@@ -0,0 +1,121 @@
+"""A small stand-in for the central collector, to try forwarder.py locally.
+
+    python collector.py --port 8000 --folder collected/
+
+POST /ingest takes the batches forwarder.py sends and appends their scans to
+<folder>/<source>.csv. Batches are idempotent: a (source, sequence) pair that
+was already stored is acknowledged again but not written twice. GET /status
+shows the last sequence and scan count stored for every source. `--fail`
+answers every POST with 503, to simulate an outage.
+"""
+import argparse
+import csv
+import gzip
+import http.server
+import json
+import os
+import threading
+
+FIELDS = ["line", "time", "barcode"]
+
+
+class CollectorState:
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, "collector_state.json")
+        self.lock = threading.Lock()
+        self.fail = False
+        os.makedirs(folder, exist_ok=True)
+        try:
+            with open(self.path) as file:
+                self.sources = json.load(file)
+        except (FileNotFoundError, ValueError):
+            self.sources = {}  # source -> {"last_seq", "scans", "gaps"}
+
+    def store(self, batch):
+        """Append a batch's scans once; returns False if it was a duplicate."""
+        source, seq = str(batch["source"]), int(batch["seq"])
+        with self.lock:
+            entry = self.sources.setdefault(source, {"last_seq": 0, "scans": 0, "gaps": 0})
+            if seq <= entry["last_seq"]:
+                return False
+            if seq != entry["last_seq"] + 1:
+                entry["gaps"] += 1  # The forwarder sends in order, so a gap means batches were set aside
+            safe_name = "".join(c if c.isalnum() or c in "-_." else "_" for c in source)
+            with open(os.path.join(self.folder, f"{safe_name}.csv"), 'a', newline='') as file:
+                writer = csv.writer(file)
+                for scan in batch["scans"]:
+                    writer.writerow([seq] + [scan.get(field) for field in FIELDS])
+            entry["last_seq"] = seq
+            entry["scans"] += len(batch["scans"])
+            with open(f"{self.path}.tmp", 'w') as file:
+                json.dump(self.sources, file)
+            os.replace(f"{self.path}.tmp", self.path)
+            return True
+
+
+class CollectorHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections open between batches
+    disable_nagle_algorithm = True  # Headers and body are written separately; don't hold the body for an ACK
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/status":
+            self.reply(404, {"error": "not found"})
+            return
+        with self.server.state.lock:
+            self.reply(200, self.server.state.sources)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/ingest":
+            self.reply(404, {"error": "not found"})
+            return
+        if self.server.state.fail:
+            self.reply(503, {"error": "collector unavailable"})
+            return
+        try:
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            batch = json.loads(body)
+            stored = self.server.state.store(batch)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.reply(400, {"error": f"bad batch: {e}"})
+            return
+        self.reply(200, {"seq": batch["seq"], "duplicate": not stored})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host, port, folder, fail=False):
+    server = http.server.ThreadingHTTPServer((host, port), CollectorHandler)
+    server.state = CollectorState(folder)
+    server.state.fail = fail
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in collector for forwarder.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--folder", default="collected/")
+    parser.add_argument("--fail", action="store_true", help="answer every batch with 503")
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.folder, args.fail)
+    print(f"Collector listening on http://{args.host}:{args.port}/ingest, storing into {args.folder}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
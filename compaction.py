@@ -0,0 +1,191 @@
+import csv
+import io
+import logging
+import os
+import time
+from datetime import datetime
+
+logger = logging.getLogger("compaction")
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+MIN_AGE_SECONDS = 60  # Leave files alone that were written this recently
+EXPORT_BATCH_ROWS = 10000
+
+# pyarrow is optional: without it closed days simply stay as CSV. It is
+# imported on first use, so processes that never touch Parquet don't load it.
+pa = pc = pa_csv = pq = None
+pyarrow_missing = False
+
+
+def load_pyarrow():
+    """Import pyarrow into this module if needed; returns False if it is not installed."""
+    global pa, pc, pa_csv, pq, pyarrow_missing
+    if pa is None and not pyarrow_missing:
+        try:
+            import pyarrow
+            import pyarrow.compute
+            import pyarrow.csv
+            import pyarrow.parquet
+        except ImportError:
+            pyarrow_missing = True
+        else:
+            pa, pc, pa_csv, pq = pyarrow, pyarrow.compute, pyarrow.csv, pyarrow.parquet
+    return pa is not None
+
+
+def is_available():
+    return load_pyarrow()
+
+
+def parquet_path_for(csv_path):
+    return os.path.splitext(csv_path)[0] + ".parquet"
+
+
+def csv_path_for(parquet_path):
+    return os.path.splitext(parquet_path)[0] + ".csv"
+
+
+def compact_day_file(csv_path, keep_csv=False):
+    """Convert one closed day CSV to Parquet with typed columns.
+
+    The line name becomes a dictionary (categorical) column and the scan time a
+    timestamp, so later reads skip text parsing. The Parquet file is written to
+    a temporary name, fsynced and renamed before the CSV is removed.
+    """
+    load_pyarrow()
+    with open(csv_path, newline='', encoding='utf-8') as file:
+        header = next(csv.reader(file), None)
+    if not header:
+        return None
+    time_column = 'Time Scanned' if 'Time Scanned' in header else header[1]
+    line_column = header[0]
+    column_types = {name: pa.string() for name in header}
+    column_types[time_column] = pa.timestamp('s')
+    table = pa_csv.read_csv(
+        csv_path,
+        convert_options=pa_csv.ConvertOptions(column_types=column_types, timestamp_parsers=[TIME_FORMAT]),
+    )
+    table = table.set_column(header.index(line_column), line_column,
+                             pc.dictionary_encode(table.column(line_column)))
+
+    parquet_path = parquet_path_for(csv_path)
+    temp_path = parquet_path + ".tmp"
+    pq.write_table(table, temp_path, compression='zstd')
+    with open(temp_path, 'rb') as file:
+        os.fsync(file.fileno())
+    if pq.read_metadata(temp_path).num_rows != table.num_rows:
+        os.remove(temp_path)
+        raise IOError(f"Row count mismatch while compacting {csv_path}")
+    os.replace(temp_path, parquet_path)
+    if not keep_csv:
+        os.remove(csv_path)
+    return parquet_path
+
+
+def compact_closed_days(folder, keep_csv=False):
+    """Compact every day CSV in `folder` older than today that has no Parquet copy yet."""
+    if not is_available():
+        logger.warning("pyarrow is not installed (pip install -r requirements-parquet.txt), "
+                       "skipping compaction of closed days")
+        return []
+    today = datetime.now().strftime('%Y-%m-%d')
+    compacted = []
+    for entry in sorted(os.scandir(folder), key=lambda entry: entry.name):
+        if not entry.name.endswith('.csv') or entry.name[:10] >= today:
+            continue
+        if os.path.exists(parquet_path_for(entry.path)):
+            continue
+        if time.time() - entry.stat().st_mtime < MIN_AGE_SECONDS:
+            continue
+        try:
+            datetime.strptime(entry.name[:10], '%Y-%m-%d')
+            compact_day_file(entry.path, keep_csv)
+            compacted.append(entry.name)
+        except Exception as e:
+            logger.exception(f"Error compacting {entry.path}: {e}", extra={"file": entry.path})
+    if compacted:
+        logger.info(f"Compacted {len(compacted)} closed day file(s) to Parquet")
+    return compacted
+
+
+def read_day_table(parquet_path, columns=None):
+    """Load a compacted day with memory-mapped I/O (no copy of the column buffers)."""
+    load_pyarrow()
+    return pq.read_table(parquet_path, columns=columns, memory_map=True)
+
+
+def scan_minutes(parquet_path):
+    """Scans per minute of day, first and last scan time of a compacted day."""
+    import numpy as np  # Only the web app's history needs it; the scanner imports this module too
+
+    load_pyarrow()
+    schema = pq.read_schema(parquet_path)
+    time_column = 'Time Scanned' if 'Time Scanned' in schema.names else schema.names[1]
+    times = read_day_table(parquet_path, [time_column]).column(time_column)
+    minutes = np.zeros(1440, dtype=np.int64)
+    if len(times) == 0:
+        return minutes, None, None
+    minute_of_day = pc.add(pc.multiply(pc.hour(times), 60), pc.minute(times)).to_numpy(zero_copy_only=False)
+    minutes += np.bincount(minute_of_day, minlength=1440)[:1440]
+    first, last = pc.min_max(times).values()
+    return minutes, first.as_py().strftime(TIME_FORMAT), last.as_py().strftime(TIME_FORMAT)
+
+
+def read_barcodes(parquet_path):
+    """The set of barcodes of a compacted day."""
+    load_pyarrow()
+    schema = pq.read_schema(parquet_path)
+    column = 'Barcode' if 'Barcode' in schema.names else schema.names[-1]
+    return set(read_day_table(parquet_path, [column]).column(column).to_pylist())
+
+
+def find_rows(parquet_path, barcode):
+    """Scans of `barcode` in a compacted day, as dicts with the scan time."""
+    load_pyarrow()
+    schema = pq.read_schema(parquet_path)
+    column = 'Barcode' if 'Barcode' in schema.names else schema.names[-1]
+    time_column = 'Time Scanned' if 'Time Scanned' in schema.names else schema.names[1]
+    table = read_day_table(parquet_path, [time_column, column])
+    matches = table.filter(pc.equal(table.column(column), barcode))
+    return [{"time": stamp.strftime(TIME_FORMAT)} for stamp in matches.column(time_column).to_pylist()]
+
+
+def iter_csv_rows(parquet_path):
+    """Yield the rows of a compacted day as lists of strings, header first, in batches."""
+    load_pyarrow()
+    table = read_day_table(parquet_path)
+    yield table.column_names
+    for batch in table.to_batches(max_chunksize=EXPORT_BATCH_ROWS):
+        columns = []
+        for column in batch.columns:
+            if pa.types.is_timestamp(column.type):
+                # Parquet stores second timestamps as milliseconds; cast back so %S has no fraction
+                column = pc.strftime(column.cast(pa.timestamp('s')), format=TIME_FORMAT)
+            elif pa.types.is_dictionary(column.type):
+                column = column.cast(pa.string())
+            columns.append(column.to_pylist())
+        yield from zip(*columns)
+
+
+def iter_csv_bytes(parquet_path, include_header=True):
+    """Render a compacted day back to the exact CSV bytes scanner.py would have written."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    rows = iter_csv_rows(parquet_path)
+    header = next(rows)
+    if include_header:
+        writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def run_compaction(config, folder):
+    """Compact closed days if enabled under `compaction` in config.yaml."""
+    settings = getattr(config, 'compaction', None)
+    if settings is None or not getattr(settings, 'enabled', False):
+        return []
+    return compact_closed_days(folder, keep_csv=getattr(settings, 'keep_csv', False))
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import zipfile
+import zlib
+import compaction
+from history import parse_day_file_name
+
+CHUNK_SIZE = 64 * 1024
+EXPORT_FORMATS = ("csv", "gzip", "zip")
+
+
+class DaySource:
+    """One day file included in an export, with its size fixed when the export starts."""
+
+    def __init__(self, folder, file_name, date, line_name):
+        self.path = os.path.join(folder, file_name)
+        self.file_name = file_name
+        self.date = date
+        self.line = line_name
+        self.compacted = file_name.endswith('.parquet')
+        stat = os.stat(self.path)
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.header_size = 0
+        if not self.compacted:
+            with open(self.path, 'rb') as file:
+                self.header_size = len(file.readline())
+
+    @property
+    def csv_name(self):
+        return f"{self.date}_{self.line}.csv"
+
+    def chunks(self, include_header):
+        """Yield this day as CSV bytes, read lazily in CHUNK_SIZE pieces."""
+        if self.compacted:
+            yield from compaction.iter_csv_bytes(self.path, include_header)
+            return
+        with open(self.path, 'rb') as file:
+            if not include_header:
+                file.seek(self.header_size)
+            # Stop at the size seen when the export started, even if today's file keeps growing
+            remaining = self.size - file.tell()
+            while remaining > 0:
+                chunk = file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+def find_sources(folder, start, end, lines=None):
+    """Day files for [start, end] (YYYY-MM-DD), oldest first, CSV preferred over a Parquet copy."""
+    names = set(os.listdir(folder)) if os.path.isdir(folder) else set()
+    sources = []
+    for file_name in sorted(names):
+        parsed = parse_day_file_name(file_name)
+        if parsed is None or not start <= parsed[0] <= end or (lines and parsed[1] not in lines):
+            continue
+        if file_name.endswith('.parquet'):
+            if compaction.csv_path_for(file_name) in names or not compaction.is_available():
+                continue
+        sources.append(DaySource(folder, file_name, parsed[0], parsed[1]))
+    return sources
+
+
+def export_etag(sources, export_format):
+    """Strong validator over the exact set and versions of the files being exported."""
+    digest = hashlib.sha1(export_format.encode())
+    for source in sources:
+        digest.update(f"{source.file_name}:{source.size}:{source.mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+def csv_length(sources):
+    """Length of the merged CSV, or None when a compacted day makes it unknown up front."""
+    if any(source.compacted for source in sources):
+        return None
+    return sum(source.size - (source.header_size if n else 0) for n, source in enumerate(sources))
+
+
+def iter_csv(sources):
+    """All days merged into one CSV with a single header row."""
+    for n, source in enumerate(sources):
+        yield from source.chunks(include_header=n == 0)
+
+
+def iter_range(chunks, first, last):
+    """Bytes first..last (inclusive) of a chunk stream, skipping the rest without buffering it."""
+    position = 0
+    for chunk in chunks:
+        end = position + len(chunk)
+        if end > first and position <= last:
+            yield chunk[max(0, first - position):last + 1 - position]
+        if end > last:
+            break
+        position = end
+
+
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+class StreamBuffer:
+    """Write-only file object collecting what zipfile writes until the generator drains it."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def iter_zip(sources):
+    """A zip archive with one CSV per day file, produced incrementally."""
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for source in sources:
+            with archive.open(source.csv_name, 'w', force_zip64=True) as entry:
+                for chunk in source.chunks(include_header=True):
+                    entry.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            yield buffer.drain()
+    yield buffer.drain()
@@ -0,0 +1,334 @@
+import gzip
+import http.client
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timedelta
+import health
+import logs
+import metrics
+from history import parse_day_file_name
+from utils import load_config, config_store, CsvTail
+
+logger = logging.getLogger("forwarder")
+
+FOLDER_PATH = "data/"
+STATE_FILE_NAME = "state.json"
+POLL_INTERVAL = 0.5  # Seconds between looks at the day files for new rows
+BACKOFF_BASE = 1  # First retry delay after a failed send, doubled up to BACKOFF_MAX
+BACKOFF_MAX = 60
+KEEP_DAYS = 2  # Day files older than this are no longer tailed
+
+BATCHES_SENT = metrics.Counter("forwarder_batches_sent_total", "Batches accepted by the collector")
+SCANS_SENT = metrics.Counter("forwarder_scans_sent_total", "Scans delivered to the collector")
+SEND_ERRORS = metrics.Counter("forwarder_send_errors_total", "Failed attempts to send a batch")
+OUTBOX_BATCHES = metrics.Gauge("forwarder_outbox_batches", "Batches waiting in the outbox")
+SEND_SECONDS = metrics.Histogram("forwarder_send_seconds", "Time to send one batch and get the reply")
+
+
+class Outbox:
+    """Batches waiting for the collector, kept on disk so they survive restarts and outages.
+
+    Each batch is a file named after its sequence number holding the exact
+    request body. Adding a batch is a two-step commit: the body is written to
+    a temporary file, then state.json records the next sequence number and the
+    day-file positions the batch covers, then the file is renamed into place.
+    After a crash a temporary batch is kept if the state already counts it and
+    dropped otherwise, so its rows are read again and never sent twice.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.state_path = os.path.join(folder, STATE_FILE_NAME)
+        os.makedirs(folder, exist_ok=True)
+        self.state = self.load_state()
+        self.recover()
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {"next_seq": 1, "cursors": {}}
+
+    def save_state(self):
+        temp_path = f"{self.state_path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(self.state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.state_path)
+
+    def batch_path(self, seq):
+        return os.path.join(self.folder, f"{seq:012d}.batch")
+
+    def recover(self):
+        for name in os.listdir(self.folder):
+            if not name.endswith(".batch.tmp"):
+                continue
+            path = os.path.join(self.folder, name)
+            if int(name.split('.')[0]) < self.state["next_seq"]:
+                os.replace(path, path[:-len(".tmp")])
+            else:
+                os.remove(path)
+
+    def pending(self):
+        """Sequence numbers of the batches still to send, oldest first."""
+        return sorted(int(name.split('.')[0]) for name in os.listdir(self.folder) if name.endswith(".batch"))
+
+    def add(self, body, cursors):
+        """Store a request body as the next batch together with the positions it was read up to."""
+        seq = self.state["next_seq"]
+        temp_path = f"{self.batch_path(seq)}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(body)
+            file.flush()
+            os.fsync(file.fileno())
+        self.state = {"next_seq": seq + 1, "cursors": cursors}
+        self.save_state()
+        os.replace(temp_path, self.batch_path(seq))
+        return seq
+
+    def read(self, seq):
+        with open(self.batch_path(seq), 'rb') as file:
+            return file.read()
+
+    def remove(self, seq):
+        os.remove(self.batch_path(seq))
+
+
+class CollectorClient:
+    """POSTs batches to the collector over one reused (keep-alive) HTTP connection."""
+
+    def __init__(self, url, source, timeout=10, compress=True):
+        parsed = urllib.parse.urlsplit(url)
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path or "/"
+        self.source = source
+        self.timeout = timeout
+        self.compress = compress
+        self.conn = None
+
+    def connect(self):
+        connection_class = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        self.conn = connection_class(self.host, self.port, timeout=self.timeout)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+        self.conn = None
+
+    def send(self, seq, body):
+        """Send one batch; returns the HTTP status. Raises OSError/HTTPException on connection problems."""
+        if self.conn is None:
+            self.connect()
+        headers = {"Content-Type": "application/json", "X-Source": self.source, "X-Sequence": str(seq)}
+        if self.compress:
+            headers["Content-Encoding"] = "gzip"
+        try:
+            self.conn.request("POST", self.path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            response.read()  # Drain so the connection can be reused
+        except (OSError, http.client.HTTPException):
+            self.close()
+            raise
+        if response.will_close:
+            self.close()
+        return response.status
+
+
+class Forwarder:
+    """Tail accepted scans from the day files and forward them to a central collector in batches.
+
+    New rows become a batch once `batch_size` are waiting or the oldest has
+    waited `batch_interval` seconds. Batches go through the Outbox and are
+    sent strictly in sequence order; a failed send is retried with backoff
+    and nothing later is sent until it succeeds. The collector uses the
+    (source, sequence) pair to ignore batches it has already stored.
+    """
+
+    def __init__(self, settings, folder=None):
+        self.folder = folder or FOLDER_PATH
+        self.source = getattr(settings, 'source', None) or socket.gethostname()
+        self.batch_size = getattr(settings, 'batch_size', 200)
+        self.batch_interval = getattr(settings, 'batch_interval', 5)
+        self.compress = getattr(settings, 'compress', True)
+        self.outbox = Outbox(getattr(settings, 'outbox', 'outbox/'))
+        self.client = CollectorClient(getattr(settings, 'url', 'http://127.0.0.1:8000/ingest'), self.source,
+                                      getattr(settings, 'timeout', 10), self.compress)
+        self.tails = {}
+        for file_name, cursor in self.outbox.state["cursors"].items():
+            tail = CsvTail()
+            tail.path = os.path.join(self.folder, file_name)
+            tail.inode, tail.offset, tail.header = cursor["inode"], cursor["offset"], cursor["header"]
+            self.tails[file_name] = tail
+        self.rows = []
+        self.rows_since = None
+        self.failures = 0
+        self.retry_at = 0
+        self.last_error = None
+        self.last_sent = None
+
+    def cursors(self):
+        return {file_name: {"inode": tail.inode, "offset": tail.offset, "header": tail.header}
+                for file_name, tail in self.tails.items()}
+
+    def collect(self):
+        """Read rows appended to recent day files since the last call."""
+        oldest = (datetime.now().date() - timedelta(days=KEEP_DAYS)).strftime('%Y-%m-%d')
+        try:
+            names = os.listdir(self.folder)
+        except FileNotFoundError:
+            return
+        for file_name in sorted(names):
+            parsed = parse_day_file_name(file_name)
+            if parsed is None or not file_name.endswith('.csv') or parsed[0] < oldest:
+                continue
+            tail = self.tails.setdefault(file_name, CsvTail())
+            rows, _ = tail.read_new_rows(os.path.join(self.folder, file_name))
+            if not rows:
+                continue
+            line_column = tail.column('ProductionLineName', 0)
+            time_column = tail.column('Time Scanned', 1)
+            barcode_column = tail.column('Barcode', 2)
+            for row in rows:
+                if len(row) > max(line_column, time_column, barcode_column):
+                    self.rows.append({"line": row[line_column], "time": row[time_column],
+                                      "barcode": row[barcode_column], "file": file_name})
+            if self.rows_since is None:
+                self.rows_since = time.monotonic()
+        # Forget files that are gone (compacted) or too old to change again
+        for file_name in list(self.tails):
+            if file_name not in names or parse_day_file_name(file_name)[0] < oldest:
+                del self.tails[file_name]
+
+    def flush_rows(self, force=False):
+        """Move waiting rows into the outbox as one batch when a size or time threshold is reached."""
+        if not self.rows:
+            return None
+        if not force and len(self.rows) < self.batch_size and time.monotonic() - self.rows_since < self.batch_interval:
+            return None
+        seq = self.outbox.state["next_seq"]
+        payload = json.dumps({"source": self.source, "seq": seq, "created": datetime.now().isoformat(timespec='seconds'),
+                              "scans": self.rows}).encode('utf-8')
+        body = gzip.compress(payload, 6) if self.compress else payload
+        self.outbox.add(body, self.cursors())
+        logger.debug(f"Queued batch {seq} with {len(self.rows)} scans", extra={"seq": seq, "scans": len(self.rows)})
+        self.rows = []
+        self.rows_since = None
+        return seq
+
+    def send_pending(self):
+        """Send outbox batches in order until it is empty or a send fails."""
+        if time.monotonic() < self.retry_at:
+            return
+        for seq in self.outbox.pending():
+            body = self.outbox.read(seq)
+            started = time.perf_counter()
+            try:
+                status = self.client.send(seq, body)
+            except (OSError, http.client.HTTPException) as e:
+                self.send_failed(seq, f"{type(e).__name__}: {e}")
+                return
+            SEND_SECONDS.observe(time.perf_counter() - started)
+            if status >= 500 or status in (408, 429):
+                self.send_failed(seq, f"HTTP {status}")
+                return
+            if status >= 400:
+                # The collector will never take this batch; set it aside instead of blocking the queue
+                os.replace(self.outbox.batch_path(seq), self.outbox.batch_path(seq) + ".rejected")
+                logger.error(f"Collector rejected batch {seq} with HTTP {status}, moved aside", extra={"seq": seq})
+                continue
+            self.outbox.remove(seq)
+            BATCHES_SENT.inc()
+            SCANS_SENT.inc(len(json.loads(gzip.decompress(body) if self.compress else body)["scans"]))
+            self.failures = 0
+            self.last_error = None
+            self.last_sent = datetime.now().isoformat(timespec='seconds')
+
+    def send_failed(self, seq, error):
+        SEND_ERRORS.inc()
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** self.failures)
+        self.failures += 1
+        self.retry_at = time.monotonic() + delay
+        self.last_error = error
+        logger.warning(f"Sending batch {seq} failed ({error}), retrying in {delay}s", extra={"seq": seq})
+
+    def status(self):
+        pending = self.outbox.pending()
+        OUTBOX_BATCHES.set(len(pending))
+        return {"outbox_batches": len(pending), "oldest_seq": pending[0] if pending else None,
+                "next_seq": self.outbox.state["next_seq"], "waiting_rows": len(self.rows),
+                "last_sent": self.last_sent, "last_error": self.last_error}
+
+    def run(self, wake):
+        """Forward until `wake` is set, then commit what was read to the outbox for the next run."""
+        while not wake.is_set():
+            self.collect()
+            self.flush_rows()
+            self.send_pending()
+            health.write_status(health.FORWARDER_HEALTH_PATH, self.status())
+            metrics.write_textfile("forwarder")
+            wake.wait(POLL_INTERVAL)
+        self.collect()
+        self.flush_rows(force=True)
+        self.client.close()
+
+
+def is_enabled(config):
+    return bool(getattr(getattr(config, 'forwarder', None), 'enabled', False))
+
+
+def run_forwarder():
+    """Forward scans while the `forwarder` section of config.yaml is enabled.
+
+    SIGHUP re-reads config.yaml and carries on with the new settings (an
+    invalid file is ignored); SIGTERM commits the waiting rows to the outbox
+    and exits. Unsent batches are picked up again on the next start.
+    """
+    config = load_config()
+    logs.setup_logging("forwarder", config)
+    if not is_enabled(config):
+        logger.info("Forwarder is disabled in config.yaml")
+        return
+    wake = threading.Event()
+    shutdown_requested = threading.Event()
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: wake.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: (shutdown_requested.set(), wake.set()))
+
+    forwarder = Forwarder(config.forwarder)
+    while True:
+        logger.info(f"Forwarding scans as {forwarder.source} to {forwarder.client.host}:{forwarder.client.port}"
+                    f"{forwarder.client.path}")
+        try:
+            forwarder.run(wake)
+        except KeyboardInterrupt:
+            shutdown_requested.set()
+        if shutdown_requested.is_set():
+            break
+        wake.clear()
+        try:
+            config_store.refresh()
+        except ValueError as e:
+            logger.error(f"Ignoring invalid config.yaml, keeping the running settings: {e}")
+            continue
+        if load_config() is config:
+            continue
+        config = load_config()
+        logs.apply_levels(config)
+        if not is_enabled(config):
+            logger.info("Forwarder was disabled in config.yaml")
+            break
+        forwarder = Forwarder(config.forwarder)
+
+
+if __name__ == "__main__":
+    run_forwarder()
@@ -0,0 +1,34 @@
+import json
+import os
+import time
+
+RUN_FOLDER = "run/"
+SCANNER_HEALTH_PATH = f"{RUN_FOLDER}scanner_health.json"  # Heartbeat written by scanner.py every second
+SUPERVISOR_STATUS_PATH = f"{RUN_FOLDER}supervisor.json"  # Service states written by main.py every second
+FORWARDER_HEALTH_PATH = f"{RUN_FOLDER}forwarder_health.json"  # Outbox state written by forwarder.py
+BRIDGE_HEALTH_PATH = f"{RUN_FOLDER}bridge_health.json"  # Port states written by port_fowarding.py
+STALE_SECONDS = 10  # A heartbeat or status file older than this means its writer is hung or gone
+
+
+def write_status(path, data):
+    """Replace a JSON status file atomically, stamped with the writer's pid and the current time."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump({"pid": os.getpid(), "time": time.time(), **data}, file)
+    os.replace(temp_path, path)
+
+
+def read_status(path):
+    """Load a status file with its age in seconds added, or None if it is missing or unreadable."""
+    try:
+        with open(path) as file:
+            data = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    data["age"] = round(time.time() - data.get("time", 0), 1)
+    return data
+
+
+def is_fresh(status):
+    return status is not None and status["age"] < STALE_SECONDS
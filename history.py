@@ -0,0 +1,207 @@
+import csv
+import json
+import os
+import re
+import threading
+import time
+import numpy as np
+import compaction
+from utils import CsvTail
+
+DAY_FILE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2})_(.+)\.(csv|parquet)$')
+INDEX_FILE_NAME = ".history_index.json"
+INDEX_VERSION = 1
+SAVE_INTERVAL = 30  # Seconds between index writes while only today's files keep growing
+
+
+def parse_day_file_name(file_name):
+    """Return (date, line name) for a day file name like 2024-05-01_Line1.csv (or .parquet), else None."""
+    match = DAY_FILE_PATTERN.match(file_name)
+    return (match.group(1), match.group(2)) if match else None
+
+
+def empty_summary(date, line_name):
+    return {
+        "date": date,
+        "line": line_name,
+        "count": 0,
+        "first": None,
+        "last": None,
+        "minutes": {},  # minute of day -> scans, for per-hour / per-segment aggregation
+        "inode": None,
+        "offset": 0,
+        "header": None,
+        "mtime_ns": None,
+        "size": 0,
+    }
+
+
+def add_rows(summary, rows, time_column):
+    """Fold newly read day-file rows into a summary."""
+    minutes = summary["minutes"]
+    for row in rows:
+        if len(row) <= time_column:
+            continue
+        stamp = row[time_column]
+        try:
+            minute = int(stamp[11:13]) * 60 + int(stamp[14:16])
+        except ValueError:
+            continue
+        key = str(minute)
+        minutes[key] = minutes.get(key, 0) + 1
+        summary["count"] += 1
+        if summary["first"] is None or stamp < summary["first"]:
+            summary["first"] = stamp
+        if summary["last"] is None or stamp > summary["last"]:
+            summary["last"] = stamp
+
+
+class HistoryIndex:
+    """Precomputed per-day summaries of every day file in the data folder.
+
+    Summaries are kept in a JSON index next to the data and refreshed only for
+    files whose mtime or size changed. A file that only grew (today's file) is
+    read from the offset where the previous summary stopped, so queries over
+    months of data cost a directory listing plus a few stat() calls.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.index_path = os.path.join(folder, INDEX_FILE_NAME)
+        self.lock = threading.Lock()
+        self.summaries = None  # file name -> summary
+        self.minute_arrays = {}  # file name -> scans per minute of day as a numpy array
+        self.saved_at = 0
+
+    def load(self):
+        try:
+            with open(self.index_path) as file:
+                data = json.load(file)
+            if data.get("version") == INDEX_VERSION:
+                return data["files"]
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        return {}
+
+    def save(self):
+        self.saved_at = time.monotonic()
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump({"version": INDEX_VERSION, "files": self.summaries}, file)
+        os.replace(temp_path, self.index_path)
+
+    def update_summary(self, file_name, date, line_name, stat):
+        """Bring one file's summary up to date, reading only what was appended since it was built."""
+        path = os.path.join(self.folder, file_name)
+        if file_name.endswith('.parquet'):
+            self.update_compacted_summary(file_name, date, line_name, stat)
+            return
+        summary = self.summaries.get(file_name)
+        if summary is None or summary["inode"] != stat.st_ino or stat.st_size < summary["offset"]:
+            summary = empty_summary(date, line_name)
+
+        tail = CsvTail()
+        tail.path, tail.inode, tail.offset, tail.header = path, summary["inode"], summary["offset"], summary["header"]
+        rows, reset = tail.read_new_rows(path)
+        if reset:
+            summary = empty_summary(date, line_name)
+        add_rows(summary, rows, tail.column('Time Scanned', 1))
+        summary.update(inode=tail.inode, offset=tail.offset, header=tail.header,
+                       mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        self.summaries[file_name] = summary
+        self.minute_arrays.pop(file_name, None)
+
+    def update_compacted_summary(self, file_name, date, line_name, stat):
+        """Summarize a compacted (Parquet) day; these never grow, so it is read once."""
+        minutes, first, last = compaction.scan_minutes(os.path.join(self.folder, file_name))
+        summary = empty_summary(date, line_name)
+        summary.update(count=int(minutes.sum()), first=first, last=last,
+                       minutes={str(minute): int(minutes[minute]) for minute in np.flatnonzero(minutes)},
+                       inode=stat.st_ino, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        self.summaries[file_name] = summary
+        self.minute_arrays[file_name] = minutes
+
+    def minute_array(self, file_name):
+        """Scans per minute of day for one file, cached as an array for fast aggregation."""
+        array = self.minute_arrays.get(file_name)
+        if array is None:
+            array = np.zeros(1440, dtype=np.int64)
+            for minute, count in self.summaries[file_name]["minutes"].items():
+                array[int(minute)] = count
+            self.minute_arrays[file_name] = array
+        return array
+
+    def refresh(self):
+        """Re-summarize new or changed day files and forget deleted ones."""
+        if self.summaries is None:
+            self.summaries = self.load()
+        changed = False
+        rewrite = not self.saved_at  # Always persist the first build
+        seen = set()
+        entries = list(os.scandir(self.folder))
+        names = {entry.name for entry in entries}
+        for entry in entries:
+            parsed = parse_day_file_name(entry.name)
+            if parsed is None:
+                continue
+            if entry.name.endswith('.parquet'):
+                # A day kept in both formats is counted once, from its CSV
+                if compaction.csv_path_for(entry.name) in names or not compaction.is_available():
+                    continue
+            seen.add(entry.name)
+            stat = entry.stat()
+            summary = self.summaries.get(entry.name)
+            if summary and summary["mtime_ns"] == stat.st_mtime_ns and summary["size"] == stat.st_size:
+                continue
+            # A file that only grew is today's; anything else is a past day being replaced
+            rewrite = rewrite or summary is None or stat.st_size < summary["size"]
+            self.update_summary(entry.name, parsed[0], parsed[1], stat)
+            changed = True
+        for file_name in set(self.summaries) - seen:
+            del self.summaries[file_name]
+            self.minute_arrays.pop(file_name, None)
+            changed = rewrite = True
+        # The index is only a cache of the CSVs (offsets and counts are saved together),
+        # so growth of today's file is persisted at most every SAVE_INTERVAL seconds
+        if changed and (rewrite or time.monotonic() - self.saved_at >= SAVE_INTERVAL):
+            self.save()
+
+    def days(self, start, end, lines=None):
+        """(summary, minute array) pairs for days in [start, end] (YYYY-MM-DD), optionally for some lines."""
+        with self.lock:
+            if not os.path.isdir(self.folder):
+                return []
+            self.refresh()
+            selected = [(summary, self.minute_array(file_name)) for file_name, summary in self.summaries.items()
+                        if start <= summary["date"] <= end and (not lines or summary["line"] in lines)]
+        return sorted(selected, key=lambda item: (item[0]["date"], item[0]["line"]))
+
+    def find_barcode(self, barcode, start, end, lines=None):
+        """Every scan of `barcode` in the day files of the range."""
+        matches = []
+        needle = barcode.encode('utf-8')
+        for summary, _ in self.days(start, end, lines):
+            path = os.path.join(self.folder, f"{summary['date']}_{summary['line']}.csv")
+            if not os.path.exists(path) and os.path.exists(compaction.parquet_path_for(path)):
+                for row in compaction.find_rows(compaction.parquet_path_for(path), barcode):
+                    matches.append({"date": summary["date"], "line": summary["line"],
+                                    "time": row["time"], "barcode": barcode})
+                continue
+            try:
+                with open(path, 'rb') as file:
+                    data = file.read()
+            except FileNotFoundError:
+                continue
+            # Cheap byte search first, parse only the files that contain the barcode
+            if needle not in data:
+                continue
+            reader = csv.reader(data.decode('utf-8', errors='replace').splitlines())
+            header = next(reader, None) or []
+            column = header.index('Barcode') if 'Barcode' in header else len(header) - 1
+            time_column = header.index('Time Scanned') if 'Time Scanned' in header else 1
+            for row in reader:
+                if len(row) > column and row[column] == barcode:
+                    matches.append({"date": summary["date"], "line": summary["line"],
+                                    "time": row[time_column] if len(row) > time_column else None,
+                                    "barcode": barcode})
+        return matches
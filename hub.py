@@ -0,0 +1,356 @@
+import collections
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import queue
+import select
+import struct
+import threading
+import time
+import metrics
+
+logger = logging.getLogger("hub")
+POLL_INTERVAL = 0.5  # Seconds between stat() checks when inotify is unavailable
+HEARTBEAT_SECONDS = 15  # Idle time before an SSE comment is sent to keep proxies from closing the stream
+CLIENT_QUEUE_SIZE = 32  # Pending events per client before it is considered too slow and dropped
+HISTORY_SIZE = 64  # Recent events kept per topic so a reconnecting client can resume from its Last-Event-ID
+SNAPSHOT_EVERY = 50  # Send the full state instead of a delta after this many deltas
+TOPIC_LINGER = 60  # Seconds a topic outlives its last subscriber, so reconnects resume instead of recomputing
+RETRY_MILLISECONDS = 5000  # Reconnect delay suggested to EventSource clients
+DISCONNECT_POLL = 1  # Seconds between checks for a client that went away, when the server can tell
+
+# inotify(7) event masks for files being written, created, moved or removed in the data folder
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+SSE_EVENTS = metrics.Counter("webapp_sse_events_total", "SSE messages queued for clients, by topic", ["topic"])
+SSE_DROPPED = metrics.Counter("webapp_sse_dropped_clients_total", "SSE clients dropped for falling behind", ["topic"])
+SSE_REFRESH_SECONDS = metrics.Histogram("webapp_sse_refresh_seconds", "Time to recompute a topic's payload", ["topic"])
+
+
+class InotifyWatcher:
+    """Wait for files to change in a folder using Linux inotify through libc."""
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {folder}")
+
+    def wait(self, timeout):
+        """Return the set of file names changed within `timeout` seconds (empty on timeout)."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        names = set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return names
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            names.add(os.fsdecode(data[pos:pos + length].rstrip(b'\0')))
+            pos += length
+        return names
+
+
+class PollingWatcher:
+    """Fallback watcher that stats the watched files every POLL_INTERVAL seconds."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.mtimes = {}
+
+    def wait(self, timeout, names=()):
+        time.sleep(min(timeout, POLL_INTERVAL))
+        changed = set()
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+                mtime = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                mtime = None
+            if self.mtimes.get(name) != mtime:
+                self.mtimes[name] = mtime
+                changed.add(name)
+        return changed
+
+
+def format_event(event_id, data, event=None):
+    """One SSE message; `event` None is the default "message" type."""
+    return (f"event: {event}\n" if event else "") + f"id: {event_id}\ndata: {data}\n\n"
+
+
+def diff_state(old, new):
+    """The top-level keys of `new` that changed since `old`, or None if only a full snapshot will do.
+
+    A list that kept its length is sent as {index: value} for the items that
+    changed, so one new scan costs one segment count instead of every label.
+    """
+    if old is None or old.keys() != new.keys():
+        return None
+    changes = {}
+    for key, value in new.items():
+        previous = old[key]
+        if value == previous:
+            continue
+        if isinstance(value, list) and isinstance(previous, list) and len(value) == len(previous):
+            changes[key] = {str(n): item for n, (item, was) in enumerate(zip(value, previous)) if item != was}
+        else:
+            changes[key] = value
+    return changes
+
+
+class Subscription:
+    """One SSE client's queue of pending (already formatted) SSE messages."""
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.queue = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.dropped = False
+
+    def events(self, disconnected=None):
+        """Yield SSE messages for this client, with heartbeat comments while idle.
+
+        `disconnected` is the server's check for a client that went away
+        (waitress provides one). It is polled every DISCONNECT_POLL seconds,
+        so a closed wallboard frees its worker without waiting for a write to fail.
+        """
+        poll = HEARTBEAT_SECONDS if disconnected is None else DISCONNECT_POLL
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            last_sent = time.monotonic()
+            while not self.dropped:
+                try:
+                    message = self.queue.get(timeout=poll)
+                except queue.Empty:
+                    if disconnected is not None and disconnected():
+                        break
+                    if time.monotonic() - last_sent >= HEARTBEAT_SECONDS:
+                        last_sent = time.monotonic()
+                        yield ": heartbeat\n\n"
+                    continue
+                if message is None:
+                    break
+                last_sent = time.monotonic()
+                yield message
+        finally:
+            self.topic.hub.unsubscribe(self)
+
+
+class Topic:
+    """A payload derived from one data file, recomputed once per change for all its subscribers.
+
+    Every change gets the next event ID from the hub. Subscribers receive a
+    "delta" event with only what changed, and every SNAPSHOT_EVERY changes a
+    full snapshot as a plain message. The last HISTORY_SIZE events are kept
+    so a client reconnecting with Last-Event-ID gets only what it missed.
+    """
+
+    def __init__(self, hub, key, path_func, compute):
+        self.hub = hub
+        self.key = key
+        self.path_func = path_func
+        self.compute = compute
+        self.subscribers = set()
+        self.path = None
+        self.state = None
+        self.last_id = None
+        self.snapshot = None  # Formatted snapshot of the current state, built when first needed
+        self.history = collections.deque(maxlen=HISTORY_SIZE)  # (event ID, formatted message)
+        self.deltas = 0  # Deltas sent since the last snapshot
+        self.idle_since = None
+        kind = key[0] if isinstance(key, tuple) else key
+        self.events_sent = SSE_EVENTS.labels(topic=kind)
+        self.clients_dropped = SSE_DROPPED.labels(topic=kind)
+        self.refresh_seconds = SSE_REFRESH_SECONDS.labels(topic=kind)
+
+    def refresh(self):
+        """Recompute the state and queue a delta (or snapshot) for every subscriber if it changed."""
+        started = time.perf_counter()
+        self.path = self.path_func()
+        state = self.compute()
+        self.refresh_seconds.observe(time.perf_counter() - started)
+        if state == self.state:
+            return
+        changes = diff_state(self.state, state)
+        self.state = state
+        self.last_id = self.hub.next_event_id()
+        self.snapshot = None
+        if changes is None or self.deltas >= SNAPSHOT_EVERY:
+            message = self.snapshot_message()
+            self.deltas = 0
+        else:
+            message = format_event(self.last_id, json.dumps(changes), "delta")
+            self.deltas += 1
+        self.history.append((self.last_id, message))
+        for subscription in list(self.subscribers):
+            try:
+                subscription.queue.put_nowait(message)
+                self.events_sent.inc()
+            except queue.Full:
+                # Too far behind, drop the client; its EventSource reconnects and resyncs
+                logger.warning(f"Dropping slow SSE client on {self.key}")
+                self.clients_dropped.inc()
+                subscription.dropped = True
+                self.subscribers.discard(subscription)
+
+    def snapshot_message(self):
+        if self.snapshot is None:
+            self.snapshot = format_event(self.last_id, json.dumps(self.state))
+        return self.snapshot
+
+    def resume(self, last_event_id):
+        """Messages bringing a client that last saw `last_event_id` up to date (a snapshot if unknown)."""
+        if last_event_id == self.last_id:
+            return []
+        ids = [event_id for event_id, _ in self.history]
+        if last_event_id in ids:
+            missed = [message for _, message in list(self.history)[ids.index(last_event_id) + 1:]]
+            if len(missed) < CLIENT_QUEUE_SIZE // 2:
+                return missed
+        return [self.snapshot_message()]
+
+
+class ChangeHub:
+    """Single background watcher feeding every SSE client through per-client queues.
+
+    Topics are created on first subscription and removed with their last
+    subscriber. The watcher thread uses inotify on the data folder when
+    available and falls back to polling file stats.
+    """
+
+    def __init__(self, folder, use_inotify=True):
+        self.folder = folder
+        self.use_inotify = use_inotify
+        self.lock = threading.Lock()
+        self.topics = {}
+        self.thread = None
+        self.watcher = None
+        self.closed = False  # Set while the web server shuts down: streams end and new ones are refused
+        self.max_subscribers = None  # Open streams allowed at once (server.max_streams), None for no limit
+        # Event IDs start from the clock so they keep increasing across web app restarts
+        self.last_event_id = time.time_ns() // 1000000
+
+    def next_event_id(self):
+        self.last_event_id += 1
+        return self.last_event_id
+
+    def subscribe(self, key, path_func, compute, last_event_id=None):
+        """Register a client for a topic and queue what it needs to be up to date.
+
+        A client resuming with a `last_event_id` still in the topic's history
+        gets only the events it missed; others get a snapshot. Returns None
+        when `max_subscribers` streams are already open.
+        """
+        with self.lock:
+            if self.max_subscribers is not None and \
+                    sum(len(topic.subscribers) for topic in self.topics.values()) >= self.max_subscribers:
+                return None
+            self.start()
+            topic = self.topics.get(key)
+            if topic is None:
+                topic = self.topics[key] = Topic(self, key, path_func, compute)
+                topic.refresh()
+            topic.idle_since = None
+            subscription = Subscription(topic)
+            if self.closed:
+                subscription.dropped = True
+                return subscription
+            topic.subscribers.add(subscription)
+            for message in topic.resume(last_event_id):
+                subscription.queue.put_nowait(message)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            topic = subscription.topic
+            topic.subscribers.discard(subscription)
+            if not topic.subscribers and topic.idle_since is None:
+                # Kept (and refreshed) for TOPIC_LINGER seconds in case the client reconnects
+                topic.idle_since = time.monotonic()
+
+    def close(self):
+        """End every open stream and refuse new ones, so the server's workers can finish and shut down."""
+        with self.lock:
+            self.closed = True
+            for topic in self.topics.values():
+                for subscription in topic.subscribers:
+                    subscription.dropped = True
+                    try:
+                        subscription.queue.put_nowait(None)
+                    except queue.Full:
+                        pass  # Its next get() returns at once and the loop sees `dropped`
+                topic.subscribers.clear()
+
+    def reopen(self):
+        """Accept subscribers again after close(), for a web server restarted in the same process."""
+        with self.lock:
+            self.closed = False
+
+    def expire_topics(self):
+        with self.lock:
+            now = time.monotonic()
+            for key, topic in list(self.topics.items()):
+                if topic.idle_since is not None and now - topic.idle_since > TOPIC_LINGER:
+                    del self.topics[key]
+
+    def notify(self, names=None):
+        """Recompute topics whose file is among `names` (all topics if None)."""
+        with self.lock:
+            for topic in list(self.topics.values()):
+                path = topic.path_func()
+                if names is None or path != topic.path or os.path.basename(path) in names:
+                    try:
+                        topic.refresh()
+                    except Exception as e:
+                        logger.exception(f"Error refreshing SSE topic {topic.key}: {e}")
+
+    def subscriber_count(self, kind=None):
+        """Connected SSE clients, optionally only those of one kind of topic ("data", "visual")."""
+        with self.lock:
+            return sum(len(topic.subscribers) for key, topic in self.topics.items()
+                       if kind is None or (key[0] if isinstance(key, tuple) else key) == kind)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        os.makedirs(self.folder, exist_ok=True)
+        if self.use_inotify:
+            try:
+                self.watcher = InotifyWatcher(self.folder)
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify unavailable ({e}), polling {self.folder} for changes")
+        if self.watcher is None:
+            self.watcher = PollingWatcher(self.folder)
+        self.thread = threading.Thread(target=self.run, name="change-hub", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                if isinstance(self.watcher, PollingWatcher):
+                    with self.lock:
+                        names = {os.path.basename(topic.path_func()) for topic in self.topics.values()}
+                    changed = self.watcher.wait(1, names)
+                else:
+                    changed = self.watcher.wait(1)
+                # Also runs on timeouts so topics notice a new day file after midnight
+                self.notify(changed)
+                self.expire_topics()
+            except Exception as e:
+                logger.exception(f"Error in change hub: {e}")
+                time.sleep(1)
@@ -0,0 +1,87 @@
+import json
+import logging
+import os
+import socket
+import threading
+
+logger = logging.getLogger("ipc")
+DEFAULT_SOCKET_PATH = "run/scan_events.sock"
+MAX_EVENT_BYTES = 4096
+
+
+def get_socket_path(config):
+    """Path of the scan event socket, or None when the push channel is disabled in config.yaml."""
+    ipc = getattr(config, 'ipc', None)
+    if ipc is None or not getattr(ipc, 'enabled', False):
+        return None
+    return getattr(ipc, 'socket_path', DEFAULT_SOCKET_PATH)
+
+
+def remove_socket(path):
+    """Delete a socket file left behind by a previous run."""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class ScanPublisher:
+    """Send accepted scans to the web process over a Unix datagram socket.
+
+    Publishing never blocks the scan loop: if the web process is not running
+    or its buffer is full the event is dropped, and the dashboard still picks
+    the scan up from the CSV, which remains the durable record.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def publish(self, event):
+        try:
+            self.sock.sendto(json.dumps(event).encode('utf-8'), self.path)
+            return True
+        except (FileNotFoundError, ConnectionRefusedError, BlockingIOError):
+            return False
+
+    def close(self):
+        self.sock.close()
+
+
+class ScanListener:
+    """Receive scan events published by the scanner process and hand them to a callback."""
+
+    def __init__(self, path, callback):
+        self.path = path
+        self.callback = callback
+        self.sock = None
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        remove_socket(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.thread = threading.Thread(target=self.run, name="scan-listener", daemon=True)
+        self.thread.start()
+        logger.info(f"Listening for scan events on {self.path}")
+
+    def run(self):
+        while True:
+            try:
+                data = self.sock.recv(MAX_EVENT_BYTES)
+                self.callback(json.loads(data))
+            except OSError:
+                break  # Socket closed
+            except Exception as e:
+                logger.exception(f"Error handling scan event: {e}")
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            remove_socket(self.path)
@@ -0,0 +1,131 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from datetime import datetime
+import metrics
+
+LOG_FOLDER = "logs/"
+QUEUE_SIZE = 10000  # Records waiting for the writer thread before new ones are dropped
+CONSOLE_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+active_handler = None  # The DroppingQueueHandler installed by setup_logging() in this process
+# Attributes every LogRecord has; anything else was passed in `extra` and becomes a JSON field
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any `extra` fields (line, barcode, ...)."""
+
+    def __init__(self, process_name):
+        super().__init__()
+        self.process_name = process_name
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "process": self.process_name,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the caller: when the writer falls behind, records are dropped."""
+
+    def __init__(self, log_queue, dropped_counter=None):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.dropped_counter = dropped_counter  # Counter exporting `dropped`, see setup_logging()
+
+    def prepare(self, record):
+        # The listener runs in this process, so only the arguments are merged here;
+        # formatting (and the traceback of exc_info) is left to the listener thread
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped_counter is not None:
+                self.dropped_counter.inc()
+
+
+def make_file_handler(path, settings):
+    """Rotate by size (`max_bytes`, default) or by time (`when`, e.g. "midnight")."""
+    backup_count = getattr(settings, 'backup_count', 7)
+    when = getattr(settings, 'when', None)
+    if when:
+        return logging.handlers.TimedRotatingFileHandler(path, when=when, backupCount=backup_count, encoding='utf-8')
+    return logging.handlers.RotatingFileHandler(path, maxBytes=getattr(settings, 'max_bytes', 10 * 1024 * 1024),
+                                                backupCount=backup_count, encoding='utf-8')
+
+
+def setup_logging(process_name, config=None, console=None, registry=metrics.REGISTRY):
+    """Send this process's logging through a queue to a JSON log file and the console.
+
+    Callers only pay for putting the record on a queue; formatting and writing
+    happen on a listener thread. Settings come from the `logging` section of
+    config.yaml: level, levels (per logger name), folder, max_bytes or when,
+    backup_count and console_level. `console` is the console stream (default
+    stderr). Records dropped on a full queue are counted in
+    <process_name>_log_records_dropped_total on `registry`, the one this
+    process publishes. Returns the queue handler.
+    """
+    global active_handler
+    if active_handler is not None:
+        # Services sharing one process (main.py's in-process mode) share the first setup
+        apply_levels(config)
+        return active_handler
+    settings = getattr(config, 'logging', None)
+    folder = getattr(settings, 'folder', LOG_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+
+    file_handler = make_file_handler(os.path.join(folder, f"{process_name}.log"), settings)
+    file_handler.setFormatter(JsonFormatter(process_name))
+    console_handler = logging.StreamHandler(console)
+    console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+    console_handler.setLevel(getattr(settings, 'console_level', 'INFO').upper())
+
+    # Named per process, like the other families, so /metrics never repeats one
+    dropped_counter = metrics.Counter(f"{process_name}_log_records_dropped_total",
+                                      "Log records dropped because the log writer thread fell behind",
+                                      registry=registry).labels()  # Exported as 0 until the first drop
+    queue_handler = DroppingQueueHandler(queue.Queue(QUEUE_SIZE), dropped_counter)
+    listener = logging.handlers.QueueListener(queue_handler.queue, file_handler, console_handler,
+                                              respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # Flush what is still queued on exit
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    apply_levels(config)
+    active_handler = queue_handler
+    return queue_handler
+
+
+def apply_levels(config):
+    """Set the root level and per-logger levels from config.yaml (also used on a config reload)."""
+    settings = getattr(config, 'logging', None)
+    logging.getLogger().setLevel(getattr(settings, 'level', 'INFO').upper())
+    levels = getattr(settings, 'levels', None)
+    for name, level in (levels.to_dict().items() if levels is not None else []):
+        logging.getLogger(name).setLevel(str(level).upper())
+    # The per-request access log of the development and threaded servers
+    if levels is None or not hasattr(levels, 'werkzeug'):
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
@@ -1,145 +1,436 @@
+import logging
 import os
+import signal
 import time
 import subprocess
 import threading
+import urllib.error
+import urllib.request
 from datetime import datetime, timedelta
 import sys
 
-# Import the necessary modules from your previous code
-from flask import Flask, jsonify, render_template, request, redirect, url_for
-from scanner import listen_to_scanner
-from webapp import app as webapp
-from utils import load_config, modify_config, check_csv_exists, check_folder_exists
+# The services' own modules are imported only when they run on a thread (supervisor.mode: threads)
+from utils import (load_config, load_config_data, config_store, check_csv_exists, check_folder_exists,
+                   get_line_configs)
+from ipc import get_socket_path, remove_socket
+from compaction import run_compaction
+from health import (SCANNER_HEALTH_PATH, SUPERVISOR_STATUS_PATH, FORWARDER_HEALTH_PATH, BRIDGE_HEALTH_PATH,
+                    read_status, write_status, is_fresh)
+import logs
+import metrics
+
+logger = logging.getLogger("main")
 
-CONFIG_FILE = 'config.yaml'
 FOLDER_PATH = "data/"
-LAST_MODIFIED = None
-flask_process = None  # Track Flask process
-scanner_process = None  # Track scanner process
-daily_restart_scheduled = False  # Track if daily restart is scheduled
+LAST_CONFIG = None  # Last valid config.yaml contents, to tell which sections an edit touched
+RESTART_SECTIONS = ('server', 'ipc')  # Sockets bound at startup; changing these still needs a restart
+MAINTENANCE_DELAY = 120  # Seconds after midnight before closed days are compacted
+PROBE_INTERVAL = 5  # Seconds between health probes of a running service
+PROBE_TIMEOUT = 3
+MAX_PROBE_FAILURES = 3  # Consecutive failed probes before a service is restarted
+STARTUP_GRACE = 30  # Seconds a freshly started service has to pass its first probe
+STOP_TIMEOUT = 15  # Seconds a service gets to drain after SIGTERM before it is killed
+BACKOFF_BASE = 1  # First restart delay in seconds, doubled after every unstable run
+BACKOFF_MAX = 60
+STABLE_SECONDS = 60  # A run this long resets the backoff
+RUN_MODE = 'processes'  # supervisor.mode, read at startup: 'threads' runs the scanner and web app inside main.py
+
+# In threads mode the services' metrics share this process, so main.py keeps its own registry
+SUPERVISOR_METRICS = metrics.Registry()
+RESTARTS = metrics.Counter("supervisor_restarts_total", "Services restarted after exiting or failing health checks",
+                           ["service"], registry=SUPERVISOR_METRICS)
+SERVICE_UP = metrics.Gauge("supervisor_service_up", "1 while the service is running and passed its last probe",
+                           ["service"], registry=SUPERVISOR_METRICS)
+
 
+# Create today's CSV file for every configured production line
+def verify_csv_files():
+    config = load_config()
+    current_date = datetime.now().strftime('%Y-%m-%d')
+    for line in get_line_configs(config):
+        csv_file_name = f"{FOLDER_PATH}{current_date}_{line.name}.csv"
+        check_csv_exists(csv_file_name, line.header)
+        logger.debug(f"Verified CSV file: {csv_file_name}")
 
-# Function to monitor the config file for changes
+
+# Clear a scan event socket left by a previous run; the web process binds a fresh one
+def prepare_ipc_socket():
+    socket_path = get_socket_path(load_config())
+    if socket_path:
+        check_folder_exists(os.path.dirname(socket_path) or '.')
+        remove_socket(socket_path)
+    return socket_path
+
+
+# Function to monitor the config file for changes.
+# config_store only reports edits that change the content and validate, so
+# saving the file without changes (or an admin save, which is one atomic
+# write) reloads the services at most once. In threads mode an admin save
+# updates this process's store directly, so changes arrive by subscription.
 def monitor_config():
-    global LAST_MODIFIED
+    config_changed = threading.Event()
+    config_store.subscribe(lambda snapshot: config_changed.set())
     while True:
-        # Check if the config file has been modified
         try:
-            file_mod_time = os.path.getmtime(CONFIG_FILE)
-            if LAST_MODIFIED is None:
-                LAST_MODIFIED = file_mod_time
-            elif file_mod_time != LAST_MODIFIED:
-                print(f"Config file modified at {datetime.now()}. Restarting services...")
-                LAST_MODIFIED = file_mod_time
-                restart_services()  # Restart services when config changes
+            config_store.refresh()
+        except ValueError as e:
+            logger.error(f"Invalid config.yaml, services keep the previous settings: {e}")
         except Exception as e:
-            print(f"Error while checking config file: {e}")
-        time.sleep(1)  # Check every 1 second
+            logger.exception(f"Error while checking config file: {e}")
+        # Check every 1 second
+        if config_changed.wait(1):
+            config_changed.clear()
+            logger.info(f"Config file modified at {datetime.now()}. Reloading services...")
+            try:
+                apply_config_change()
+            except Exception as e:
+                logger.exception(f"Error while applying the config change: {e}")
+
+
+# Hand a config edit to the running services, restarting them only when they cannot reload it
+def apply_config_change():
+    global LAST_CONFIG
+    data = load_config_data()
+    previous, LAST_CONFIG = LAST_CONFIG, data
+    logs.apply_levels(load_config())
+    update_optional_services(data)
+    if previous is None or any(previous.get(key) != data.get(key) for key in RESTART_SECTIONS):
+        restart_services()
+    else:
+        reload_services()
+
+
+# Tell both services to re-read config.yaml in place (SIGHUP); scans keep flowing meanwhile
+def reload_services():
+    check_folder_exists(FOLDER_PATH)
+    verify_csv_files()
+    with supervisor_lock:
+        # A service that is down picks the new config up when the supervisor restarts it
+        for service in SERVICES:
+            if service.is_running():
+                service.process.send_signal(signal.SIGHUP)
+    logger.info("Services reloaded without a restart.")
 
 
 # Function to restart both services (Flask and barcode scanner)
 def restart_services():
-    global flask_process, scanner_process
-
-    # Stop the running processes if they exist
-    if flask_process:
-        print("Stopping Flask WebApp...")
-        flask_process.terminate()  # Terminate the Flask process
-        flask_process = None  # Reset the flask_process variable
-    if scanner_process:
-        print("Stopping Barcode Scanner Service...")
-        scanner_process.terminate()  # Terminate the scanner process
-        scanner_process = None  # Reset the scanner_process variable
-
-    # Ensure the data folder exists
-    check_folder_exists(FOLDER_PATH)
-    
-    # Create the CSV file for today if it doesn't exist
-    config = load_config()
-    current_date = datetime.now().strftime('%Y-%m-%d')
-    csv_file_name = f"{FOLDER_PATH}{current_date}_{config.name}.csv"
-    check_csv_exists(csv_file_name, config.header)
-    print(f"Verified CSV file: {csv_file_name}")
+    with supervisor_lock:
+        # Ensure the data folder exists
+        check_folder_exists(FOLDER_PATH)
 
-    # Restart the barcode scanner service
-    print("Restarting Barcode Scanner Service...")
-    scanner_process = subprocess.Popen([sys.executable, 'scanner.py'])
+        # Create the CSV files for today if they don't exist
+        verify_csv_files()
+        prepare_ipc_socket()
 
-    # Restart Flask web application
-    print("Restarting Flask WebApp...")
-    flask_process = subprocess.Popen([sys.executable, 'webapp.py'])
+        # Each service is stopped and started again on its own thread, so the
+        # scanner is back up without waiting for the web app to close its streams
+        restarts = [threading.Thread(target=service.restart, name=f"restart {service.name}") for service in SERVICES]
+        for thread in restarts:
+            thread.start()
+        for thread in restarts:
+            thread.join()
 
-    print("Services restarted successfully.")
+    logger.info("Services restarted successfully.")
 
 
-# Schedule daily restart
-def schedule_daily_restart():
-    global daily_restart_scheduled
-    
+# Run the nightly housekeeping in place; the services roll over to the new day files themselves
+def schedule_daily_maintenance():
     while True:
         now = datetime.now()
-        # Calculate time until midnight
-        tomorrow = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
-        seconds_until_midnight = (tomorrow - now).total_seconds()
-        
-        print(f"Daily restart scheduled in {seconds_until_midnight/3600:.2f} hours")
-        
-        # Sleep until midnight
-        time.sleep(seconds_until_midnight)
-        
-        print(f"Performing scheduled daily restart at {datetime.now()}")
-        restart_services()
-        
-        # Sleep for 5 minutes after restart
-        print("Services will be paused for 5 minutes...")
-        time.sleep(300)  # 5 minutes in seconds
-        
-        print("Resuming services after scheduled maintenance")
-        restart_services()
+        # Give the scanner time to switch files so yesterday's are closed and old enough to compact
+        next_run = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1, seconds=MAINTENANCE_DELAY)
+        seconds_until_run = (next_run - now).total_seconds()
+
+        logger.info(f"Daily maintenance scheduled in {seconds_until_run/3600:.2f} hours")
+        time.sleep(seconds_until_run)
+
+        logger.info(f"Performing daily maintenance at {datetime.now()}")
+        try:
+            verify_csv_files()
+            # Yesterday's files are closed now, convert them to Parquet if enabled
+            run_compaction(load_config(), FOLDER_PATH)
+        except Exception as e:
+            logger.exception(f"Error during daily maintenance: {e}")
+
+
+# Health probe for the scanner: a fresh heartbeat from this process with every line thread alive
+def scanner_is_healthy(service):
+    status = read_status(SCANNER_HEALTH_PATH)
+    if not is_fresh(status) or status["pid"] != service.process.pid:
+        return False
+    return all(line["alive"] for line in status["lines"].values())
+
+
+# Health probe for the forwarder: a fresh heartbeat from this process (an unreachable collector is not a failure)
+def forwarder_is_healthy(service):
+    status = read_status(FORWARDER_HEALTH_PATH)
+    return is_fresh(status) and status["pid"] == service.process.pid
+
+
+# Health probe for the serial bridge: a fresh heartbeat (an unplugged port is retried, not a failure)
+def bridge_is_healthy(service):
+    status = read_status(BRIDGE_HEALTH_PATH)
+    return is_fresh(status) and status["pid"] == service.process.pid
+
+
+# Health probe for the web app: /healthz answers at all (503 only reports a degraded service)
+def webapp_is_healthy(service):
+    server_config = getattr(load_config(), 'server', None)
+    host = getattr(server_config, 'host', '0.0.0.0')
+    port = getattr(server_config, 'port', 5000)
+    url = f"http://{'127.0.0.1' if host == '0.0.0.0' else host}:{port}/healthz"
+    try:
+        with urllib.request.urlopen(url, timeout=PROBE_TIMEOUT):
+            return True
+    except urllib.error.HTTPError:
+        return True
+    except Exception:
+        return False
+
+
+class ServiceThread:
+    """A service function running on a thread of main.py, behind the part of subprocess.Popen that Service uses.
+
+    The function gets (stop, reload) events in place of SIGTERM and SIGHUP.
+    A thread cannot be killed, so one that ignores `stop` is left behind.
+    """
+
+    def __init__(self, name, target):
+        self.pid = os.getpid()
+        self.returncode = None
+        self.stop_requested = threading.Event()
+        self.reload_requested = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(target,), name=name, daemon=True)
+        self.thread.start()
+
+    def run(self, target):
+        try:
+            target(self.stop_requested, self.reload_requested)
+            self.returncode = 0
+        except Exception as e:
+            logger.exception(f"{self.thread.name} failed: {e}")
+            self.returncode = 1
+
+    def poll(self):
+        return None if self.thread.is_alive() else self.returncode
+
+    def send_signal(self, signum):
+        if signum == signal.SIGHUP:
+            self.reload_requested.set()
+        else:
+            self.terminate()
+
+    def terminate(self):
+        self.stop_requested.set()
+
+    def kill(self):
+        logger.error(f"{self.thread.name} did not stop and cannot be killed in threads mode; abandoning it")
+        self.returncode = -signal.SIGKILL
+
+    def wait(self, timeout=None):
+        if self.returncode is None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                raise subprocess.TimeoutExpired(self.thread.name, timeout)
+        return self.returncode
+
+
+class Service:
+    """A supervised child process, or a thread of main.py in threads mode.
+
+    It is restarted when it exits or fails MAX_PROBE_FAILURES health probes in a
+    row. Restarts back off exponentially from BACKOFF_BASE up to BACKOFF_MAX
+    seconds, and the backoff resets once a run lasted STABLE_SECONDS. Services
+    with a `target` function run it on a ServiceThread in threads mode.
+    """
+
+    def __init__(self, name, script, probe, target=None):
+        self.name = name
+        self.script = script
+        self.probe = probe
+        self.target = target
+        self.process = None
+        self.started_at = None
+        self.ready = False  # Passed a health probe since it was last started
+        self.restarts = 0
+        self.failures = 0  # Consecutive unstable runs, for the backoff
+        self.probe_failures = 0
+        self.last_probe = 0
+        self.last_exit = None
+        self.next_start = 0
+        label = os.path.splitext(script)[0]
+        self.restart_counter = RESTARTS.labels(service=label)
+        SERVICE_UP.labels(service=label).set_function(
+            lambda: int(self.is_running() and self.ready and self.probe_failures == 0))
+
+    def start(self):
+        if RUN_MODE == 'threads' and self.target is not None:
+            self.process = ServiceThread(self.name, self.target)
+        else:
+            self.process = subprocess.Popen([sys.executable, self.script])
+        self.started_at = time.monotonic()
+        self.ready = False
+        self.probe_failures = 0
+
+    def stop(self):
+        """Ask the process to exit (SIGTERM) and kill it if it has not within STOP_TIMEOUT seconds."""
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"{self.name} did not stop within {STOP_TIMEOUT}s, killing it")
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+    def restart(self):
+        # SIGTERM lets the scanner commit what it has read before it starts again
+        if self.process is not None:
+            logger.info(f"Stopping {self.name}...")
+            self.stop()
+        logger.info(f"Restarting {self.name}...")
+        self.start()
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def check(self):
+        """Probe the service and schedule a restart with backoff if it died or stopped answering."""
+        now = time.monotonic()
+        if self.process is None:
+            if now >= self.next_start:
+                logger.info(f"Starting {self.name}" + (f" (restart {self.restarts})" if self.restarts else ""))
+                self.start()
+            return
+        code = self.process.poll()
+        if code is None:
+            if now - self.last_probe < PROBE_INTERVAL:
+                return
+            self.last_probe = now
+            if self.probe(self):
+                self.ready = True
+                self.probe_failures = 0
+                return
+            # Slow starts get STARTUP_GRACE seconds before failed probes count
+            if self.ready or now - self.started_at > STARTUP_GRACE:
+                self.probe_failures += 1
+            if self.probe_failures < MAX_PROBE_FAILURES:
+                return
+            logger.warning(f"{self.name} failed {self.probe_failures} health checks, restarting it")
+            self.stop()
+        else:
+            logger.warning(f"{self.name} exited with code {code}")
+            self.last_exit = code
+            self.process = None
+        if now - self.started_at >= STABLE_SECONDS:
+            self.failures = 0
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** self.failures)
+        self.failures += 1
+        self.restarts += 1
+        self.restart_counter.inc()
+        self.next_start = now + delay
+        logger.info(f"Restarting {self.name} in {delay:.0f}s")
+
+    def status(self):
+        return {
+            "pid": self.process.pid if self.process is not None else None,
+            "running": self.is_running(),
+            "ready": self.ready,
+            "restarts": self.restarts,
+            "last_exit": self.last_exit,
+            "uptime": round(time.monotonic() - self.started_at) if self.is_running() else None,
+        }
 
 
 # Run Flask web app
-def run_flask():
-    print("Starting Flask Web Application...")
-    webapp.run(debug=True, host="0.0.0.0", port=5000)
+def run_flask(stop=None, reload=None):
+    from webapp import serve as serve_webapp
+
+    logger.info("Starting Flask Web Application...")
+    serve_webapp(stop)  # Config edits reach it through config_store, so `reload` is not needed
 
 
 # Run barcode scanner service
-def run_scanner():
-    print("Starting Barcode Scanner Service...")
-    listen_to_scanner()
+def run_scanner(stop=None, reload=None):
+    from scanner import listen_to_scanner
+
+    logger.info("Starting Barcode Scanner Service...")
+    listen_to_scanner(stop, reload)
+
+
+SERVICES = [
+    Service("Barcode Scanner Service", 'scanner.py', scanner_is_healthy, run_scanner),
+    Service("Flask WebApp", 'webapp.py', webapp_is_healthy, run_flask),
+]
+# Supervised only while their config.yaml section has `enabled: true`
+OPTIONAL_SERVICES = {
+    'forwarder': Service("Scan Forwarder", 'forwarder.py', forwarder_is_healthy),
+    'bridge': Service("Serial Bridge", 'port_fowarding.py', bridge_is_healthy),
+}
+supervisor_lock = threading.Lock()  # Held while services are checked, started or stopped
+
+
+# Add or remove the optional services to match config.yaml; disabling one stops its process
+def update_optional_services(data):
+    with supervisor_lock:
+        for section, service in OPTIONAL_SERVICES.items():
+            enabled = bool((data.get(section) or {}).get('enabled'))
+            if enabled and service not in SERVICES:
+                SERVICES.append(service)
+            elif not enabled and service in SERVICES:
+                logger.info(f"Stopping {service.name}...")
+                service.stop()
+                SERVICES.remove(service)
+
+
+# Check every service once a second and publish their states for /healthz
+def supervise(shutdown_requested):
+    while not shutdown_requested.wait(1):
+        with supervisor_lock:
+            for service in SERVICES:
+                try:
+                    service.check()
+                except Exception as e:
+                    logger.exception(f"Error while supervising {service.name}: {e}")
+            write_status(SUPERVISOR_STATUS_PATH, {"services": {service.name: service.status() for service in SERVICES}})
+            metrics.write_textfile("supervisor", SUPERVISOR_METRICS)
 
 
 def main():
-    global flask_process, scanner_process
+    global LAST_CONFIG, RUN_MODE
 
+    logs.setup_logging("main", load_config(), registry=SUPERVISOR_METRICS)
+    RUN_MODE = getattr(getattr(load_config(), 'supervisor', None), 'mode', 'processes')
+    logger.info(f"Running the services as {RUN_MODE}")
     # Ensure correct data file exists before starting services
     check_folder_exists(FOLDER_PATH)
-    config = load_config()
-    current_date = datetime.now().strftime('%Y-%m-%d')
-    csv_file_name = f"{FOLDER_PATH}{current_date}_{config.name}.csv"
-    check_csv_exists(csv_file_name, config.header)
-    print(f"Verified CSV file: {csv_file_name}")
+    verify_csv_files()
+    socket_path = prepare_ipc_socket()
+    LAST_CONFIG = load_config_data()
+    update_optional_services(LAST_CONFIG)
 
     # Start the config monitor in a separate thread
     threading.Thread(target=monitor_config, daemon=True).start()
-    
-    # Start the daily restart scheduler in a separate thread
-    threading.Thread(target=schedule_daily_restart, daemon=True).start()
 
-    # Start subprocesses from the main thread
-    scanner_process = subprocess.Popen([sys.executable, 'scanner.py'])
-    flask_process = subprocess.Popen([sys.executable, 'webapp.py'])
+    # Start the daily maintenance scheduler in a separate thread
+    threading.Thread(target=schedule_daily_maintenance, daemon=True).start()
 
-    try:
-        # Keep the main thread alive to ensure services are running
-        while True:
-            time.sleep(1)  # Keep main thread alive
+    # SIGTERM (systemd, docker stop) shuts down as gracefully as Ctrl+C
+    shutdown_requested = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: shutdown_requested.set())
 
+    try:
+        # The supervisor starts the services on its first pass and keeps them running
+        supervise(shutdown_requested)
     except KeyboardInterrupt:
-        print("Shutting down services...")
-        flask_process.terminate()
-        scanner_process.terminate()
+        pass
+    logger.info("Shutting down services...")
+    with supervisor_lock:
+        for service in SERVICES:
+            service.stop()
+    if socket_path:
+        remove_socket(socket_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,231 @@
+import bisect
+import functools
+import os
+import threading
+import time
+
+METRICS_FOLDER = "run/metrics/"  # Each process writes its metrics here for the web app's /metrics
+STALE_SECONDS = 10  # Metrics files not rewritten for this long belong to a process that is gone
+# Latency buckets in seconds, from 10 us for in-memory checks up to 1 s for full recomputes
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Registry:
+    """The metrics of one process, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def render(self):
+        return "".join(metric.render() for metric in self.metrics)
+
+
+REGISTRY = Registry()
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named metric family; label values pick a child that holds the actual numbers.
+
+    Hot paths should keep the child returned by labels() instead of looking it
+    up on every update.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, **values):
+        key = tuple(str(values[name]) for name in self.labelnames)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(key, self.new_child())
+        return child
+
+    def remove(self, **values):
+        """Forget a child, e.g. a production line that was removed from config.yaml."""
+        with self.lock:
+            self.children.pop(tuple(str(values[name]) for name in self.labelnames), None)
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """(suffix, label values, extra labels, value) for every child."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}\n", f"# TYPE {self.name} {self.kind}\n"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.labelnames, values, extra)} {format_value(value)}\n")
+        return "".join(lines)
+
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    """A total that only goes up (scans, bytes, restarts)."""
+
+    kind = "counter"
+
+    def new_child(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        return [("", key, (), child.value) for key, child in list(self.children.items())]
+
+
+class GaugeValue:
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Compute the value when metrics are rendered instead of keeping it up to date."""
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+
+class Gauge(Metric):
+    """A value that goes up and down (connected ports, SSE subscribers)."""
+
+    kind = "gauge"
+
+    def new_child(self):
+        return GaugeValue()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+    def samples(self):
+        return [("", key, (), child.get()) for key, child in list(self.children.items())]
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot counts values above every bound
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(Metric):
+    """Distribution of durations, with cumulative buckets like prometheus_client renders them."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        samples = []
+        for key, child in list(self.children.items()):
+            with child.lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append(("_bucket", key, [("le", format_value(bound))], cumulative))
+            samples.append(("_sum", key, (), total))
+            samples.append(("_count", key, (), cumulative))
+        return samples
+
+
+def timed(histogram):
+    """Decorator recording each call's duration in a histogram (or one of its children)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def write_textfile(name, registry=REGISTRY, folder=METRICS_FOLDER):
+    """Publish a process's metrics as <folder>/<name>.prom, replaced atomically."""
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{name}.prom")
+    with open(f"{path}.tmp", 'w') as file:
+        file.write(registry.render())
+    os.replace(f"{path}.tmp", path)
+
+
+def read_textfiles(folder=METRICS_FOLDER):
+    """Metrics recently published by other processes, concatenated."""
+    parts = []
+    try:
+        entries = sorted(os.scandir(folder), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return ""
+    for entry in entries:
+        if not entry.name.endswith('.prom'):
+            continue
+        try:
+            if time.time() - entry.stat().st_mtime > STALE_SECONDS:
+                continue
+            with open(entry.path) as file:
+                parts.append(file.read())
+        except FileNotFoundError:
+            continue
+    return "".join(parts)
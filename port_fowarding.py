@@ -1,16 +1,199 @@
+"""Bridge a barcode scanner's serial port to another serial port (a legacy PC, PLC or label printer).
+
+    python port_fowarding.py [--in-port /dev/ttyACM0] [--out-port /dev/ttyUSB1] [--baudrate 9600]
+
+Settings default to the `bridge` section of config.yaml; main.py supervises the
+bridge while `bridge.enabled` is set. Bytes are copied both ways as they
+arrive, waiting in select() rather than polling, and a port that is unplugged
+is reopened every RETRY_SECONDS without stopping the other direction.
+
+To also record the scans, give the production line a `forward_port` in
+config.yaml instead: the scanner service then reads the port itself and copies
+every byte it reads to the forward port through ForwardPort.
+"""
+import argparse
+import logging
+import select
+import signal
+import threading
+import time
 import serial
+import health
+import logs
+import metrics
+from utils import load_config, config_store
+
+logger = logging.getLogger("bridge")
+
+RETRY_SECONDS = 5  # Wait before reopening a port that failed or was unplugged
+WRITE_TIMEOUT = 1  # Seconds a write may block on a device that stopped reading
+
+# The scanner imports ForwardPort too, so the bridge keeps its families in its own registry and
+# only the bridge process publishes them; a ForwardPort is handed the counters it should update
+BRIDGE_METRICS = metrics.Registry()
+BRIDGE_BYTES = metrics.Counter("bridge_bytes_total", "Bytes copied between the bridged ports", ["direction"],
+                               registry=BRIDGE_METRICS)
+BRIDGE_DROPPED = metrics.Counter("bridge_dropped_bytes_total", "Bytes lost because the other port was unavailable",
+                                 ["port"], registry=BRIDGE_METRICS)
+BRIDGE_ERRORS = metrics.Counter("bridge_port_errors_total", "Serial errors, each followed by a reopen", ["port"],
+                                registry=BRIDGE_METRICS)
+
+
+class ForwardPort:
+    """Write side of a bridge that survives its device being unplugged.
+
+    While the port is missing, writes are dropped (and counted) instead of
+    blocking the caller, and opening it is retried at most every
+    RETRY_SECONDS. Stale scans are not replayed to the device when it returns.
+    `dropped` and `errors` are the counters (labelled children) it updates.
+    """
+
+    def __init__(self, port, baudrate, dropped, errors):
+        self.port = port
+        self.baudrate = baudrate
+        self.ser = None
+        self.retry_at = 0
+        self.dropped = dropped
+        self.errors = errors
+
+    def open(self):
+        if self.ser is None and time.monotonic() >= self.retry_at:
+            try:
+                self.ser = serial.Serial(self.port, self.baudrate, timeout=0, write_timeout=WRITE_TIMEOUT)
+                logger.info(f"Opened {self.port} at {self.baudrate} baud", extra={"port": self.port})
+            except (serial.SerialException, OSError) as e:
+                self.failed(e)
+        return self.ser
+
+    def failed(self, error):
+        self.errors.inc()
+        logger.warning(f"Serial error on {self.port}: {error}. Retrying in {RETRY_SECONDS}s", extra={"port": self.port})
+        self.close()
+        self.retry_at = time.monotonic() + RETRY_SECONDS
+
+    def write(self, data):
+        """Copy bytes to the port; returns False if they were dropped."""
+        if self.open() is None:
+            self.dropped.inc(len(data))
+            return False
+        try:
+            self.ser.write(data)
+            return True
+        except (serial.SerialException, OSError) as e:
+            self.dropped.inc(len(data))
+            self.failed(e)
+            return False
+
+    def close(self):
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except (serial.SerialException, OSError):
+                pass
+        self.ser = None
+
+    def status(self):
+        return {"port": self.port, "connected": self.ser is not None}
+
+
+class SerialBridge:
+    """Copy bytes between two serial ports in both directions, blocking in select() until either has data."""
+
+    def __init__(self, in_port, out_port, baudrate=9600, out_baudrate=None):
+        self.ends = [ForwardPort(port, rate, BRIDGE_DROPPED.labels(port=port), BRIDGE_ERRORS.labels(port=port))
+                     for port, rate in ((in_port, baudrate), (out_port, out_baudrate or baudrate))]
+        self.copied = [BRIDGE_BYTES.labels(direction="in_to_out"), BRIDGE_BYTES.labels(direction="out_to_in")]
+
+    def run(self, stop):
+        next_heartbeat = 0
+        while not stop.is_set():
+            if time.monotonic() >= next_heartbeat:
+                health.write_status(health.BRIDGE_HEALTH_PATH, self.status())
+                metrics.write_textfile("bridge", BRIDGE_METRICS)
+                next_heartbeat = time.monotonic() + 1
+            ports = [end.open() for end in self.ends]
+            if None in ports:
+                # Bytes from the open side are copied only while the other side is there too
+                stop.wait(min(1, max(0.1, min(end.retry_at for end in self.ends if end.ser is None) - time.monotonic())))
+                continue
+            readable, _, _ = select.select(ports, [], [], 1)
+            for n, port in enumerate(ports):
+                if port not in readable:
+                    continue
+                source, sink = self.ends[n], self.ends[1 - n]
+                try:
+                    # select() saw data, so a read that returns nothing means the device is gone
+                    data = port.read(port.in_waiting or 1)
+                    if not data:
+                        raise serial.SerialException("device reports readiness to read but returned no data")
+                except (serial.SerialException, OSError) as e:
+                    source.failed(e)
+                    break
+                if sink.write(data):
+                    self.copied[n].inc(len(data))
+
+    def close(self):
+        for end in self.ends:
+            end.close()
+
+    def status(self):
+        return {"in": self.ends[0].status(), "out": self.ends[1].status()}
+
+
+def bridge_settings(config, args):
+    """(in port, out port, baud rate, out baud rate): command-line arguments over the `bridge` section."""
+    settings = getattr(config, 'bridge', None)
+    return (args.in_port or getattr(settings, 'in_port', '/dev/ttyACM0'),
+            args.out_port or getattr(settings, 'out_port', '/dev/ttyUSB1'),
+            args.baudrate or getattr(settings, 'baudrate', 9600),
+            args.out_baudrate or getattr(settings, 'out_baudrate', None))
+
+
+def main():
+    """Run the bridge until SIGTERM; SIGHUP re-reads config.yaml and reopens the ports only if they changed."""
+    parser = argparse.ArgumentParser(description="Bridge a scanner's serial port to another serial port")
+    parser.add_argument("--in-port")
+    parser.add_argument("--out-port")
+    parser.add_argument("--baudrate", type=int)
+    parser.add_argument("--out-baudrate", type=int)
+    args = parser.parse_args()
+
+    config = load_config()
+    logs.setup_logging("bridge", config, registry=BRIDGE_METRICS)
+    wake = threading.Event()
+    shutdown_requested = threading.Event()
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: wake.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: (shutdown_requested.set(), wake.set()))
+
+    settings = bridge_settings(config, args)
+    bridge = SerialBridge(*settings)
+    logger.info(f"Bridging {settings[0]} <-> {settings[1]}")
+    try:
+        while True:
+            bridge.run(wake)
+            if shutdown_requested.is_set():
+                break
+            wake.clear()
+            try:
+                config_store.refresh()
+            except ValueError as e:
+                logger.error(f"Ignoring invalid config.yaml, keeping the running settings: {e}")
+                continue
+            if load_config() is config:
+                continue
+            config = load_config()
+            logs.apply_levels(config)
+            if bridge_settings(config, args) != settings:
+                bridge.close()
+                settings = bridge_settings(config, args)
+                bridge = SerialBridge(*settings)
+                logger.info(f"Bridging {settings[0]} <-> {settings[1]}")
+    except KeyboardInterrupt:
+        logger.info("Stopped by user.")
+    finally:
+        bridge.close()
+
 
-# Open serial ports (adjust to your actual port names)
-in_port = serial.Serial('/dev/ttyACM0', 9600)
-out_port = serial.Serial('/dev/ttyUSB1', 9600)
-
-try:
-    while True:
-        if in_port.in_waiting:
-            data = in_port.read(in_port.in_waiting)
-            out_port.write(data)
-except KeyboardInterrupt:
-    print("Stopped by user.")
-finally:
-    in_port.close()
-    out_port.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,86 +1,489 @@
 import serial
+import logging
 import time
 import csv
-import pandas as pd
-from datetime import datetime
-from utils import load_config, check_csv_exists, check_folder_exists, modify_config
+import os
+import signal
+import threading
+from datetime import datetime, timedelta
+from utils import load_config, config_store, check_csv_exists, check_folder_exists, get_line_configs
+from ipc import ScanPublisher, get_socket_path
+from port_fowarding import ForwardPort
+from store import DayFileStore, make_store, store_settings
+import compaction
+import health
+import logs
+import metrics
+
+logger = logging.getLogger("scanner")
 
 FOLDER_PATH = "data/"
-config = load_config()
+PORT_RETRY_SECONDS = 5  # Wait before reopening a serial port that failed or was unplugged
+STOP_TIMEOUT = 5  # Seconds to wait for a removed line's thread to release its port
+
+# Published to the web app's /metrics through run/metrics/scanner.prom
+SCANS = metrics.Counter("scanner_scans_total", "Scans read from the serial port, by result", ["line", "result"])
+SERIAL_BYTES = metrics.Counter("scanner_serial_bytes_total", "Bytes read from the serial port", ["line"])
+SERIAL_ERRORS = metrics.Counter("scanner_serial_errors_total", "Serial port errors, each followed by a reopen", ["line"])
+PORT_CONNECTED = metrics.Gauge("scanner_port_connected", "1 while the line's serial port is open", ["line"])
+DEDUP_SECONDS = metrics.Histogram("scanner_dedup_seconds", "Time to check a scan against the dedup index", ["line"])
+APPEND_SECONDS = metrics.Histogram("scanner_append_seconds", "Time to record an accepted scan", ["line"])
+FORWARD_DROPPED = metrics.Counter("scanner_forward_dropped_bytes_total",
+                                  "Bytes not copied to the line's forward_port because it was unavailable", ["line"])
+FORWARD_ERRORS = metrics.Counter("scanner_forward_errors_total",
+                                 "Serial errors on the line's forward_port, each followed by a reopen", ["line"])
+
+
+def clean_barcode(data):
+    """Strip whitespace and quote characters from a raw scan."""
+    return str(data.strip().replace('"', '').replace("'", ""))
+
+
+class BarcodeIndex:
+    """In-memory set of barcodes already recorded for a production line.
+
+    The index is warmed once from the day file (plus `lookback_days` previous
+    day files when uniqueness must hold across days) and then kept up to date
+    by ScannerLine.append_to_csv(), so checking a scan never re-reads the CSV.
+    """
+
+    def __init__(self, line_name, lookback_days=0, folder_path=None):
+        self.line_name = line_name
+        self.lookback_days = max(0, int(lookback_days))
+        self.folder_path = folder_path or FOLDER_PATH
+        self.days = {}  # 'YYYY-MM-DD' -> set of barcodes scanned that day
+
+    def file_path(self, day):
+        return f"{self.folder_path}{day}_{self.line_name}.csv"
+
+    def warm(self, today=None):
+        """(Re)load the barcodes for today and the lookback window, dropping older days."""
+        today = today or datetime.now().date()
+        wanted = [(today - timedelta(days=n)).strftime('%Y-%m-%d') for n in range(self.lookback_days + 1)]
+        self.days = {day: self.days.get(day) or read_barcodes(self.file_path(day)) for day in wanted}
+
+    def add(self, barcode, day=None):
+        day = day or datetime.now().strftime('%Y-%m-%d')
+        self.days.setdefault(day, set()).add(barcode)
+
+    def __contains__(self, barcode):
+        return any(barcode in barcodes for barcodes in self.days.values())
+
+    def __len__(self):
+        return sum(len(barcodes) for barcodes in self.days.values())
+
 
-# Adjust the serial port and baud rate according to your scanner's settings
-ser = serial.Serial('/dev/ttyACM0', 9600, timeout=1)  # Update with your actual serial port
+def read_barcodes(filepath):
+    """Return the set of barcodes stored in a day CSV (empty if the file is missing)."""
+    barcodes = set()
+    if not os.path.isfile(filepath):
+        # Closed days may have been compacted to Parquet
+        parquet_path = compaction.parquet_path_for(filepath)
+        if compaction.is_available() and os.path.isfile(parquet_path):
+            return compaction.read_barcodes(parquet_path)
+        return barcodes
+    with open(filepath, newline='', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if not header:
+            return barcodes
+        column = header.index('Barcode') if 'Barcode' in header else len(header) - 1
+        for row in reader:
+            if len(row) > column:
+                barcodes.add(row[column])
+    return barcodes
 
-def isUniqueEntry(filepath, data):
-    df = pd.read_csv(filepath,  sep=',')
-    # df.astype(str)
-    processed_data = str(data.strip().replace('"', '').replace("'", ""))
 
-    if processed_data in df['Barcode'].astype(str).unique().tolist():
-        print(f"'{processed_data}' already exists in the 'Barcode' column.")
-        return False  # Data already exists in the DataFrame
+# Scan terminators a scanner can be configured to send after each barcode
+TERMINATORS = {
+    "cr": (b"\r",),
+    "lf": (b"\n",),
+    "crlf": (b"\r\n",),
+    "any": (b"\r\n", b"\r", b"\n"),  # Longest first so CRLF counts as one terminator
+}
+
+
+class ScanFramer:
+    """Buffer raw serial bytes and split them into barcodes on the configured terminator."""
+
+    def __init__(self, terminator="cr"):
+        if terminator not in TERMINATORS:
+            raise ValueError(f"Unknown scan terminator '{terminator}', expected one of {sorted(TERMINATORS)}")
+        self.terminator = terminator
+        self.buffer = b""
+
+    def feed(self, data):
+        """Add bytes from the port and return the list of complete barcodes they finish."""
+        self.buffer += data
+        barcodes = []
+        while True:
+            # Find the earliest terminator in the buffer
+            cut = None
+            for term in TERMINATORS[self.terminator]:
+                pos = self.buffer.find(term)
+                if pos != -1 and (cut is None or pos < cut[0]):
+                    cut = (pos, len(term))
+            if cut is None:
+                break
+            pos, size = cut
+            # A lone CR at the end of the buffer may be the first half of a CRLF
+            if self.terminator == "any" and pos + size == len(self.buffer) and self.buffer.endswith(b"\r"):
+                break
+            frame, self.buffer = self.buffer[:pos], self.buffer[pos + size:]
+            if frame:
+                barcodes.append(frame.decode('utf-8', errors='replace'))
+        return barcodes
+
+    def flush(self):
+        """Return a barcode left waiting on a possible CRLF, if any."""
+        if self.terminator == "any" and self.buffer.endswith(b"\r"):
+            return self.feed(b"\n")
+        return []
+
+
+def read_scans(port, framer, read_mode="waiting", bytes_read=None, tee=None):
+    """Block until the port has data (or its timeout expires) and return the barcodes it completes.
+
+    "waiting" drains everything in the UART buffer in one read, "read_until"
+    blocks on the terminator itself. Neither polls or sleeps between bytes.
+    `bytes_read` is an optional counter for the bytes taken from the port and
+    `tee` an optional callable receiving the raw bytes before they are framed.
+    """
+    if read_mode == "read_until" and len(TERMINATORS[framer.terminator]) == 1:
+        data = port.read_until(TERMINATORS[framer.terminator][0])
     else:
-        print(f"{processed_data} is unique in the 'Barcode' column.")
-        return True  # Data is unique in the DataFrame
+        data = port.read(port.in_waiting or 1)
+    if not data:
+        # Timed out with nothing new, release a CR held back in "any" mode
+        return framer.flush()
+    if bytes_read is not None:
+        bytes_read.inc(len(data))
+    if tee is not None:
+        tee(data)
+    return framer.feed(data)
+
+
+def open_serial(line_config):
+    """Open a line's scanner port with the port and baud rate from config.yaml."""
+    return serial.Serial(line_config.port, line_config.baudrate, timeout=1)
+
 
+def forward_settings(line_config):
+    return getattr(line_config, 'forward_port', None), getattr(line_config, 'forward_baudrate', None)
 
-def append_to_csv(filepath, data):
-    row = [config.name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), str(data.strip().replace('"', '').replace("'", ""))]
-    with open(filepath, 'a', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(row)
 
+def make_forward_port(line_config):
+    """The port a line copies its scanner's bytes to (`forward_port` in config.yaml), if any."""
+    port, baudrate = forward_settings(line_config)
+    if not port:
+        return None
+    return ForwardPort(port, baudrate or line_config.baudrate, FORWARD_DROPPED.labels(line=line_config.name),
+                       FORWARD_ERRORS.labels(line=line_config.name))
 
-def get_current_csv_filename():
+
+def get_current_csv_filename(line_name, header):
     """Get the CSV filename for the current date and ensure it exists."""
     current_date = datetime.now().strftime('%Y-%m-%d')
-    csv_file_name = f"{FOLDER_PATH}{current_date}_{config.name}.csv"
+    csv_file_name = f"{FOLDER_PATH}{current_date}_{line_name}.csv"
     
     # Make sure the file exists with correct headers
     check_folder_exists(FOLDER_PATH)
-    check_csv_exists(csv_file_name, config.header)
+    check_csv_exists(csv_file_name, header)
     
     return csv_file_name
 
 
-def listen_to_scanner():
-    barcode = ''
-    last_date = datetime.now().strftime('%Y-%m-%d')
-    
-    # Initial file setup
-    csv_file_name = get_current_csv_filename()
-    print(f"Scanner using file: {csv_file_name}")
+class ScannerLine:
+    """One production line: its serial scanner, dedup index and day file."""
+
+    def __init__(self, line_config, publisher=None, store=None):
+        self.config = line_config
+        self.publisher = publisher  # Optional ScanPublisher pushing accepted scans to the web process
+        self.store = store or DayFileStore(line_config.header)
+        self.name = line_config.name
+        self.framer = ScanFramer(line_config.terminator)
+        self.barcode_index = BarcodeIndex(self.name, line_config.lookback_days)
+        self.ser = None
+        self.forward = make_forward_port(line_config)  # Optional ForwardPort copying the scanner's bytes
+        self.csv_file_name = None
+        self.current_date = None
+        self.running = True
+        self.last_scan = None
+        self.pending_config = None  # (line config, storage settings) waiting for the listen thread
+        self.thread = None
+        self.bind_metrics()
 
-    while True:
-        # Check if the date has changed
+    def bind_metrics(self):
+        """Look up this line's metric children once, so the scan path only increments them."""
+        self.accepted = SCANS.labels(line=self.name, result="accepted")
+        self.duplicates = SCANS.labels(line=self.name, result="duplicate")
+        self.bytes_read = SERIAL_BYTES.labels(line=self.name)
+        self.serial_errors = SERIAL_ERRORS.labels(line=self.name)
+        self.dedup_seconds = DEDUP_SECONDS.labels(line=self.name)
+        self.append_seconds = APPEND_SECONDS.labels(line=self.name)
+        PORT_CONNECTED.labels(line=self.name).set_function(lambda: int(self.ser is not None))
+
+    def check_date(self):
+        """Switch to a new day file and re-warm the dedup index when the date changes."""
         current_date = datetime.now().strftime('%Y-%m-%d')
-        if current_date != last_date:
-            print(f"Date changed from {last_date} to {current_date}. Updating file.")
-            csv_file_name = get_current_csv_filename()
-            last_date = current_date
-            print(f"Now using file: {csv_file_name}")
-            
-            # Reload config in case it was modified
-            global config
-            config = load_config()
-
-        # Read data from the barcode scanner
-        data = ser.read()  # Read one byte at a time
-
-        if data:
-            barcode += data.decode('utf-8')  # Append to the barcode string
-
-            # If you detect a newline (end of scan), process the barcode
-            if data == b'\r':  # You may need to check for `\n` or `\r\n` depending on your scanner
-                print(f"Scanned Barcode: {barcode}")
-                if isUniqueEntry(csv_file_name, barcode):
-                    append_to_csv(csv_file_name, barcode)
-                else:
-                    print("Entry is not Unique. Please scan another code")
-                
-                barcode = ''  # Reset barcode after processing
-
-        time.sleep(0.05)  # Avoid busy-waiting
+        if current_date == self.current_date:
+            return
+        if self.current_date is not None:
+            logger.info(f"[{self.name}] Date changed from {self.current_date} to {current_date}. Updating file.",
+                        extra={"line": self.name})
+        self.current_date = current_date
+        self.csv_file_name = get_current_csv_filename(self.name, self.config.header)
+        # Opening the store first repairs a torn last row, so the index never sees a partial barcode
+        self.store.open(self.csv_file_name)
+        self.barcode_index.warm()
+        logger.info(f"[{self.name}] Using file: {self.csv_file_name} "
+                    f"({len(self.barcode_index)} barcodes indexed, lookback {self.barcode_index.lookback_days} day(s))",
+                    extra={"line": self.name, "file": self.csv_file_name})
+
+    def isUniqueEntry(self, data):
+        started = time.perf_counter()
+        processed_data = clean_barcode(data)
+        unique = processed_data not in self.barcode_index
+        self.dedup_seconds.observe(time.perf_counter() - started)
+
+        if not unique:
+            logger.info(f"[{self.name}] '{processed_data}' already exists in the 'Barcode' column.",
+                        extra={"line": self.name, "barcode": processed_data})
+            return False  # Data already recorded
+        else:
+            logger.debug(f"[{self.name}] {processed_data} is unique in the 'Barcode' column.",
+                         extra={"line": self.name, "barcode": processed_data})
+            return True  # Data is unique
+
+    def append_to_csv(self, data):
+        started = time.perf_counter()
+        now = datetime.now()
+        barcode = clean_barcode(data)
+        row = [self.name, now.strftime('%Y-%m-%d %H:%M:%S'), barcode]
+        self.store.append(row)
+        self.barcode_index.add(barcode, now.strftime('%Y-%m-%d'))
+        self.last_scan = row[1]
+        if self.publisher is not None:
+            self.publisher.publish({
+                "line": self.name,
+                "file": os.path.basename(self.csv_file_name),
+                "time": row[1],
+                "barcode": barcode,
+                "ts": time.time(),
+            })
+        self.append_seconds.observe(time.perf_counter() - started)
+
+    def process_scan(self, barcode):
+        """Record a framed barcode if it has not been seen before."""
+        started = time.perf_counter()
+        logger.debug(f"[{self.name}] Scanned Barcode: {barcode}", extra={"line": self.name, "barcode": barcode})
+        if self.isUniqueEntry(barcode):
+            self.append_to_csv(barcode)
+            self.accepted.inc()
+            logger.info(f"[{self.name}] Recorded {barcode}", extra={
+                "line": self.name, "barcode": barcode, "latency_ms": round((time.perf_counter() - started) * 1e3, 3)})
+            return True
+        self.duplicates.inc()
+        logger.info(f"[{self.name}] Entry is not Unique. Please scan another code", extra={"line": self.name})
+        return False
+
+    def reconfigure(self, line_config, storage=None):
+        """Queue new settings; the listen thread applies them between two reads, so no scan is lost."""
+        self.pending_config = (line_config, storage)
+
+    def apply_pending_config(self):
+        """Switch to queued settings, keeping the port open unless its port or baud rate changed."""
+        if self.pending_config is None:
+            return
+        line_config, storage = self.pending_config
+        self.pending_config = None
+        previous, self.config = self.config, line_config
+        if storage:
+            self.store.configure(**storage)
+        self.store.header = line_config.header
+        if line_config.terminator != self.framer.terminator:
+            # Bytes of a scan that is still arriving carry over to the new framer
+            framer = ScanFramer(line_config.terminator)
+            framer.buffer = self.framer.buffer
+            self.framer = framer
+        if line_config.name != self.name or int(line_config.lookback_days) != self.barcode_index.lookback_days:
+            self.name = line_config.name
+            self.barcode_index = BarcodeIndex(self.name, line_config.lookback_days)
+            self.current_date = None  # check_date() opens the (renamed) line's day file
+            PORT_CONNECTED.remove(line=previous.name)
+            self.bind_metrics()
+            if self.thread is not None:
+                self.thread.name = f"scanner-{self.name}"
+        if (line_config.port, line_config.baudrate) != (previous.port, previous.baudrate) and self.ser is not None:
+            logger.info(f"[{self.name}] Moving from {previous.port} to {line_config.port} at {line_config.baudrate} baud",
+                        extra={"line": self.name, "port": line_config.port})
+            self.ser.close()
+            self.ser = None
+        if forward_settings(line_config) != forward_settings(previous):
+            if self.forward is not None:
+                self.forward.close()
+            self.forward = make_forward_port(line_config)
+        logger.info(f"[{self.name}] Applied new configuration", extra={"line": self.name})
+
+    def tee(self):
+        return self.forward.write if self.forward is not None else None
+
+    def stop(self):
+        """Ask the listen thread to finish; it drains the port and commits the day file on its way out."""
+        self.running = False
+
+    def drain(self):
+        """Record complete scans still waiting in the port's input buffer before shutting down."""
+        if self.ser is None:
+            return
+        try:
+            while self.ser.in_waiting:
+                for barcode in read_scans(self.ser, self.framer, "waiting", self.bytes_read, self.tee()):
+                    self.process_scan(barcode)
+            for barcode in self.framer.flush():
+                self.process_scan(barcode)
+        except serial.SerialException as e:
+            logger.warning(f"[{self.name}] Could not drain {self.config.port}: {e}",
+                           extra={"line": self.name, "port": self.config.port})
+
+    def status(self):
+        """Health of this line for the scanner heartbeat."""
+        return {
+            "port": self.config.port,
+            "connected": self.ser is not None,
+            "forward": self.forward.status() if self.forward is not None else None,
+            "alive": self.thread is not None and self.thread.is_alive(),
+            "file": self.csv_file_name,
+            "last_scan": self.last_scan,
+        }
+
+    def close(self):
+        """Commit pending rows and release the day file and serial port."""
+        self.store.close()
+        if self.ser is not None:
+            self.ser.close()
+            self.ser = None
+        if self.forward is not None:
+            self.forward.close()
+
+    def listen(self):
+        """Read and record scans from this line's port, reopening it if it fails."""
+        while self.running:
+            try:
+                self.apply_pending_config()
+                self.check_date()
+                if self.ser is None:
+                    self.ser = open_serial(self.config)
+                    logger.info(f"[{self.name}] Listening on {self.config.port} at {self.config.baudrate} baud",
+                                extra={"line": self.name, "port": self.config.port})
+
+                # Wait for data from the barcode scanner and process every complete scan
+                for barcode in read_scans(self.ser, self.framer, self.config.read_mode, self.bytes_read, self.tee()):
+                    self.process_scan(barcode)
+                # Commit a partial batch once it is old enough, even if no more scans arrive
+                self.store.sync_if_due()
+            except serial.SerialException as e:
+                self.serial_errors.inc()
+                logger.error(f"[{self.name}] Serial error on {self.config.port}: {e}. Retrying in {PORT_RETRY_SECONDS}s",
+                             extra={"line": self.name, "port": self.config.port})
+                if self.ser is not None:
+                    self.ser.close()
+                    self.ser = None
+                time.sleep(PORT_RETRY_SECONDS)
+        self.drain()
+        self.close()
+        logger.info(f"[{self.name}] Stopped", extra={"line": self.name})
+
+
+def start_line(line):
+    line.thread = threading.Thread(target=line.listen, name=f"scanner-{line.name}", daemon=True)
+    line.thread.start()
+
+
+def stop_lines(lines):
+    """Stop every line and wait for their threads to commit what they have read."""
+    for line in lines:
+        line.stop()
+    for line in lines:
+        line.thread.join(STOP_TIMEOUT)
+
+
+def update_lines(lines, config, publisher):
+    """Bring the running lines in line with `config` and return the new list.
+
+    The first entry is the main line and keeps its port across renames; extra
+    lines are matched by name. Kept lines are reconfigured in place, removed
+    ones are stopped before new ones start, so a port can move between lines.
+    """
+    line_configs = get_line_configs(config)
+    running = {None if n == 0 else line.name: line for n, line in enumerate(lines)}
+    wanted = {None if n == 0 else line_config.name: line_config for n, line_config in enumerate(line_configs)}
+    removed = [running.pop(key) for key in set(running) - set(wanted)]
+    for line in removed:
+        logger.info(f"[{line.name}] Removed from config.yaml, stopping", extra={"line": line.name})
+        PORT_CONNECTED.remove(line=line.name)
+    stop_lines(removed)
+
+    storage = store_settings(config)
+    updated = []
+    for n, line_config in enumerate(line_configs):
+        line = running.get(None if n == 0 else line_config.name)
+        if line is None:
+            line = ScannerLine(line_config, publisher, make_store(config, line_config.header))
+            start_line(line)
+        else:
+            line.reconfigure(line_config, storage)
+        updated.append(line)
+    return updated
+
+
+def listen_to_scanner(stop=None, reload=None):
+    """Serve every configured production line from this process, one thread per port.
+
+    SIGHUP reloads config.yaml without a restart: it is validated first, and an
+    invalid file is ignored so the lines keep running on the previous settings.
+    SIGTERM drains and commits every line before exiting. A heartbeat with the
+    state of each line is written every second for the supervisor in main.py.
+
+    When main.py runs the scanner on one of its threads, the `stop` and
+    `reload` events stand in for the signals, and the metrics are published
+    by the web app sharing the process instead of a textfile.
+    """
+    config = load_config()
+    logs.setup_logging("scanner", config)
+    socket_path = get_socket_path(config)
+    publisher = ScanPublisher(socket_path) if socket_path else None
+    lines = update_lines([], config, publisher)
+
+    reload_requested = reload or threading.Event()
+    shutdown_requested = stop or threading.Event()
+    if stop is None:
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: reload_requested.set())
+        signal.signal(signal.SIGTERM, lambda signum, frame: shutdown_requested.set())
+    while not shutdown_requested.is_set():
+        health.write_status(health.SCANNER_HEALTH_PATH, {"lines": {line.name: line.status() for line in lines}})
+        if stop is None:
+            metrics.write_textfile("scanner")
+        if not reload_requested.wait(1):
+            continue
+        reload_requested.clear()
+        try:
+            config_store.refresh()
+        except ValueError as e:
+            logger.error(f"Ignoring invalid config.yaml, keeping the running settings: {e}")
+            continue
+        if load_config() is config:
+            continue
+        logger.info("Reloading config.yaml")
+        config = load_config()
+        logs.apply_levels(config)
+        lines = update_lines(lines, config, publisher)
+
+    logger.info("Stopping scanner lines...")
+    stop_lines(lines)
+    if publisher is not None:
+        publisher.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,138 @@
+import csv
+import io
+import logging
+import os
+import time
+from utils import check_csv_exists, check_folder_exists
+
+logger = logging.getLogger("store")
+FSYNC_POLICIES = ("always", "batch", "never")
+
+
+def recover_day_file(path):
+    """Cut off a half-written last row left by a crash or power cut.
+
+    Rows are appended with a single write ending in a newline, so anything after
+    the last newline is a torn write. Returns the number of bytes removed.
+    """
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+    if size == 0:
+        return 0
+    with open(path, 'rb+') as file:
+        # Scan backwards for the last newline in blocks
+        pos = size
+        while pos > 0:
+            start = max(0, pos - 4096)
+            file.seek(start)
+            block = file.read(pos - start)
+            newline = block.rfind(b'\n')
+            if newline != -1:
+                end = start + newline + 1
+                break
+            pos = start
+        else:
+            end = 0
+        if end < size:
+            file.truncate(end)
+            file.flush()
+            os.fsync(file.fileno())
+    return size - end
+
+
+def encode_row(row):
+    """A CSV row exactly as csv.writer writes it, line terminator included."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(row)
+    return buffer.getvalue().encode('utf-8')
+
+
+class DayFileStore:
+    """Append-only writer for a production line's day CSV.
+
+    Keeps the day file open and appends each row with one O_APPEND write, so
+    readers never see half a row and no open/close happens per scan. Durability
+    follows the `fsync` policy:
+      always  fsync after every row
+      batch   group commit: fsync once `batch_size` rows are pending or the
+              oldest pending row is `batch_interval` seconds old
+      never   leave flushing to the operating system
+    On open, a torn last row from a previous crash is cut off first.
+    """
+
+    def __init__(self, header, fsync="batch", batch_size=32, batch_interval=0.5):
+        self.header = header
+        self.configure(fsync, batch_size, batch_interval)
+        self.path = None
+        self.fd = None
+        self.pending = 0
+        self.pending_since = None
+
+    def configure(self, fsync="batch", batch_size=32, batch_interval=0.5):
+        """Change the durability policy; rows already pending are committed under the old one."""
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync}', expected one of {FSYNC_POLICIES}")
+        if getattr(self, 'fd', None) is not None:
+            self.sync()
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+    def open(self, path):
+        """Switch to `path`, committing and closing the previous day file."""
+        if path == self.path and self.fd is not None:
+            return
+        self.close()
+        check_folder_exists(os.path.dirname(path) or '.')
+        removed = recover_day_file(path)
+        if removed:
+            logger.warning(f"Recovered {path}: removed {removed} bytes of a torn last row", extra={"file": path})
+        check_csv_exists(path, self.header)
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.path = path
+
+    def append(self, row):
+        os.write(self.fd, encode_row(row))
+        if self.fsync == "always":
+            os.fsync(self.fd)
+        elif self.fsync == "batch":
+            self.pending += 1
+            if self.pending_since is None:
+                self.pending_since = time.monotonic()
+            self.sync_if_due()
+
+    def sync_if_due(self):
+        """Group commit: fsync when the batch is full or has waited long enough."""
+        if self.pending and (self.pending >= self.batch_size
+                             or time.monotonic() - self.pending_since >= self.batch_interval):
+            self.sync()
+
+    def sync(self):
+        if self.fd is not None and (self.pending or self.fsync == "never"):
+            os.fsync(self.fd)
+        self.pending = 0
+        self.pending_since = None
+
+    def close(self):
+        if self.fd is not None:
+            self.sync()
+            os.close(self.fd)
+        self.fd = None
+        self.path = None
+
+
+def store_settings(config):
+    """The `storage` section of config.yaml as DayFileStore.configure() arguments."""
+    storage = getattr(config, 'storage', None)
+    return {
+        "fsync": getattr(storage, 'fsync', 'batch'),
+        "batch_size": getattr(storage, 'batch_size', 32),
+        "batch_interval": getattr(storage, 'batch_interval', 0.5),
+    }
+
+
+def make_store(config, header):
+    """Build a DayFileStore from the `storage` section of config.yaml."""
+    return DayFileStore(header, **store_settings(config))
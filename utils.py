@@ -1,30 +1,306 @@
 import yaml
 import csv
+import hashlib
+import logging
 import os
+import threading
+from datetime import datetime
 
-# Helper class for dot notation config access
+logger = logging.getLogger("config")
+
+CONFIG_FILE = 'config.yaml'
+
+# Helper class for dot notation config access.
+# Snapshots are read-only: sections become ConfigObjects, lists become
+# tuples, and mappings inside lists (time segments, extra lines) become
+# ConfigEntry dicts, so both segment["start"] and segment.start work.
 class ConfigObject:
     def __init__(self, dictionary):
+        object.__setattr__(self, '_data', plain(dictionary))
         for key, value in dictionary.items():
             if isinstance(value, dict):
-                setattr(self, key, ConfigObject(value))
+                object.__setattr__(self, key, ConfigObject(value))
             else:
-                setattr(self, key, value)
+                object.__setattr__(self, key, freeze(value))
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"config snapshots are read-only, use config_store.update() to change {key!r}")
+
+    # A plain, mutable copy of the settings, e.g. to compare or edit them
+    def to_dict(self):
+        return plain(self._data)
+
+# Read-only dictionary with dot notation, for mappings inside config lists
+class ConfigEntry(dict):
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("config snapshots are read-only, use config_store.update()")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+    __setattr__ = __delattr__ = _read_only
+
+    # Copies are plain dictionaries
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+# Convert a config value to its read-only form
+def freeze(value):
+    if isinstance(value, dict):
+        return ConfigEntry({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+# Convert a (possibly frozen) config value back to plain dicts and lists, as YAML and JSON expect
+def plain(value):
+    if isinstance(value, ConfigObject):
+        return value.to_dict()
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    return value
+
+# The validated contents of config.yaml, shared by everything in the process.
+# get() returns the current ConfigObject snapshot; the file is only stat()ed
+# per call and parsed again when its inode, size or mtime changed and its
+# content hash differs. update() applies several keys in one atomic write.
+# subscribe() registers callbacks that get each new snapshot.
+class ConfigStore:
+    def __init__(self, path=CONFIG_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.version = None  # (inode, size, mtime) of the file behind the snapshot, or of a rejected edit
+        self.digest = None
+        self.subscribers = []
+
+    def file_version(self):
+        stat = os.stat(self.path)
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    # Take in a new version of the file. Returns the new snapshot, or None if
+    # the content is unchanged; raises ValueError if it is invalid.
+    def load(self, version):
+        with open(self.path, 'rb') as file:
+            content = file.read()
+        self.version = version
+        digest = hashlib.sha1(content).hexdigest()
+        if digest == self.digest:
+            return None
+        try:
+            data = yaml.safe_load(content)
+        except yaml.YAMLError as e:
+            raise ValueError(f"config.yaml is not valid YAML: {e}") from None
+        validate_config(data)
+        self.digest = digest
+        self.snapshot = ConfigObject(data)
+        return self.snapshot
+
+    # Re-check the file. Returns True if a new snapshot was taken and raises
+    # ValueError (once per edit) if the file changed to something invalid;
+    # the previous snapshot stays current meanwhile.
+    def refresh(self):
+        with self.lock:
+            version = self.file_version()
+            if version == self.version and self.snapshot is not None:
+                return False
+            snapshot = self.load(version)
+        if snapshot is None:
+            return False
+        self.notify(snapshot)
+        return True
+
+    # The current snapshot; raises ValueError only if there has never been a valid one
+    def get(self):
+        try:
+            self.refresh()
+        except ValueError as e:
+            if self.snapshot is None:
+                raise
+            logger.error(f"Ignoring invalid config.yaml, keeping the running settings: {e}")
+        return self.snapshot
 
-# Read YAML and convert to ConfigObject
+    # Apply {key: value} changes in one validated write through a temporary
+    # file and a rename, so readers never see a partial file and watchers
+    # see one change. Raises ValueError, writing nothing, if the result is invalid.
+    def update(self, changes):
+        with self.lock:
+            with open(self.path, 'r') as file:
+                data = yaml.safe_load(file) or {}
+            data.update(plain(changes))
+            validate_config(data)
+            content = yaml.dump(data, default_flow_style=False).encode('utf-8')
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'wb') as file:
+                file.write(content)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.path)
+            self.version = self.file_version()
+            self.digest = hashlib.sha1(content).hexdigest()
+            self.snapshot = snapshot = ConfigObject(data)
+        self.notify(snapshot)
+        return snapshot
+
+    # Call `callback(snapshot)` after every change this process sees
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def notify(self, snapshot):
+        for callback in list(self.subscribers):
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.exception(f"Error in config subscriber {callback!r}: {e}")
+
+config_store = ConfigStore()
+
+# The current settings as a plain dictionary
+def load_config_data():
+    return config_store.get().to_dict()
+
+# The current settings as a read-only ConfigObject snapshot
 def load_config():
-    with open('config.yaml', 'r') as file:
-        data = yaml.safe_load(file)
-    return ConfigObject(data)
+    return config_store.get()
 
-def modify_config(key, value):
-    with open('config.yaml', 'r') as file:
-        config = yaml.safe_load(file)
+# Top-level keys that hold a section of settings, and those that hold a list
+MAPPING_SECTIONS = ('bridge', 'compaction', 'dedup', 'forwarder', 'ipc', 'logging', 'scanner', 'server',
+                    'storage', 'supervisor')
+LIST_SECTIONS = ('lines', 'time_segments')
 
-    config[f'{key}'] = value
+# Check a config dictionary before it replaces the running one; raises ValueError.
+# Anything else a malformed value trips over is reported as ValueError too,
+# since that is what the services catch to keep their previous settings.
+def validate_config(data):
+    try:
+        check_config(data)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"config.yaml has a malformed setting: {type(e).__name__}: {e}") from None
 
-    with open('config.yaml', 'w') as file:
-        yaml.dump(config, file, default_flow_style=False)
+def check_config(data):
+    if not isinstance(data, dict):
+        raise ValueError("config.yaml must contain a mapping")
+    for key in MAPPING_SECTIONS:
+        if data.get(key) is not None and not isinstance(data[key], dict):
+            raise ValueError(f"'{key}' must be a section of settings, got {data[key]!r}")
+    for key in LIST_SECTIONS:
+        if data.get(key) is not None and not isinstance(data[key], list):
+            raise ValueError(f"'{key}' must be a list, got {data[key]!r}")
+    for n, entry in enumerate(data.get('lines') or []):
+        if not isinstance(entry, dict):
+            raise ValueError(f"entry {n} in 'lines' must be a mapping with at least name and port, got {entry!r}")
+    if not isinstance((data.get('logging') or {}).get('levels') or {}, dict):
+        raise ValueError("'logging.levels' must map logger names to levels")
+    if not isinstance(data.get('name'), str) or not data['name'].strip():
+        raise ValueError("'name' must be a non-empty string")
+    if not isinstance(data.get('header'), list) or not data['header']:
+        raise ValueError("'header' must be a non-empty list of column names")
+    if not isinstance(data.get('target', 0), int) or data.get('target', 0) < 0:
+        raise ValueError("'target' must be a non-negative integer")
+    for n, segment in enumerate(data.get('time_segments') or []):
+        if not isinstance(segment, dict):
+            raise ValueError(f"time segment {n} must be a mapping with start, end and target")
+        for key in ('start', 'end'):
+            try:
+                datetime.strptime(str(segment.get(key)), '%H:%M')
+            except ValueError:
+                raise ValueError(f"time segment {n} has an invalid {key} {segment.get(key)!r} (expected HH:MM)")
+        if not isinstance(segment.get('target'), int) or segment['target'] < 0:
+            raise ValueError(f"time segment {n} needs a non-negative integer target")
+    log_settings = data.get('logging') or {}
+    log_levels = [log_settings.get('level', 'INFO'), log_settings.get('console_level', 'INFO')]
+    log_levels += list((log_settings.get('levels') or {}).values())
+    for level in log_levels:
+        if str(level).upper() not in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'):
+            raise ValueError(f"Unknown log level {level!r} under 'logging'")
+    storage = data.get('storage') or {}
+    if storage.get('fsync', 'batch') not in ('always', 'batch', 'never'):
+        raise ValueError(f"Unknown fsync policy {storage.get('fsync')!r} under 'storage'")
+    forwarder = data.get('forwarder') or {}
+    if forwarder.get('enabled') and not str(forwarder.get('url', '')).startswith(('http://', 'https://')):
+        raise ValueError("'forwarder.url' must be an http:// or https:// collector URL")
+    for key in ('batch_size', 'batch_interval'):
+        if not isinstance(forwarder.get(key, 1), (int, float)) or forwarder.get(key, 1) <= 0:
+            raise ValueError(f"'forwarder.{key}' must be a positive number")
+    line_configs = get_line_configs(ConfigObject(data))
+    ports = [line.port for line in line_configs]
+    for n, port in enumerate(ports):
+        if port in ports[:n]:
+            raise ValueError(f"lines {line_configs[ports.index(port)].name} and {line_configs[n].name} "
+                             f"both read {port}; every line needs its own scanner port")
+    for line in line_configs:
+        if line.terminator not in ('cr', 'lf', 'crlf', 'any'):
+            raise ValueError(f"line {line.name} has an unknown scan terminator {line.terminator!r}")
+        if line.read_mode not in ('waiting', 'read_until'):
+            raise ValueError(f"line {line.name} has an unknown read mode {line.read_mode!r}")
+        if line.forward_port and line.forward_port in ports:
+            raise ValueError(f"line {line.name} forwards to {line.forward_port}, which is a scanner port")
+    server = data.get('server') or {}
+    if server.get('mode', 'waitress') not in ('waitress', 'threaded', 'dev'):
+        raise ValueError(f"Unknown server mode {server.get('mode')!r} (expected waitress, threaded or dev)")
+    threads = server.get('threads', 64)
+    if not isinstance(threads, int) or threads < 1:
+        raise ValueError("'server.threads' must be a positive integer")
+    max_streams = server.get('max_streams')
+    if max_streams is not None and (not isinstance(max_streams, int) or not 0 <= max_streams < threads):
+        raise ValueError("'server.max_streams' must be an integer below 'server.threads', "
+                         "so requests other than SSE streams always have a worker")
+    supervisor = data.get('supervisor') or {}
+    if supervisor.get('mode', 'processes') not in ('processes', 'threads'):
+        raise ValueError(f"Unknown supervisor mode {supervisor.get('mode')!r} (expected processes or threads)")
+    bridge = data.get('bridge') or {}
+    if bridge.get('enabled') and bridge.get('in_port', '/dev/ttyACM0') in ports:
+        raise ValueError(f"the bridge and a line both read {bridge.get('in_port', '/dev/ttyACM0')}; "
+                         "set forward_port on the line to bridge a port that is also recorded")
+
+# Build one settings object per production line served by this box.
+# The top-level `name`, `header`, `target`, `time_segments` and `scanner`
+# settings describe the first line; `lines` lists any additional lines, e.g.
+#   lines:
+#   - name: ProductionLine2
+#     port: /dev/ttyACM1
+#     baudrate: 9600
+# Keys left out of a `lines` entry fall back to the top-level settings,
+# except `port` (required per line) and `forward_port`.
+def get_line_configs(config):
+    scanner = getattr(config, 'scanner', None)
+    dedup = getattr(config, 'dedup', None)
+    defaults = {
+        "name": config.name,
+        "header": config.header,
+        "target": getattr(config, 'target', 0),
+        "time_segments": getattr(config, 'time_segments', []),
+        "port": getattr(scanner, 'port', '/dev/ttyACM0'),
+        "baudrate": getattr(scanner, 'baudrate', 9600),
+        "terminator": getattr(scanner, 'terminator', 'cr'),
+        "read_mode": getattr(scanner, 'read_mode', 'waiting'),
+        "lookback_days": getattr(dedup, 'lookback_days', 0),
+        "forward_port": getattr(scanner, 'forward_port', None),  # Copy every byte read to this port, see ForwardPort
+        "forward_baudrate": getattr(scanner, 'forward_baudrate', None),
+    }
+    lines = [ConfigObject(defaults)]
+    names = {config.name}
+    for entry in getattr(config, 'lines', None) or []:
+        if not entry.get("name") or entry["name"] in names:
+            raise ValueError(f"Every entry in 'lines' needs a unique name, got {entry.get('name')!r}")
+        names.add(entry["name"])
+        # Two lines can't share a scanner or forward port, so neither is inherited
+        if not entry.get("port"):
+            raise ValueError(f"line {entry['name']} needs its own scanner 'port'")
+        lines.append(ConfigObject({**defaults, "forward_port": None, "forward_baudrate": None, **entry}))
+    return lines
+
+# Change one top-level key; prefer one config_store.update() for several
+def modify_config(key, value):
+    return config_store.update({key: value})
 
 # Ensure the folder exists
 def check_folder_exists(folder_path):
@@ -36,4 +312,62 @@ def check_csv_exists(csv_path, headers):
     if not os.path.isfile(csv_path):
         with open(csv_path, 'w', newline='') as file:
             writer = csv.writer(file)
-            writer.writerow(headers)
\ No newline at end of file
+            writer.writerow(headers)
+
+# Incrementally read rows appended to a CSV file.
+# Remembers the byte offset it has consumed and only parses what was added
+# since, starting over when the path changes (day rollover) or the file is
+# replaced or truncated. A trailing line without its newline is left for the
+# next call, so a half-written row is never returned.
+class CsvTail:
+    def __init__(self):
+        self.path = None
+        self.inode = None
+        self.offset = 0
+        self.header = None
+
+    def reset(self, path=None):
+        self.path = path
+        self.inode = None
+        self.offset = 0
+        self.header = None
+
+    # Index of a named column, falling back to its position in the default header
+    def column(self, name, default):
+        if self.header and name in self.header:
+            return self.header.index(name)
+        return default
+
+    # Return (rows, reset): the new data rows, and whether the caller must
+    # discard what it derived from earlier rows because the file started over.
+    def read_new_rows(self, path):
+        reset = False
+        if path != self.path:
+            self.reset(path)
+            reset = True
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            was_reading = self.offset > 0
+            self.reset(path)
+            return [], reset or was_reading
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            reset = reset or self.offset > 0
+            self.inode = stat.st_ino
+            self.offset = 0
+        if stat.st_size == self.offset:
+            return [], reset
+
+        with open(path, 'rb') as file:
+            file.seek(self.offset)
+            chunk = file.read(stat.st_size - self.offset)
+        complete = chunk.rfind(b'\n') + 1
+        if complete == 0:
+            return [], reset
+        at_start = self.offset == 0
+        self.offset += complete
+
+        rows = [row for row in csv.reader(chunk[:complete].decode('utf-8', errors='replace').splitlines()) if row]
+        if at_start and rows:
+            self.header, rows = rows[0], rows[1:]  # Skip the header row
+        return rows, reset
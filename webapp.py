@@ -1,130 +1,242 @@
 from flask import Flask, jsonify, render_template, request, redirect, url_for, Response, send_from_directory
-import json
+import hashlib
 import os
 import time
-import csv
+import logging
+import signal
+import threading
 from datetime import datetime, timedelta
-import pandas as pd
-from utils import load_config, modify_config
+import numpy as np
+from utils import load_config, config_store, get_line_configs, CsvTail
+from hub import ChangeHub
+from ipc import ScanListener, get_socket_path
+from history import HistoryIndex
+from werkzeug.exceptions import NotFound
+import compaction
+import export
+import health
+import logs
+import metrics
 
-config = load_config()
+logger = logging.getLogger("webapp")
 
 app = Flask(__name__)
+STARTED_AT = time.time()
+
+COMPUTE_SECONDS = metrics.Histogram("webapp_compute_seconds", "Time to compute a dashboard payload", ["function"])
+SSE_SUBSCRIBERS = metrics.Gauge("webapp_sse_subscribers", "Connected SSE clients, by topic", ["topic"])
+SCAN_EVENTS = metrics.Counter("webapp_scan_events_total", "Scan events received from the scanner process")
+SSE_REJECTED = metrics.Counter("webapp_sse_rejected_total", "SSE connections refused because server.max_streams were open")
 
 FOLDER_PATH = "data/"
-TARGET = config.target
-LINE_NAME = config.name
+change_hub = ChangeHub(FOLDER_PATH)
+for topic_kind in ("data", "visual"):
+    SSE_SUBSCRIBERS.labels(topic=topic_kind).set_function(lambda kind=topic_kind: change_hub.subscriber_count(kind))
+history_index = HistoryIndex(FOLDER_PATH)
+# The settings below are filled in from config.yaml by apply_config() on first
+# use (see get_config), so importing this module reads no files
+config = None
+TARGET = None
+LINE_NAME = None
 # Use time_segments from config, default to 1 segment if missing
-TIME_SEGMENTS = getattr(config, 'time_segments', [
-    {"start": "00:00", "end": "23:59", "target": TARGET}
-])
+TIME_SEGMENTS = None
+# Additional production lines served by this box, keyed by name (see utils.get_line_configs)
+LINES = {}
+# Held while the settings above are read or swapped, so a reload is never seen half applied
+settings_lock = threading.Lock()
+SMALL_BATCH = 64  # Fewer new rows than this are parsed in Python, below pandas' fixed cost per call
+PACE_WINDOW = 15  # Working minutes of recent scans behind the current rate in /api/pace
+STREAM_RESERVE = 8  # Waitress workers kept free of SSE streams for pages, /data and main.py's /healthz probe
+STREAM_RETRY_SECONDS = 5  # Retry-After of a refused stream; the templates reopen a closed stream after 5 s
+
+
+def get_config():
+    """The running config snapshot, loaded from config_store on first use."""
+    if config is None:
+        apply_config(load_config())
+    return config
+
+
+def get_line_settings(line_name=None):
+    """Return (name, target, time segments) for a line, defaulting to the main line.
+
+    Unknown line names fall back to the main line so old dashboard URLs keep working.
+    """
+    get_config()
+    with settings_lock:
+        if line_name and line_name != LINE_NAME and line_name in LINES:
+            line = LINES[line_name]
+            return line.name, line.target, line.time_segments or TIME_SEGMENTS
+        return LINE_NAME, TARGET, TIME_SEGMENTS
+
+
+def apply_config(new_config):
+    """Swap a validated config snapshot in for the running settings in one step.
+
+    Subscribed to config_store, so it runs for admin saves in this process as
+    well as for edits picked up on SIGHUP. SSE clients get a fresh payload right
+    away; segment counts are rebuilt on the next update because the compiled
+    schedule changes with the segments.
+    """
+    global config, TARGET, LINE_NAME, TIME_SEGMENTS, LINES
+    lines = {line.name: line for line in get_line_configs(new_config)[1:]}
+    segments = getattr(new_config, 'time_segments', None) or [
+        {"start": "00:00", "end": "23:59", "target": new_config.target}
+    ]
+    with settings_lock:
+        config, TARGET, LINE_NAME, TIME_SEGMENTS, LINES = new_config, new_config.target, new_config.name, segments, lines
+    logs.apply_levels(new_config)
+    change_hub.notify()
 
 
-def get_current_file_path():
-    """Determines the current CSV file path based on date and LINE_NAME."""
-    return f"{FOLDER_PATH}{datetime.now().strftime('%Y-%m-%d')}_{LINE_NAME}.csv"
+config_store.subscribe(apply_config)
+
+
+def reload_config():
+    """Re-read config.yaml after main.py signals a change, keeping the old settings if it is invalid."""
+    try:
+        if config_store.refresh():
+            logger.info("Reloaded config.yaml")
+    except Exception as e:
+        logger.error(f"Ignoring invalid config.yaml, keeping the running settings: {e}")
+
+
+def get_current_file_path(line_name=None):
+    """Determines the current CSV file path based on date and line name."""
+    line_name, _, _ = get_line_settings(line_name)
+    return f"{FOLDER_PATH}{datetime.now().strftime('%Y-%m-%d')}_{line_name}.csv"
 
 @app.route("/")
 def index():
+    line_name, target, _ = get_line_settings(request.args.get("line"))
     # Log the expected file path at the time of serving index.html for debugging
-    print(f"Serving index.html, expecting data from: {get_current_file_path()}")
-    return render_template("index.html", target=TARGET, line_name=LINE_NAME)
+    logger.debug(f"Serving index.html, expecting data from: {get_current_file_path(line_name)}",
+                 extra={"line": line_name})
+    return render_template("index.html", target=target, line_name=line_name)
 
-def preprocess_data():
-    """Reads and processes data from the current CSV file."""
-    current_file = get_current_file_path()
-    processed_data_rows = []
-    
-    if os.path.exists(current_file):
-        try:
-            # Check if file is not empty to avoid errors with csv.DictReader on empty files
-            if os.path.getsize(current_file) > 0:
-                with open(current_file, newline='', encoding='utf-8') as file:
-                    reader = csv.DictReader(file)
-                    for row in reader:
-                        processed_data_rows.append(row)
-            # else: file exists but is empty, processed_data_rows remains empty
-        except FileNotFoundError:
-            print(f"Warning: File {current_file} disappeared before read.")
-        except Exception as e:
-            print(f"Error reading CSV file {current_file}: {e}")
-            # Fallback to empty data on other errors
-
-    if not processed_data_rows:
+class ScanCounter:
+    """Process-wide running count of scans in each line's current day file.
+
+    Every caller (the /data route and all /stream clients) shares one CsvTail per
+    line, so a refresh only parses the rows appended since the previous one.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lines = {}  # line name -> [CsvTail, count]
+
+    def count(self, line_name, path):
+        with self.lock:
+            state = self.lines.setdefault(line_name, [CsvTail(), 0])
+            rows, reset = state[0].read_new_rows(path)
+            if reset:
+                state[1] = 0
+            state[1] += len(rows)
+            return state[1]
+
+
+scan_counter = ScanCounter()
+
+
+@metrics.timed(COMPUTE_SECONDS.labels(function="preprocess_data"))
+def preprocess_data(line_name=None):
+    """Returns the scan count and target percentage for the current CSV file."""
+    line_name, target, _ = get_line_settings(line_name)
+    current_file = get_current_file_path(line_name)
+    try:
+        count = scan_counter.count(line_name, current_file)
+    except Exception as e:
+        logger.error(f"Error reading CSV file {current_file}: {e}", extra={"line": line_name, "file": current_file})
+        # Fallback to empty data on errors
+        count = 0
+
+    if not count:
         return [0, 0]
 
-    percentage = round(len(processed_data_rows) / TARGET * 100, 2) if TARGET > 0 else 0
-    # print(preprocess_data) # Removed erroneous print statement
-    return [len(processed_data_rows), percentage]
+    percentage = round(count / target * 100, 2) if target > 0 else 0
+    return [count, percentage]
 
 
-@app.route("/data")
-def get_data():
-    """Route to fetch the processed scanned data dynamically (can be used for initial load or fallback)."""
-    count, percentage = preprocess_data()
-    return jsonify({
+def get_data_payload(line_name=None):
+    """Dashboard payload shared by /data and /stream."""
+    line_name, target, _ = get_line_settings(line_name)
+    count, percentage = preprocess_data(line_name)
+    return {
         "count": count,
         "percentage": percentage,
-        "line_name": LINE_NAME,
-        "target": TARGET
-    })
+        "line_name": line_name,
+        "target": target
+    }
+
+def data_etag(line_name=None):
+    """ETag for /data: changes with the day file (inode, size, mtime) and the line's name and target."""
+    line_name, target, _ = get_line_settings(line_name)
+    path = get_current_file_path(line_name)
+    try:
+        stat = os.stat(path)
+        version = f"{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+    except FileNotFoundError:
+        version = "missing"
+    return hashlib.sha1(f"{path}|{version}|{line_name}|{target}".encode()).hexdigest()[:20]
+
+@app.route("/data")
+def get_data():
+    """Route to fetch the processed scanned data dynamically (can be used for initial load or fallback).
+
+    Answers 304 Not Modified without reading the file when If-None-Match
+    still matches, since the counts only change when the day file grows.
+    """
+    line_name = request.args.get("line")
+    etag = data_etag(line_name)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(get_data_payload(line_name))
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"  # Cache, but revalidate every time
+    return response
+
+def get_last_event_id():
+    """The last SSE event ID a reconnecting client saw, or None.
+
+    EventSource sends the Last-Event-ID header when it reconnects by itself;
+    the templates pass ?last_event_id= when they reopen a stream that closed.
+    """
+    value = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
 
 @app.route("/stream")
 def stream():
-    """Server-Sent Events endpoint to stream data updates."""
-    def event_stream():
-        last_mtime = 0
-        # Send initial data immediately upon connection
-        try:
-            initial_count, initial_percentage = preprocess_data()
-            initial_data = {
-                "count": initial_count,
-                "percentage": initial_percentage,
-                "line_name": LINE_NAME,
-                "target": TARGET
-            }
-            yield f"data: {json.dumps(initial_data)}\n\n"
-            
-            # Set last_mtime based on the file used for initial data
-            _initial_file_path = get_current_file_path()
-            if os.path.exists(_initial_file_path):
-                last_mtime = os.path.getmtime(_initial_file_path)
-            else:
-                last_mtime = 0 # File might not exist yet
-        except Exception as e:
-            print(f"Error sending initial SSE data: {e}")
-            # Client will not receive initial data, will wait for first update
+    """Server-Sent Events endpoint to stream data updates.
 
-        while True:
-            current_file_for_stream = get_current_file_path()
-            current_mtime = 0
-            if os.path.exists(current_file_for_stream):
-                try:
-                    current_mtime = os.path.getmtime(current_file_for_stream)
-                except FileNotFoundError: # File might be deleted
-                    current_mtime = 0 
-            
-            if current_mtime != last_mtime:
-                try:
-                    count, percentage = preprocess_data()
-                    data = {
-                        "count": count,
-                        "percentage": percentage,
-                        "line_name": LINE_NAME,
-                        "target": TARGET
-                    }
-                    yield f"data: {json.dumps(data)}\n\n"
-                    last_mtime = current_mtime
-                except Exception as e:
-                    print(f"Error processing or sending SSE update: {e}")
-                    # Avoid breaking the stream, wait for next check
-            
-            time.sleep(0.5)  # Check for file modifications every 0.5 seconds
-    return Response(event_stream(), mimetype="text/event-stream")
-
-def get_time_segments_from_config():
+    All clients watching a line share one topic on the change hub, so each scan
+    is processed once no matter how many dashboards are open.
+    """
+    line_name = get_line_settings(request.args.get("line"))[0]
+    return open_stream(("data", line_name), lambda: get_current_file_path(line_name),
+                       lambda: get_data_payload(line_name))
+
+def open_stream(key, path_func, compute):
+    """SSE response for a change hub topic, or 503 once server.max_streams streams are open.
+
+    Under waitress every stream holds a worker, so the limit keeps workers
+    free for everything else; a refused wallboard retries after a few seconds.
+    """
+    subscription = change_hub.subscribe(key, path_func, compute, get_last_event_id())
+    if subscription is None:
+        SSE_REJECTED.inc()
+        logger.warning(f"Refusing SSE client on {key}: {change_hub.max_subscribers} streams already open")
+        return Response("Too many open streams, retry later\n", status=503, mimetype="text/plain",
+                        headers={"Retry-After": str(STREAM_RETRY_SECONDS)})
+    return Response(subscription.events(request.environ.get("waitress.client_disconnected")),
+                    mimetype="text/event-stream")
+
+def get_time_segments_from_config(line_name=None):
     """Return list of time segments from config, each as dict with start, end, target."""
-    return TIME_SEGMENTS
+    return get_line_settings(line_name)[2]
 
 def format_time(time_str):
     """Ensure time string is in 24-hour HH:MM format."""
@@ -136,121 +248,249 @@ def format_time(time_str):
         # Return original if parsing fails
         return time_str
 
-def process_data_for_visual():
-    """Reads and processes data from the current CSV for time series visualization using user-defined segments."""
-    current_file = get_current_file_path()
-    labels = []
-    actual_counts = []
-    target_counts = []
-    segments = get_time_segments_from_config()
-    
-    # Prepare segment time boundaries
-    segment_bounds = []
-    for seg in segments:
-        start = datetime.strptime(seg["start"], "%H:%M").time()
-        end = datetime.strptime(seg["end"], "%H:%M").time()
-        segment_bounds.append((start, end, seg["target"]))
-        labels.append(f"{seg['start']}-{seg['end']}")
-        actual_counts.append(0)
-        target_counts.append(seg["target"])
-
-    if os.path.exists(current_file) and os.path.getsize(current_file) > 0:
-        try:
-            df = pd.read_csv(current_file)
-            df['Time Scanned'] = pd.to_datetime(df['Time Scanned'])
-            
-            # Filter for current day's data
-            today = datetime.now().date()
-            df = df[df['Time Scanned'].dt.date == today]
-            
-            for _, row in df.iterrows():
-                scanned_time = row['Time Scanned'].time()
-                for idx, (start, end, _) in enumerate(segment_bounds):
-                    # For normal segments (e.g., 08:00-16:00)
-                    if start <= end:
-                        if start <= scanned_time <= end:
-                            actual_counts[idx] += 1
-                            break
-                    # For segments spanning across midnight (e.g., 22:00-06:00)
-                    else:
-                        if scanned_time >= start or scanned_time <= end:
-                            actual_counts[idx] += 1
-                            break
-
-        except Exception as e:
-            print(f"Error processing CSV for visual: {e}")
-            print(f"Current file: {current_file}")
-            import traceback
-            traceback.print_exc()
-            
+def parse_minutes(time_str):
+    """Minutes after midnight for an HH:MM string."""
+    time_obj = datetime.strptime(time_str, "%H:%M")
+    return time_obj.hour * 60 + time_obj.minute
+
+
+class SegmentSchedule:
+    """Time segments compiled into minute-of-day lookup tables.
+
+    A scan belongs to the first segment whose start <= time <= end (both ends
+    inclusive, to the second), and segments with end < start span midnight.
+    Every second of a minute but the first has the same owner, so two tables
+    of 1440 entries cover the day: `owners` for seconds 1-59 and `edge_owners`
+    for second 0, which still belongs to a segment ending on that minute.
+    Minutes outside every segment (a lunch break) map to -1. `planned` spreads
+    each segment's target over the minutes it owns, for pacing.
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.size = len(segments)
+        self.owners = np.full(1440, -1)
+        self.edge_owners = np.full(1440, -1)
+        # Assigned last to first so the earliest segment wins where segments overlap
+        for idx in reversed(range(self.size)):
+            start, end = parse_minutes(segments[idx]["start"]), parse_minutes(segments[idx]["end"])
+            minutes = np.arange(start, end) if start <= end else np.r_[start:1440, 0:end]
+            self.owners[minutes] = idx
+            self.edge_owners[np.r_[minutes, end]] = idx
+        self.planned = np.zeros(1440)
+        for idx, seg in enumerate(segments):
+            owned = self.owners == idx
+            if owned.any():
+                self.planned[owned] = seg["target"] / owned.sum()
+        self.cumulative_planned = np.cumsum(self.planned)
+        self.working = self.owners >= 0
+
+    def bucket(self, seconds):
+        """Segment index for each second-of-day value, -1 where no segment applies."""
+        seconds = np.asarray(seconds)
+        minutes = seconds // 60
+        return np.where(seconds % 60 == 0, self.edge_owners[minutes], self.owners[minutes])
+
+    def count(self, seconds):
+        """Number of scans per segment for an array of second-of-day values."""
+        idx = self.bucket(seconds)
+        return np.bincount(idx[idx >= 0], minlength=self.size)
+
+
+_segment_schedules = {}
+
+
+def get_segment_schedule(segments):
+    """The compiled SegmentSchedule for a list of segments, compiled once and reused until they change."""
+    key = tuple((seg["start"], seg["end"], seg["target"]) for seg in segments)
+    schedule = _segment_schedules.get(key)
+    if schedule is None:
+        if len(_segment_schedules) > 16:
+            _segment_schedules.clear()
+        schedule = _segment_schedules[key] = SegmentSchedule(segments)
+    return schedule
+
+
+def scan_seconds(stamps, day):
+    """Seconds after midnight of the 'YYYY-MM-DD HH:MM:SS' stamps that fall on `day`."""
+    if len(stamps) < SMALL_BATCH:
+        seconds = []
+        for stamp in stamps:
+            try:
+                scanned = datetime.strptime(stamp, '%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                continue
+            if scanned.date() == day:
+                seconds.append(scanned.hour * 3600 + scanned.minute * 60 + scanned.second)
+        return np.array(seconds, dtype=int)
+    import pandas as pd  # Imported on the first large batch only; it is the slowest import of the web app
+
+    times = pd.to_datetime(pd.Series(stamps), format='%Y-%m-%d %H:%M:%S', errors='coerce')
+    times = times[times.dt.normalize() == pd.Timestamp(day)]
+    return (times.dt.hour * 3600 + times.dt.minute * 60 + times.dt.second).to_numpy()
+
+
+class SegmentCounter:
+    """Process-wide per-segment and per-minute scan counts for each line's current day file.
+
+    New rows are read with CsvTail and bucketed in one vectorized step, so an
+    update costs time proportional to the scans added since the last one. The
+    counts are rebuilt from the start of the file when the segments change.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lines = {}  # line name -> [CsvTail, SegmentSchedule, segment counts, minute-of-day counts]
+
+    def update(self, line_name, path, schedule):
+        with self.lock:
+            state = self.lines.get(line_name)
+            if state is None or state[1] is not schedule:
+                state = self.lines[line_name] = [CsvTail(), schedule, np.zeros(schedule.size, dtype=int),
+                                                 np.zeros(1440, dtype=int)]
+            tail = state[0]
+            rows, reset = tail.read_new_rows(path)
+            if reset:
+                state[2][:] = 0
+                state[3][:] = 0
+            if rows:
+                column = tail.column('Time Scanned', 1)
+                stamps = [row[column] for row in rows if len(row) > column]
+                seconds = scan_seconds(stamps, datetime.now().date())
+                state[2] += schedule.count(seconds)
+                state[3] += np.bincount(seconds // 60, minlength=1440)
+            return state[2].copy(), state[3].copy()
+
+    def counts(self, line_name, path, schedule):
+        return self.update(line_name, path, schedule)[0].tolist()
+
+    def minutes(self, line_name, path, schedule):
+        """Scans in each minute of the day so far."""
+        return self.update(line_name, path, schedule)[1]
+
+
+segment_counter = SegmentCounter()
+
+
+@metrics.timed(COMPUTE_SECONDS.labels(function="process_data_for_visual"))
+def process_data_for_visual(line_name=None):
+    """Processes data from the current CSV for time series visualization using user-defined segments."""
+    line_name = get_line_settings(line_name)[0]
+    current_file = get_current_file_path(line_name)
+    segments = get_time_segments_from_config(line_name)
+    labels = [f"{seg['start']}-{seg['end']}" for seg in segments]
+    target_counts = [seg["target"] for seg in segments]
+    actual_counts = [0] * len(segments)
+
+    try:
+        actual_counts = segment_counter.counts(line_name, current_file, get_segment_schedule(segments))
+    except Exception as e:
+        logger.exception(f"Error processing CSV for visual: {e}", extra={"line": line_name, "file": current_file})
+
     return {
         "labels": labels,
         "actual_counts": actual_counts,
         "target_counts": target_counts,
-        "line_name": LINE_NAME,
+        "line_name": line_name,
         "segments": segments
     }
 
+def minute_label(minute):
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+@metrics.timed(COMPUTE_SECONDS.labels(function="compute_pace"))
+def compute_pace(line_name=None, now=None):
+    """Where the line stands against its target, from the per-minute counts and the compiled schedule.
+
+    `expected` is how many scans the target calls for by now, following the
+    segment targets' shape through the day (nothing is expected during
+    breaks). The current rate is taken over the last PACE_WINDOW working
+    minutes and projected over the working minutes left.
+    """
+    line_name, target, segments = get_line_settings(line_name)
+    schedule = get_segment_schedule(segments)
+    now = now or datetime.now()
+    minute, elapsed = now.hour * 60 + now.minute, now.second / 60
+    minutes = segment_counter.minutes(line_name, get_current_file_path(line_name), schedule)
+    actual = int(minutes.sum())
+
+    total_planned = schedule.cumulative_planned[-1]
+    planned_now = schedule.cumulative_planned[minute] - schedule.planned[minute] * (1 - elapsed)
+    if total_planned > 0:
+        expected = target * planned_now / total_planned
+    else:
+        # No segment targets: spread the target evenly over the working minutes
+        working_total = schedule.working.sum()
+        worked = schedule.working[:minute].sum() + schedule.working[minute] * elapsed
+        expected = target * worked / working_total if working_total else 0
+
+    # The last PACE_WINDOW working minutes, reaching back across a break
+    window = np.flatnonzero(schedule.working[:minute + 1])[-PACE_WINDOW:]
+    worked = len(window) - (schedule.working[minute] * (1 - elapsed))
+    rate = minutes[window].sum() / worked if worked > 0 else 0.0
+    remaining = schedule.working[minute + 1:].sum() + schedule.working[minute] * (1 - elapsed)
+    projected = actual + rate * remaining
+
+    working_minutes = np.flatnonzero(schedule.working)
+    segment = schedule.owners[minute]
+    return {
+        "line_name": line_name,
+        "time": now.strftime("%H:%M:%S"),
+        "target": target,
+        "actual": actual,
+        "expected": round(float(expected), 1),
+        "ahead": round(float(actual - expected), 1),
+        "rate_per_hour": round(float(rate) * 60, 1),
+        "projected": int(round(projected)),
+        "on_track": bool(projected >= target),
+        "segment": f"{segments[segment]['start']}-{segments[segment]['end']}" if segment >= 0 else None,
+        "remaining_minutes": round(float(remaining), 1),
+        "shift_end": minute_label(working_minutes[-1] + 1) if len(working_minutes) else None,
+    }
+
+
+@app.route("/api/pace")
+def api_pace():
+    """Live pacing for a line (?line=, default the main line): expected vs actual and projected end of day."""
+    return jsonify(compute_pace(request.args.get("line")))
+
+
 @app.route("/visual")
 def visual():
-    initial_visual_data = process_data_for_visual()
-    return render_template("visual.html", initial_data=initial_visual_data, line_name=LINE_NAME)
+    line_name = get_line_settings(request.args.get("line"))[0]
+    initial_visual_data = process_data_for_visual(line_name)
+    return render_template("visual.html", initial_data=initial_visual_data, line_name=line_name)
 
 @app.route("/visual-stream")
 def visual_stream():
-    def event_stream():
-        last_mtime = 0
-        # Send initial data
-        try:
-            initial_data = process_data_for_visual()
-            yield f"data: {json.dumps(initial_data)}\n\n"
-            _initial_file_path = get_current_file_path()
-            if os.path.exists(_initial_file_path):
-                last_mtime = os.path.getmtime(_initial_file_path)
-        except Exception as e:
-            print(f"Error sending initial visual SSE data: {e}")
-
-        while True:
-            current_file_for_stream = get_current_file_path()
-            current_mtime = 0
-            if os.path.exists(current_file_for_stream):
-                try:
-                    current_mtime = os.path.getmtime(current_file_for_stream)
-                except FileNotFoundError:
-                    current_mtime = 0
-            
-            if current_mtime != last_mtime:
-                try:
-                    data = process_data_for_visual()
-                    yield f"data: {json.dumps(data)}\n\n"
-                    last_mtime = current_mtime
-                except Exception as e:
-                    print(f"Error processing or sending visual SSE update: {e}")
-            
-            time.sleep(0.5) # Check for file modifications
-    return Response(event_stream(), mimetype="text/event-stream")
+    line_name = get_line_settings(request.args.get("line"))[0]
+    return open_stream(("visual", line_name), lambda: get_current_file_path(line_name),
+                       lambda: process_data_for_visual(line_name))
 
 @app.route("/admin", methods=["GET", "POST"])
 def admin():
-    global TARGET, LINE_NAME, TIME_SEGMENTS
+    """Show and edit the main line's settings.
+
+    A save is written to config.yaml in one atomic update, so main.py sees a
+    single change and reloads the services once; this process applies it
+    straight away through its config_store subscription.
+    """
     if request.method == "POST":
+        changes = {}
         if "target" in request.form:
             try:
                 new_target = int(request.form["target"])
-                if new_target >= 0:
-                    TARGET = new_target
-                    modify_config("target", TARGET)
-                else:
-                    return "Invalid target value (must be non-negative)", 400
             except ValueError:
                 return "Invalid target value (must be an integer)", 400
+            if new_target < 0:
+                return "Invalid target value (must be non-negative)", 400
+            changes["target"] = new_target
         if "line_name" in request.form:
             new_line_name = request.form["line_name"].strip()
-            if new_line_name:
-                LINE_NAME = new_line_name
-                modify_config("name", LINE_NAME)
-            else:
+            if not new_line_name:
                 return "Line name cannot be empty", 400
+            changes["name"] = new_line_name
         # Handle time segments
         segments = []
         idx = 0
@@ -267,19 +507,95 @@ def admin():
                         target = 0
                     segments.append({"start": start, "end": end, "target": target})
                 except ValueError as e:
-                    print(f"Error processing segment {idx}: {e}")
+                    logger.warning(f"Error processing segment {idx}: {e}")
                 idx += 1
             else:
                 break
         if segments:
-            TIME_SEGMENTS = segments
-            modify_config("time_segments", TIME_SEGMENTS)
+            changes["time_segments"] = segments
+        if changes:
+            try:
+                config_store.update(changes)
+            except ValueError as e:
+                return f"Invalid settings: {e}", 400
         return redirect(url_for("admin"))
     # For GET request, prepare segments to display in admin page
+    line_name, target, time_segments = get_line_settings()
     return render_template("admin.html", 
-                         target=TARGET, 
-                         line_name=LINE_NAME,
-                         time_segments=TIME_SEGMENTS)
+                         target=target, 
+                         line_name=line_name,
+                         time_segments=time_segments)
+
+def parse_date_arg(name, default):
+    """Read a YYYY-MM-DD query argument, raising ValueError on a malformed date."""
+    value = request.args.get(name)
+    if not value:
+        return default
+    return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+
+def get_line_args():
+    """Line names from ?line=A&line=B or ?line=A,B (empty list means all lines)."""
+    return [name for value in request.args.getlist("line") for name in value.split(",") if name]
+
+@app.route("/api/history")
+def api_history():
+    """Scan history across all day files in the data folder.
+
+    Query arguments: start, end (YYYY-MM-DD, default the last 7 days), line
+    (repeatable or comma separated, default all lines) and barcode (list every
+    scan of that barcode in the range). Per-day counts are answered from the
+    history index; hour and segment totals are aggregated from its per-minute
+    counts, using each line's current time segments.
+    """
+    today = datetime.now().date()
+    try:
+        end = parse_date_arg("end", today.strftime("%Y-%m-%d"))
+        start = parse_date_arg("start", (today - timedelta(days=6)).strftime("%Y-%m-%d"))
+    except ValueError:
+        return "Invalid date (expected YYYY-MM-DD)", 400
+    if start > end:
+        return "start must not be after end", 400
+    lines = get_line_args()
+
+    days = history_index.days(start, end, lines)
+    by_line = {}
+    minutes_by_line = {}
+    for summary, minutes in days:
+        by_line[summary["line"]] = by_line.get(summary["line"], 0) + summary["count"]
+        if summary["line"] in minutes_by_line:
+            minutes_by_line[summary["line"]] = minutes_by_line[summary["line"]] + minutes
+        else:
+            minutes_by_line[summary["line"]] = minutes
+    all_minutes = sum(minutes_by_line.values(), np.zeros(1440, dtype=np.int64))
+    by_hour = all_minutes.reshape(24, 60).sum(axis=1).tolist()
+
+    segments = {}
+    for line_name, line_minutes in minutes_by_line.items():
+        # Lines no longer in config.yaml fall back to the main line's segments
+        line_segments = get_line_settings(line_name)[2]
+        schedule = get_segment_schedule(line_segments)
+        # Minute resolution: each minute goes to the segment owning its seconds 1-59
+        owners = schedule.owners
+        counts = np.bincount(owners[owners >= 0], weights=line_minutes[owners >= 0], minlength=schedule.size)
+        segments[line_name] = [
+            {"label": f"{seg['start']}-{seg['end']}", "target": seg["target"], "count": int(count)}
+            for seg, count in zip(line_segments, counts)
+        ]
+
+    result = {
+        "start": start,
+        "end": end,
+        "lines": sorted(by_line),
+        "total": sum(by_line.values()),
+        "by_line": by_line,
+        "by_hour": by_hour,
+        "segments": segments,
+        "days": [{key: summary[key] for key in ("date", "line", "count", "first", "last")} for summary, _ in days],
+    }
+    barcode = request.args.get("barcode")
+    if barcode:
+        result["barcode_matches"] = history_index.find_barcode(barcode.strip(), start, end, lines)
+    return jsonify(result)
 
 @app.route("/rawdata")
 def rawdata():
@@ -288,20 +604,240 @@ def rawdata():
         return "Data directory not found.", 404
     
     files = [f for f in os.listdir(FOLDER_PATH) if f.endswith('.csv')]
+    # Compacted days are still offered as CSV, converted on download
+    if compaction.is_available():
+        files += [compaction.csv_path_for(f) for f in os.listdir(FOLDER_PATH) if f.endswith('.parquet')]
+        files = list(set(files))
     # Sort files, perhaps by name or modification time if desired
     files.sort(reverse=True) # Example: newest first if names are date-based
-    return render_template("rawdata.html", files=files, line_name=LINE_NAME)
+    return render_template("rawdata.html", files=files, line_name=get_line_settings()[0])
 
 @app.route("/download/<filename>")
 def download_file(filename):
     """Serves a CSV file for download from the data directory."""
     try:
         return send_from_directory(FOLDER_PATH, filename, as_attachment=True)
-    except FileNotFoundError:
+    except NotFound:
+        # A compacted day: stream it back out as CSV
+        parquet_name = compaction.parquet_path_for(filename)
+        if filename.endswith('.csv') and compaction.is_available() and parquet_name in os.listdir(FOLDER_PATH):
+            return Response(compaction.iter_csv_bytes(os.path.join(FOLDER_PATH, parquet_name)), mimetype="text/csv",
+                            headers={"Content-Disposition": f"attachment; filename={filename}"})
         return "File not found.", 404
 
+@app.route("/export")
+def export_range():
+    """Stream a date range of day files as one CSV, a gzipped CSV or a zip of day files.
+
+    Query arguments: start, end (YYYY-MM-DD, default today), line (repeatable or
+    comma separated, default all lines) and format (csv, gzip or zip). The body is
+    generated lazily, so memory use does not grow with the range. Responses carry
+    an ETag; plain CSV exports of uncompacted days also honour Range requests so
+    an interrupted download can be resumed.
+    """
+    today = datetime.now().strftime("%Y-%m-%d")
+    try:
+        start = parse_date_arg("start", today)
+        end = parse_date_arg("end", today)
+    except ValueError:
+        return "Invalid date (expected YYYY-MM-DD)", 400
+    export_format = request.args.get("format", "csv")
+    if export_format not in export.EXPORT_FORMATS:
+        return f"Invalid format (expected one of {', '.join(export.EXPORT_FORMATS)})", 400
+    sources = export.find_sources(FOLDER_PATH, start, end, get_line_args())
+    if not sources:
+        return "No data in the requested range.", 404
+
+    etag = export.export_etag(sources, export_format)
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+
+    file_name = f"export_{start}_{end}"
+    headers = {"ETag": f'"{etag}"', "Accept-Ranges": "none"}
+    if export_format == "zip":
+        headers["Content-Disposition"] = f"attachment; filename={file_name}.zip"
+        return Response(export.iter_zip(sources), mimetype="application/zip", headers=headers)
+    if export_format == "gzip":
+        headers["Content-Disposition"] = f"attachment; filename={file_name}.csv.gz"
+        return Response(export.iter_gzip(export.iter_csv(sources)), mimetype="application/gzip", headers=headers)
+
+    headers["Content-Disposition"] = f"attachment; filename={file_name}.csv"
+    length = export.csv_length(sources)
+    if length is None:
+        return Response(export.iter_csv(sources), mimetype="text/csv", headers=headers)
+    headers["Accept-Ranges"] = "bytes"
+    byte_range = request.range
+    # Ignore Range if the client's copy is from a different version of the data (If-Range)
+    if byte_range is not None and request.if_range.etag not in (None, etag):
+        byte_range = None
+    if byte_range is not None and byte_range.units == "bytes" and len(byte_range.ranges) == 1:
+        bounds = byte_range.range_for_length(length)
+        if bounds is None:
+            return Response(status=416, headers={"Content-Range": f"bytes */{length}"})
+        first, stop = bounds
+        headers["Content-Range"] = f"bytes {first}-{stop - 1}/{length}"
+        headers["Content-Length"] = str(stop - first)
+        return Response(export.iter_range(export.iter_csv(sources), first, stop - 1),
+                        status=206, mimetype="text/csv", headers=headers)
+    headers["Content-Length"] = str(length)
+    return Response(export.iter_csv(sources), mimetype="text/csv", headers=headers)
+
+@app.route("/healthz")
+def healthz():
+    """Health of this web process and, when run under main.py, of every supervised service.
+
+    Returns 503 when the supervisor reports a service down or has stopped
+    updating its status, or the scanner heartbeat shows a stale or dead line.
+    """
+    supervisor = health.read_status(health.SUPERVISOR_STATUS_PATH)
+    scanner = health.read_status(health.SCANNER_HEALTH_PATH)
+    problems = []
+    if supervisor is not None:
+        if not health.is_fresh(supervisor):
+            problems.append(f"supervisor status is {supervisor['age']}s old")
+        problems += [f"{name} is not running" for name, service in supervisor["services"].items()
+                     if not service["running"]]
+    if scanner is not None:
+        if not health.is_fresh(scanner):
+            problems.append(f"scanner heartbeat is {scanner['age']}s old")
+        problems += [f"scanner line {name} has stopped" for name, line in scanner["lines"].items()
+                     if not line["alive"]]
+    result = {
+        "status": "degraded" if problems else "ok",
+        "problems": problems,
+        "webapp": {
+            "pid": os.getpid(),
+            "uptime": round(time.time() - STARTED_AT),
+            "sse_clients": change_hub.subscriber_count(),
+        },
+        "services": supervisor["services"] if supervisor else None,
+        "scanner": scanner,
+        "forwarder": health.read_status(health.FORWARDER_HEALTH_PATH),
+        "bridge": health.read_status(health.BRIDGE_HEALTH_PATH),
+    }
+    return jsonify(result), 503 if problems else 200
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus metrics of this web process, followed by those the scanner and supervisor publish."""
+    body = metrics.REGISTRY.render() + metrics.read_textfiles()
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+def on_scan_event(event):
+    """Push a scan published by the scanner process to SSE clients without waiting for the file watcher."""
+    SCAN_EVENTS.inc()
+    change_hub.notify({event.get("file")})
+
+
+def start_scan_listener():
+    """Listen for scan events from the scanner process if the push channel is enabled."""
+    socket_path = get_socket_path(get_config())
+    if socket_path:
+        listener = ScanListener(socket_path, on_scan_event)
+        listener.start()
+        return listener
+    return None
+
+
+def shutdown_waitress(server):
+    """Make a waitress server's run() return, even with SSE clients connected.
+
+    close() alone only stops accepting, and run() keeps looping while any
+    connection is open, so the streams are ended first, the workers get to
+    finish, and every remaining socket is then closed from waitress's own
+    loop thread.
+    """
+    from waitress import wasyncore
+    from waitress.server import MultiSocketServer
+
+    change_hub.close()
+    if isinstance(server, MultiSocketServer):
+        server.close()
+        return
+    server.task_dispatcher.shutdown()
+    server.trigger.pull_trigger(lambda: wasyncore.close_all(server._map))
+
+
+def serve(stop=None):
+    """Run the web app with the server selected under `server` in config.yaml.
+
+    mode: waitress  waitress with a fixed pool of `threads` workers (the default, in requirements.txt;
+                    the threaded server is used if it is not installed)
+          threaded  Werkzeug threaded server without debug or reloader
+          dev       Flask development server with debug and reloader, only when asked for: its
+                    debugger runs code for anyone who can reach it
+    Every open SSE stream holds a waitress worker, so at most `max_streams`
+    streams are served at once (default `threads` minus STREAM_RESERVE) and
+    further wallboards get 503 and retry; the rest of the pool stays free for
+    pages and the supervisor's /healthz probe. Size `threads` for the number of
+    wallboards plus that reserve. The threaded server starts a thread per
+    connection and only limits streams when `max_streams` is set.
+
+    `stop` is given when main.py runs the web app on one of its threads
+    (`supervisor.mode: threads`): the server shuts down once it is set, dev
+    mode serves threaded because its reloader needs the main thread, and
+    config edits arrive through config_store instead of SIGHUP.
+    """
+    logs.setup_logging("webapp", get_config())
+    server_config = getattr(get_config(), 'server', None)
+    mode = getattr(server_config, 'mode', 'waitress')
+    host = getattr(server_config, 'host', '0.0.0.0')
+    port = getattr(server_config, 'port', 5000)
+    threads = getattr(server_config, 'threads', 64)
+    max_streams = getattr(server_config, 'max_streams', None)
+    if stop is not None and mode == "dev":
+        mode = "threaded"
+    change_hub.reopen()  # Closed by the previous server when main.py restarts the web app on a thread
+    # With the dev reloader only the child process that actually serves requests listens
+    listener = None
+    if mode != "dev" or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        listener = start_scan_listener()
+    # SIGHUP from main.py: reload config.yaml in place (off the signal handler, which may interrupt a lock holder)
+    if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=reload_config, daemon=True).start())
+
+    try:
+        if mode == "waitress":
+            try:
+                from waitress import create_server
+            except ImportError:
+                logger.warning("waitress is not installed, falling back to the threaded server")
+                mode = "threaded"
+            else:
+                if max_streams is None:
+                    max_streams = threads - max(1, min(STREAM_RESERVE, threads // 2))
+                change_hub.max_subscribers = max_streams
+                logger.info(f"Serving on {host}:{port} with waitress ({threads} threads, "
+                            f"at most {max_streams} SSE streams)")
+                # A lookahead of one keeps reading while a stream runs, so waitress notices a client closing it
+                server = create_server(app, host=host, port=port, threads=threads,
+                                       connection_limit=max(100, threads * 2), channel_request_lookahead=1)
+                if stop is not None:
+                    threading.Thread(target=lambda: (stop.wait(), shutdown_waitress(server)), daemon=True).start()
+                server.run()
+                return
+
+        change_hub.max_subscribers = max_streams
+        if mode == "threaded":
+            from werkzeug.serving import make_server
+            logger.info(f"Serving on {host}:{port} with the threaded server")
+            server = make_server(host, port, app, threaded=True)
+            if stop is not None:
+                threading.Thread(target=lambda: (stop.wait(), change_hub.close(), server.shutdown()),
+                                 daemon=True).start()
+            server.serve_forever()
+            server.server_close()
+            return
+
+        # The dev reloader restarts the server on config edits instead of waiting for SIGHUP
+        app.run(debug=True, host=host, port=port, extra_files=['config.yaml'])
+    finally:
+        if listener is not None:
+            listener.close()
+
+
 if __name__ == "__main__":
     # Ensure the data folder exists at startup
     if not os.path.exists(FOLDER_PATH):
         os.makedirs(FOLDER_PATH)
-    app.run(debug=True, host="0.0.0.0", port=5000)
\ No newline at end of file
+    serve()